@@ -7,11 +7,11 @@ AFFIRMATIVES = {'yes', 'True', 'true', '1', 't', 'T', 'y', 'Y', 'on', 'ON'}
 logger = logging.getLogger()
 
 
-def get_database_url():
+def get_database_url(db_addr=None, db_port=None):
     db_user = os.getenv('DB_USER')
     db_password = os.getenv('DB_PASSWORD')
-    db_addr = os.getenv('DB_ADDRESS', 'localhost')
-    db_port = os.getenv('DB_PORT', 5432)
+    db_addr = db_addr or os.getenv('DB_ADDRESS', 'localhost')
+    db_port = db_port or os.getenv('DB_PORT', 5432)
     db_name = os.getenv('DB_NAME', 'football')
     if not all((db_user, db_password, db_addr, db_port, db_name)):
         raise EnvironmentError('DB env variables unset')
@@ -22,6 +22,40 @@ def get_database_url():
     return url
 
 
+def get_replica_database_urls():
+    # DB_REPLICA_ADDRESSES=host[:port],... with the credentials and database name of the primary
+    addresses = [a.strip() for a in os.getenv('DB_REPLICA_ADDRESSES', '').split(',') if a.strip()]
+    return [get_database_url(*address.split(':', 1)) for address in addresses]
+
+
+def get_replica_retry_interval():
+    return float(os.getenv('DB_REPLICA_RETRY_INTERVAL', 30))
+
+
+def has_sql_pool_settings(workload):
+    return any(os.getenv(f'{name}_{workload.upper()}') for name in ('SQL_POOL_SIZE', 'SQL_MAX_OVERFLOW'))
+
+
+def get_sql_pool_size(workload='default'):
+    return int(os.getenv(f'SQL_POOL_SIZE_{workload.upper()}', os.getenv('SQL_POOL_SIZE', 5)))
+
+
+def get_sql_max_overflow(workload='default'):
+    return int(os.getenv(f'SQL_MAX_OVERFLOW_{workload.upper()}', os.getenv('SQL_MAX_OVERFLOW', 20)))
+
+
+def get_sql_pool_timeout():
+    return float(os.getenv('SQL_POOL_TIMEOUT', 60))
+
+
+def use_prepared_statements():
+    return os.getenv('SQL_PREPARED_STATEMENTS', 'false') in AFFIRMATIVES
+
+
+def get_prepare_threshold():
+    return int(os.getenv('SQL_PREPARE_THRESHOLD', 5))
+
+
 def get_neo4j_uri():
     return os.getenv('NEO4J_URI', 'bolt://localhost:7687')
 
@@ -48,3 +82,172 @@ def players_selection_limit():
 
 def get_maximum_path_length():
     return int(os.getenv('MAXIMUM_PATH_LENGTH', 6))
+
+
+def use_graph_engine():
+    return os.getenv('GRAPH_ENGINE_ENABLED', 'false') in AFFIRMATIVES
+
+
+def use_challenge_pool():
+    return os.getenv('CHALLENGE_POOL_ENABLED', 'false') in AFFIRMATIVES
+
+
+def get_challenge_pool_low_watermark():
+    return int(os.getenv('CHALLENGE_POOL_LOW_WATERMARK', 20))
+
+
+def get_challenge_pool_high_watermark():
+    return int(os.getenv('CHALLENGE_POOL_HIGH_WATERMARK', 100))
+
+
+def get_challenge_pool_max_keys():
+    return int(os.getenv('CHALLENGE_POOL_MAX_KEYS', 32))
+
+
+def get_challenge_generator_processes():
+    return int(os.getenv('CHALLENGE_GENERATOR_PROCESSES', os.cpu_count() or 1))
+
+
+def get_challenge_queue_size():
+    return int(os.getenv('CHALLENGE_QUEUE_SIZE', 1000))
+
+
+def get_challenge_queue_ttl():
+    return int(os.getenv('CHALLENGE_QUEUE_TTL', 3600))
+
+
+def get_maximum_batch_challenges():
+    return int(os.getenv('MAXIMUM_BATCH_CHALLENGES', 50))
+
+
+def get_hint_cache_size():
+    return int(os.getenv('HINT_CACHE_SIZE', 128))
+
+
+def get_challenge_session_ttl():
+    # without SHARED_STORE_URL sessions live in the worker that created them: with several workers (gunicorn -w,
+    # WEB_CONCURRENCY) the next calls of a session may reach another worker and get a 404
+    return int(os.getenv('CHALLENGE_SESSION_TTL', 6 * 3600))
+
+
+def get_data_version_poll_interval():
+    return float(os.getenv('DATA_VERSION_POLL_INTERVAL', 10))
+
+
+def get_candidates_cache_size():
+    return int(os.getenv('CANDIDATES_CACHE_SIZE', 64))
+
+
+def get_candidates_cache_ttl():
+    return float(os.getenv('CANDIDATES_CACHE_TTL', 3600))
+
+
+def inline_images():
+    return os.getenv('INLINE_IMAGES', 'true') in AFFIRMATIVES
+
+
+def use_search_index():
+    return os.getenv('SEARCH_INDEX_ENABLED', 'true') in AFFIRMATIVES
+
+
+def get_async_database_url():
+    return get_database_url().replace('postgresql://', 'postgresql+asyncpg://', 1)
+
+
+def get_entity_cache_size():
+    return int(os.getenv('ENTITY_CACHE_SIZE', 10000))
+
+
+def get_entity_cache_max_bytes():
+    return int(os.getenv('ENTITY_CACHE_MAX_BYTES', 64 << 20))
+
+
+def get_neo4j_max_pool_size():
+    return int(os.getenv('NEO4J_MAX_POOL_SIZE', 100))
+
+
+def get_neo4j_connection_acquisition_timeout():
+    return float(os.getenv('NEO4J_CONNECTION_ACQUISITION_TIMEOUT', 60))
+
+
+def get_neo4j_connection_timeout():
+    return float(os.getenv('NEO4J_CONNECTION_TIMEOUT', 30))
+
+
+def use_instrumentation():
+    return os.getenv('INSTRUMENTATION_ENABLED', 'true') in AFFIRMATIVES
+
+
+def get_slow_request_threshold():
+    # seconds
+    return float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 1000)) / 1000
+
+
+def use_distance_oracle():
+    return os.getenv('DISTANCE_ORACLE_ENABLED', 'false') in AFFIRMATIVES
+
+
+def get_distance_oracle_dir():
+    return os.getenv('DISTANCE_ORACLE_DIR')
+
+
+def get_distance_oracle_max_keys():
+    return int(os.getenv('DISTANCE_ORACLE_MAX_KEYS', 32))
+
+
+def get_distance_oracle_max_players():
+    return int(os.getenv('DISTANCE_ORACLE_MAX_PLAYERS', 5000))
+
+
+def get_shared_store_url():
+    # redis://host:port/db or file:///path/to/store.db, unset for local caches only
+    return os.getenv('SHARED_STORE_URL')
+
+
+def get_web_workers():
+    # number of web workers, as read by gunicorn
+    return int(os.getenv('WEB_CONCURRENCY', 1))
+
+
+def get_shared_store_max_entries():
+    return int(os.getenv('SHARED_STORE_MAX_ENTRIES', 100000))
+
+
+def get_optimal_path_cache_size():
+    return int(os.getenv('OPTIMAL_PATH_CACHE_SIZE', 10000))
+
+
+def get_optimal_path_cache_ttl():
+    return float(os.getenv('OPTIMAL_PATH_CACHE_TTL', 24 * 3600))
+
+
+def get_graph_snapshot_path():
+    return os.getenv('GRAPH_SNAPSHOT_PATH')
+
+
+def use_compression():
+    return os.getenv('COMPRESSION_ENABLED', 'true') in AFFIRMATIVES
+
+
+def get_compression_min_size():
+    return int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+
+
+def get_compression_level():
+    return int(os.getenv('COMPRESSION_LEVEL', 6))
+
+
+def use_response_cache():
+    return os.getenv('RESPONSE_CACHE_ENABLED', 'true') in AFFIRMATIVES
+
+
+def get_response_cache_size():
+    return int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+
+
+def get_response_cache_ttl():
+    return int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+
+
+def get_http_cache_max_age():
+    return int(os.getenv('HTTP_CACHE_MAX_AGE', 300))
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import typing as t
+from http import HTTPStatus
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import web_starter, factory, app_config
+from app.routes import game_async
+from app.utils import async_db, data_version, neo4j_async_client, instrumentation, compression
+
+logger = logging.getLogger()
+
+# routes served natively by the event loop; everything else goes to the flask app
+ASYNC_ROUTES = {
+    ('POST', '/api/game/challenge/validate'): game_async.validate_solution,
+}
+RESPONSE_HEADERS = [(b'content-type', b'application/json')] + [
+    (name.lower().encode(), value.encode()) for name, value in factory.CORS_HEADERS
+]
+
+
+class AsyncApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        handler = ASYNC_ROUTES.get((scope.get('method'), scope.get('path')))
+        if scope['type'] != 'http' or handler is None:
+            await self.wsgi_app(scope, receive, send)
+            return
+
+        body = await read_body(receive)
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = None
+
+        trace = instrumentation.start(f'async.{handler.__name__}')
+        try:
+            # app context for the shared helpers (data version, flask-sqlalchemy engine)
+            with self.flask_app.app_context():
+                # what the flask before_request hook does for the other routes; it may query the database
+                await asyncio.to_thread(data_version.get)
+                status, response = await handler(payload)
+        except Exception as e:
+            logger.exception(f'Error while serving {scope["path"]} -> {e}')
+            status, response = 500, None
+
+        headers = []
+        if trace is not None:
+            headers.append((b'server-timing', instrumentation.finish(trace, scope['method'], scope['path'],
+                                                                     status).encode()))
+        if response is None:
+            response = {'error': HTTPStatus(status).phrase}
+        accept_encoding = dict(scope.get('headers', ())).get(b'accept-encoding', b'').decode('latin-1')
+        await send_json(send, status, response, headers, compression.negotiate(accept_encoding))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await neo4j_async_client.close()
+                await async_db.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_json(send, status: int, payload, headers: t.List[t.Tuple[bytes, bytes]] = (),
+                    encoding: t.Optional[str] = None):
+    body = json.dumps(payload).encode()
+    headers = list(headers)
+    if encoding and len(body) >= compression.MIN_SIZE and app_config.use_compression():
+        body = compression.compress(body, encoding)
+        headers += [(b'content-encoding', encoding.encode()), (b'vary', b'Accept-Encoding')]
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': RESPONSE_HEADERS + headers + [(b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_app():
+    return AsyncApp(web_starter.create_app())
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(create_app(), port=int(8080))
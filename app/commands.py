@@ -0,0 +1,114 @@
+import click
+import sqlalchemy
+from flask import Blueprint
+
+from app import model as m
+from app.utils import data_version, rankings, distance_oracle, graph_engine, ingestion, shared_store
+
+bp = Blueprint('commands', __name__, cli_group=None)
+
+
+@bp.cli.command('init-db')
+def init_db():
+    # only missing tables are created, so on an existing database this adds the app-owned ones
+    m.db.create_all()
+    # create_all skips the indexes of tables that already exist
+    for model in (m.Militancy, m.TeamMilitancy):
+        for index in model.__table__.indexes:
+            index.create(bind=m.db.engine, checkfirst=True)
+    # nor the columns added to them: img_hash is added and filled for the images loaded before it existed
+    inspector = sqlalchemy.inspect(m.db.engine)
+    with m.db.engine.begin() as conn:
+        for model in ingestion.IMAGE_TABLES:
+            table = model.__table__
+            if 'img_hash' not in {c['name'] for c in inspector.get_columns(table.name)}:
+                conn.execute(sqlalchemy.text(f'ALTER TABLE {table.name} ADD COLUMN img_hash VARCHAR(32)'))
+            ingestion.hash_images(conn, table, only_missing=True)
+    # and the rankings, empty on a database initialized before them
+    if rankings.refresh_if_empty():
+        click.echo(f'rankings filled (data version: {data_version.bump()})')
+    click.echo('database initialized')
+
+
+@bp.cli.command('bump-data-version')
+def bump_data_version():
+    # to be run after every data reload: all workers drop their caches on their next version poll
+    version = data_version.bump()
+    click.echo(f'data version: {version}')
+
+
+@bp.cli.command('refresh-rankings')
+def refresh_rankings():
+    teams, leagues = rankings.refresh()
+    version = data_version.bump()
+    click.echo(f'rankings refreshed: {teams} teams, {leagues} leagues (data version: {version})')
+
+
+@bp.cli.command('build-distance-oracle')
+@click.option('--leagues', '-l', type=int, multiple=True, help='league filter, repeat for more leagues')
+def build_distance_oracle(leagues):
+    # to be run after every data version bump: workers ignore files built for another data version
+    from app.routes import game_utils
+
+    if not distance_oracle.DIRECTORY:
+        raise click.UsageError('DISTANCE_ORACLE_DIR is not set')
+    version = data_version.get()
+    # the graph of the app only if it is already the one of this data version
+    graph = graph_engine.graph
+    if graph_engine.graph_version != version or graph is None:
+        graph = graph_engine.load_from_neo4j()
+    key = tuple(sorted(set(leagues)))
+    candidates = game_utils.get_candidates(leagues_filter=list(key))
+    weights = distance_oracle.candidate_weights(candidates.player_ids, candidates.cum_weights)
+    matrix = distance_oracle.compute(graph, candidates.player_ids, game_utils.MAXIMUM_PATH_LENGTH, version, weights)
+    path = distance_oracle.path_for(key)
+    distance_oracle.save(matrix, path)
+    click.echo(f'distance oracle for {len(matrix)} players written to {path}')
+
+
+@bp.cli.command('export-graph-snapshot')
+@click.argument('path', required=False)
+def export_graph_snapshot(path):
+    # workers with GRAPH_SNAPSHOT_PATH set map this file instead of dumping the graph from neo4j
+    path = path or graph_engine.SNAPSHOT_PATH
+    if not path:
+        raise click.UsageError('no path given and GRAPH_SNAPSHOT_PATH is not set')
+    version = data_version.get()
+    graph = graph_engine.load_from_neo4j()
+    graph_engine.save_snapshot(graph, path, version)
+    click.echo(f'graph snapshot written to {path}: {len(graph)} players, {graph.edge_count} edges '
+               f'(data version: {version})')
+
+
+@bp.cli.command('ingest')
+@click.argument('directory', required=False)
+@click.option('--season', '-s', type=int, help='only replace this season (entities are still upserted)')
+@click.option('--skip-graph', is_flag=True, help='only load the SQL tables')
+def ingest(directory, season, skip_graph):
+    # DIRECTORY holds one CSV per table (league.csv, player.csv, militancy.csv, ...); without it, only the graph is
+    # rebuilt from the SQL data
+    if not directory and skip_graph:
+        raise click.UsageError('nothing to do: no directory given and --skip-graph set')
+    version = ingestion.ingest(directory, season, graph=not skip_graph)
+    click.echo(f'data ingested (data version: {version})')
+
+
+@bp.cli.command('generate-challenges')
+@click.option('--leagues', '-l', multiple=True,
+              help='comma separated league filter, repeat for more filters (default: no filter)')
+@click.option('--processes', '-p', type=int, help='generator processes (default: CHALLENGE_GENERATOR_PROCESSES)')
+def generate_challenges(leagues, processes):
+    # runs until interrupted, keeping the shared challenge queues of these filters full for the web workers
+    from app.utils import challenge_generator, challenge_pool
+
+    if shared_store.get_store() is None:
+        raise click.UsageError('SHARED_STORE_URL is not set')
+    try:
+        keys = [challenge_pool.normalize_key(int(i) for i in f.split(',') if i) for f in leagues] or [()]
+    except ValueError:
+        raise click.BadParameter('league filters are comma separated league ids', param_hint='--leagues')
+    # the generator loads the graph of each data version itself: the app's background load would be a second copy
+    graph_engine.stop_background_load()
+    generator = challenge_generator.Generator(keys, processes or challenge_generator.PROCESSES)
+    click.echo(f'generating challenges for {len(keys)} league filters with {generator.processes} processes')
+    generator.run()
@@ -5,26 +5,51 @@ from app import app_config
 
 logger = logging.getLogger()
 
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'PUT, GET, POST, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization'),
+    ('Access-Control-Expose-Headers',
+     'Content-Type,Content-Length,Authorization,X-Pagination,ETag,X-Challenge-Session'),
+    ('Timing-Allow-Origin', '*'),
+)
+
 
 def create_app(service_name, dev=True):
     flask_app = flask.Flask(__name__)
 
     init_config(flask_app.config)
     configure_database(flask_app)
-    configure_node4j()
+    configure_instrumentation(flask_app)
+    configure_response_cache(flask_app)
+    configure_compression(flask_app)
+    configure_node4j(flask_app)
 
-    from app.routes import game, entities
+    from app.routes import game, entities, images, health, metrics
+    from app import commands
+    from app.utils import data_version
     flask_app.register_blueprint(game.bp)
     flask_app.register_blueprint(entities.bp)
+    flask_app.register_blueprint(images.bp)
+    flask_app.register_blueprint(health.bp)
+    flask_app.register_blueprint(metrics.bp)
+    flask_app.register_blueprint(commands.bp)
+    configure_challenge_pool(flask_app)
+    configure_challenge_sessions()
+    configure_search_index(flask_app)
+    configure_rankings(flask_app)
+
+    @flask_app.before_request
+    def check_data_version():
+        if flask.request.blueprint not in (health.bp.name, metrics.bp.name):
+            data_version.get()
 
     @flask_app.after_request
     def add_headers(response):
-        response.headers.add('Content-Type', 'application/json')
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Methods', 'PUT, GET, POST, DELETE, OPTIONS')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Expose-Headers',
-                             'Content-Type,Content-Length,Authorization,X-Pagination')
+        if flask.request.blueprint not in (images.bp.name, metrics.bp.name):
+            response.headers.add('Content-Type', 'application/json')
+        for name, value in CORS_HEADERS:
+            response.headers.add(name, value)
         return response
 
     return flask_app
@@ -33,7 +58,8 @@ def create_app(service_name, dev=True):
 def init_config(config):
     config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-    url = app_config.get_database_url()
+    from app.utils import db_routing
+    url = db_routing.driver_url(app_config.get_database_url())
     config['DB_VENDOR'] = 'postgres'
     config['SQLALCHEMY_DATABASE_URI'] = url
     config['DATABASE_URI'] = url
@@ -41,8 +67,68 @@ def init_config(config):
 
 def configure_database(flask_app):
     from app.model import db
+    from app.utils import db_routing
     db.init_app(flask_app)
+    db_routing.init_app(flask_app)
+
+
+def configure_instrumentation(flask_app):
+    if not app_config.use_instrumentation():
+        return
+
+    from app.utils import instrumentation
+    instrumentation.init_app(flask_app)
+
+
+def configure_response_cache(flask_app):
+    # registered before compression, so it keeps the encoded bodies
+    if not app_config.use_response_cache():
+        return
+
+    from app.utils import response_cache
+    response_cache.init_app(flask_app)
+
+
+def configure_compression(flask_app):
+    # registered before add_headers, so it runs after it
+    if not app_config.use_compression():
+        return
+
+    from app.utils import compression
+    compression.init_app(flask_app)
+
+
+def configure_node4j(flask_app):
+    # the neo4j driver is created lazily on first use, so nothing here waits for the graph database
+    if app_config.use_graph_engine():
+        from app.utils import graph_engine
+        graph_engine.load_in_background(flask_app)
+
+
+def configure_challenge_pool(flask_app):
+    if not app_config.use_challenge_pool():
+        return
+
+    from app.utils import challenge_pool
+    from app.routes import game_utils
+    challenge_pool.init_app(flask_app, game_utils.generate_challenge_ids)
+
+
+def configure_challenge_sessions():
+    # sessions are kept in this worker without a shared store
+    if app_config.get_web_workers() > 1 and not app_config.get_shared_store_url():
+        logger.warning(f'{app_config.get_web_workers()} web workers without SHARED_STORE_URL: challenge sessions '
+                       f'created by a worker are not found by the others')
+
+
+def configure_rankings(flask_app):
+    from app.utils import rankings
+    rankings.init_app(flask_app)
+
 
+def configure_search_index(flask_app):
+    if not app_config.use_search_index():
+        return
 
-def configure_node4j():
-    from app.utils import neo4j_client
+    from app.utils import search_index
+    search_index.init_app(flask_app)
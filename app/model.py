@@ -1,17 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 
+from app.utils import db_routing
 
-db = SQLAlchemy(engine_options={
-    'pool_pre_ping': True,
-    'max_overflow': 200,
-    'pool_timeout': 60.0
-})
+# reads of the session go to the replicas (or the pool of their workload), everything else to this engine
+db = SQLAlchemy(engine_options=db_routing.engine_options(), session_options={'class_': db_routing.RoutingSession})
 
 
 class TeamMilitancy(db.Model):
     __tablename__ = 'teammilitancy'
     __table_args__ = (
         db.PrimaryKeyConstraint('team_id', 'league_id', 'year'),
+        # league of the latest season of a team
+        db.Index('ix_teammilitancy_team_id_year', 'team_id', 'year'),
     )
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
     league_id = db.Column(db.Integer, db.ForeignKey('league.id'))
@@ -23,7 +23,9 @@ class Team(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    img = db.Column(db.LargeBinary)
+    img = db.deferred(db.Column(db.LargeBinary))
+    # md5 of img, written with it: image urls and ETags never read the image itself
+    img_hash = db.Column(db.String(32))
     img_url = db.Column(db.String)
     militancy = db.relationship(TeamMilitancy, backref='team')
 
@@ -32,6 +34,8 @@ class Militancy(db.Model):
     __tablename__ = 'militancy'
     __table_args__ = (
         db.PrimaryKeyConstraint('player_id', 'team_id', 'year'),
+        # current team of a player
+        db.Index('ix_militancy_player_id_start_date', 'player_id', 'start_date'),
     )
 
     player_id = db.Column(db.Integer, db.ForeignKey('player.id'))
@@ -49,7 +53,8 @@ class Player(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     surname = db.Column(db.String)
-    img = db.Column(db.LargeBinary)
+    img = db.deferred(db.Column(db.LargeBinary))
+    img_hash = db.Column(db.String(32))
     img_url = db.Column(db.String)
     value = db.Column(db.Float, default=0)
     militancy = db.relationship(Militancy, backref='player')
@@ -60,7 +65,8 @@ class League(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     display_name = db.Column(db.String)
-    img = db.Column(db.LargeBinary)
+    img = db.deferred(db.Column(db.LargeBinary))
+    img_hash = db.Column(db.String(32))
     img_url = db.Column(db.String)
     country_code = db.Column(db.String)
     militancy = db.relationship(TeamMilitancy, backref='league')
@@ -76,3 +82,26 @@ class LeagueSeasons(db.Model):
     year = db.Column(db.Integer)
     start_date = db.Column(db.Date, default=None)
     end_date = db.Column(db.Date, default=None)
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'dataversion'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TeamRanking(db.Model):
+    __tablename__ = 'teamranking'
+
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), primary_key=True)
+    team_value = db.Column(db.Float)
+    rank = db.Column(db.Integer, index=True, unique=True)
+
+
+class LeagueRanking(db.Model):
+    __tablename__ = 'leagueranking'
+
+    league_id = db.Column(db.Integer, db.ForeignKey('league.id'), primary_key=True)
+    league_value = db.Column(db.Float)
+    rank = db.Column(db.Integer, index=True, unique=True)
@@ -1,69 +1,66 @@
+import json
 import logging
 
 import sqlalchemy
-from sqlalchemy import func, select, text, tuple_, nullslast
-from flask import jsonify, abort, Blueprint, request
+from flask import jsonify, abort, Blueprint, request, Response, stream_with_context
 from unidecode import unidecode
 
 from app import model as m
-from app.utils import common
+from app.utils import common, search_index, response_cache
 
 bp = Blueprint('players', __name__)
 logger = logging.getLogger()
 
+STREAM_BATCH_SIZE = 50
+
 
 @bp.route('/api/entities/player/<player_id>', methods=['GET'])
+@response_cache.cached
 def get_player(player_id: int):
-    player = m.db.session.query(m.Player).get(player_id)
+    try:
+        player_id = int(player_id)
+    except ValueError:
+        abort(404)
+    player = common.get_pretty_players([player_id]).get(player_id)
     if not player:
         abort(404)
 
-    return jsonify(common.get_pretty_player(player))
+    return jsonify(player)
 
 
 @bp.route('/api/entities/player/search/<query>', methods=['GET'])
+@response_cache.cached
 def player_search(query: str):
     if len(query) < 3:
         return jsonify([])
 
-    query = unidecode(query)
-    players = m.db.session.query(m.Player).order_by(m.Player.value.desc()).filter(
-        sqlalchemy.func.concat(m.Player.surname, ' ', m.Player.name).like(f'%{query}%')).limit(5).all()
-
+    index = search_index.get()
+    if index is not None:
+        player_ids = index.search(query, limit=5)
+    else:
+        # until the index is built: its results replace these as soon as it is
+        response_cache.skip()
+        query = unidecode(query)
+        player_ids = [r[0] for r in m.db.session.query(m.Player.id).order_by(m.Player.value.desc()).filter(
+            sqlalchemy.func.concat(m.Player.surname, ' ', m.Player.name).like(f'%{query}%')).limit(5).all()]
+
+    players = common.get_pretty_players(player_ids)
     return jsonify([
-        common.get_pretty_player(p) for p in players
+        players[i] for i in player_ids if i in players
     ])
 
 
 @bp.route('/api/entities/league/search/<query>', methods=['GET'])
+@response_cache.cached
 def league_search(query: str):
     if len(query) < 3:
         return jsonify([])
 
     query = unidecode(query)
 
-    leagues = select(m.League.id).filter(m.League.display_name.ilike(f'{query}%')).cte('leagues')
-    teammilitancies = select(m.TeamMilitancy).filter(
-        tuple_(m.TeamMilitancy.league_id, m.TeamMilitancy.year).in_(
-            select(m.TeamMilitancy.league_id, func.max(m.TeamMilitancy.year).label('max_year')).filter(
-                m.TeamMilitancy.league_id.in_(leagues)).group_by(m.TeamMilitancy.league_id)
-        )).cte('teammilitancies')
-    teams = select(m.Team.id).filter(m.Team.id.in_(select(teammilitancies.c.team_id)))
-    militancies = select(m.Militancy).filter(
-        tuple_(m.Militancy.team_id, m.Militancy.year).in_(
-            select(m.Militancy.team_id, func.max(m.Militancy.year).label('max_year')).filter(
-                m.Militancy.team_id.in_(teams)).group_by(m.Militancy.team_id))).cte('militancies')
-    teams_by_value = select(teams.columns.id.label('team_id'), func.sum(m.Player.value).label('team_value')
-                            ).join(militancies, teams.c.id == militancies.c.team_id, isouter=True
-                                   ).join(m.Player, militancies.c.player_id == m.Player.id, isouter=True
-                                          ).group_by(teams.c.id).cte('teams_by_value')
-    leagues_by_value = select(m.League.id, func.sum(teams_by_value.c.team_value).label('league_value')
-                              ).join(teammilitancies, m.League.id == teammilitancies.c.league_id, isouter=True
-                                     ).join(teams_by_value, teammilitancies.c.team_id == teams_by_value.c.team_id,
-                                            isouter=True).group_by(m.League.id).order_by(
-        nullslast(text('league_value DESC'))).limit(5).cte('leagues_by_value')
-
-    res = m.db.session.query(m.League).filter(m.League.id.in_(select(leagues_by_value.c.id))).all()
+    res = m.db.session.query(m.League).options(*common.image_options(m.League)).join(
+        m.LeagueRanking, m.League.id == m.LeagueRanking.league_id).filter(
+        m.League.display_name.ilike(f'{query}%')).order_by(m.LeagueRanking.rank).limit(5).all()
 
     return jsonify([
         common.get_pretty_league(r) for r in res
@@ -71,31 +68,25 @@ def league_search(query: str):
 
 
 @bp.route('/api/entities/team/search/<query>', methods=['GET'])
+@response_cache.cached
 def team_search(query: str):
     if len(query) < 3:
         return jsonify([])
 
     query = unidecode(query)
 
-    teams = select(m.Team.id).filter(m.Team.name.ilike(f'{query}%')).cte('teams')
-    militancies = select(m.Militancy).filter(
-        tuple_(m.Militancy.team_id, m.Militancy.year).in_(
-            select(m.Militancy.team_id, func.max(m.Militancy.year).label('max_year')).filter(
-                m.Militancy.team_id.in_(teams)).group_by(m.Militancy.team_id)
-        )).cte('militancies')
-    teams_by_value = select(teams.columns.id, func.sum(m.Player.value).label('team_value')
-                            ).join(militancies, teams.c.id == militancies.c.team_id, isouter=True
-                                   ).join(m.Player, militancies.c.player_id == m.Player.id, isouter=True
-                                          ).group_by(teams.c.id).order_by(nullslast(text('team_value DESC'))
-                                                                          ).limit(5).cte('teams_by_value')
-    res = m.db.session.query(m.Team).filter(m.Team.id.in_(select(teams_by_value.c.id))).all()
+    team_ids = [r[0] for r in m.db.session.query(m.Team.id).join(
+        m.TeamRanking, m.Team.id == m.TeamRanking.team_id).filter(
+        m.Team.name.ilike(f'{query}%')).order_by(m.TeamRanking.rank).limit(5).all()]
 
+    teams = common.get_pretty_teams(team_ids)
     return jsonify([
-        common.get_pretty_team(r) for r in res
+        teams[i] for i in team_ids if i in teams
     ])
 
 
 @bp.route('/api/entities/league/top-leagues', methods=['GET'])
+@response_cache.cached
 def top_leagues():
     page_number = page_size = None
     try:
@@ -103,29 +94,23 @@ def top_leagues():
         page_size = int(request.args.get('page_size', 20))
     except:
         abort(400)
+    if page_number < 1 or page_size < 1:
+        abort(400)
 
-    offset = (page_number - 1) * page_size
-    teammilitancies = select(m.TeamMilitancy).filter(
-        tuple_(m.TeamMilitancy.league_id, m.TeamMilitancy.year).in_(
-            select(m.TeamMilitancy.league_id, func.max(m.TeamMilitancy.year).label('max_year')
-                   ).group_by(m.TeamMilitancy.league_id))).cte('teammilitancies')
-    teams = select(m.Team.id).filter(m.Team.id.in_(select(teammilitancies.c.team_id)))
-    militancies = select(m.Militancy).filter(
-        tuple_(m.Militancy.team_id, m.Militancy.year).in_(
-            select(m.Militancy.team_id, func.max(m.Militancy.year).label('max_year')).filter(
-                m.Militancy.team_id.in_(teams)).group_by(m.Militancy.team_id))).cte('militancies')
-    teams_by_value = select(teams.columns.id.label('team_id'), func.sum(m.Player.value).label('team_value')
-                            ).join(militancies, teams.c.id == militancies.c.team_id, isouter=True
-                                   ).join(m.Player, militancies.c.player_id == m.Player.id, isouter=True
-                                          ).group_by(teams.c.id).cte('teams_by_value')
-    leagues_by_value = select(m.League.id, func.sum(teams_by_value.c.team_value).label('league_value')
-                              ).join(teammilitancies, m.League.id == teammilitancies.c.league_id, isouter=True
-                                     ).join(teams_by_value, teammilitancies.c.team_id == teams_by_value.c.team_id,
-                                            isouter=True).group_by(m.League.id).order_by(
-        nullslast(text('league_value DESC'))).offset(offset).limit(page_size).cte('leagues_by_value')
-
-    res = m.db.session.query(m.League).filter(m.League.id.in_(select(leagues_by_value.c.id))).all()
+    total = m.db.session.query(sqlalchemy.func.count(m.LeagueRanking.league_id)).scalar()
+    pagination = {
+        'page': page_number, 'page_size': page_size, 'total': total, 'total_pages': -(-total // page_size)
+    }
 
-    return jsonify([
-        common.get_pretty_league(r) for r in res
-    ])
+    # ranks are 1-based and contiguous, so a page is a range lookup on the rank index; rows are streamed from a
+    # server-side cursor as they are serialized
+    offset = (page_number - 1) * page_size
+    res = m.db.session.execute(
+        sqlalchemy.select(m.League).options(*common.image_options(m.League)).join(
+            m.LeagueRanking, m.League.id == m.LeagueRanking.league_id).filter(
+            m.LeagueRanking.rank > offset, m.LeagueRanking.rank <= offset + page_size).order_by(
+            m.LeagueRanking.rank).execution_options(yield_per=STREAM_BATCH_SIZE)
+    ).scalars()
+
+    return Response(stream_with_context(common.stream_json_array(common.get_pretty_league(r) for r in res)),
+                    mimetype='application/json', headers={'X-Pagination': json.dumps(pagination)})
@@ -2,9 +2,8 @@ import logging
 
 from flask import jsonify, request, abort, Blueprint
 
-from app import model as m
 from app.routes import game_utils
-from app.utils import neo4j_client, common
+from app.utils import common, challenge_pool, challenge_sessions
 
 bp = Blueprint('game', __name__)
 logger = logging.getLogger()
@@ -13,34 +12,76 @@ logger = logging.getLogger()
 @bp.route('/api/game/challenge', methods=['GET'])
 def challenge():
     leagues_filter = request.args.getlist('leagues')
+    difficulty = request.args.get('difficulty')
     try:
         leagues_filter = [int(i) for i in leagues_filter]
+        difficulty = int(difficulty) if difficulty is not None else None
     except ValueError:
         abort(400)
-    result = game_utils.generate_challenge(leagues_filter=leagues_filter)
+    if difficulty is not None and difficulty + 1 not in game_utils.challenge_lengths():
+        abort(400)
+    result = game_utils.generate_challenge(leagues_filter=leagues_filter, degrees=difficulty)
     if not result:
         abort(500)
+    player_ids = result[:2]
+
+    players = common.get_pretty_players(player_ids)
+    if len(players) != len(player_ids):
+        logger.error('Players not found in SQL DB', extra={'players': list(player_ids)})
+        abort(500)
 
     ret = [
-        common.get_pretty_player(p)
-        for p in result
+        players[p]
+        for p in player_ids
     ]
 
-    return jsonify(ret)
+    session = challenge_sessions.create(*result)
+    return jsonify(ret), {'X-Challenge-Session': session['id']}
 
 
-@bp.route('/api/game/challenge/validate', methods=['POST'])
-def validate_solution():
-    node_ids = request.get_json(silent=True)
-    if node_ids is None:
+@bp.route('/api/game/challenges', methods=['POST'])
+def challenges():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+    try:
+        count = int(body.get('count', 1))
+        leagues_filter = [int(i) for i in body.get('leagues') or []]
+        difficulty = int(body['difficulty']) if body.get('difficulty') is not None else None
+    except (TypeError, ValueError):
         abort(400)
-    if not isinstance(node_ids, list):
+    if not 0 < count <= game_utils.MAXIMUM_BATCH_CHALLENGES:
         abort(400)
-    if not all((isinstance(n, int) or isinstance(n, str) for n in node_ids)):
+    if difficulty is not None and difficulty + 1 not in game_utils.challenge_lengths():
         abort(400)
 
-    node_ids = [int(n) for n in node_ids]
-    if len(set(node_ids)) != len(node_ids):
+    result = game_utils.generate_challenge_ids(leagues_filter=leagues_filter, count=count, degrees=difficulty)
+    if not result:
+        logger.warning('Could not generate challenges - Maximum attempts reached')
+        abort(500)
+    if len(result) < count:
+        logger.warning(f'Generated {len(result)} challenges out of {count}', extra={'leagues': leagues_filter})
+
+    players = common.get_pretty_players(p for p1, p2, _ in result for p in (p1, p2))
+    ret = []
+    for p1, p2, degrees in result:
+        if p1 not in players or p2 not in players:
+            logger.error('Players not found in SQL DB', extra={'players': [p1, p2]})
+            abort(500)
+        ret.append({'players': [players[p1], players[p2]], 'optimal_degrees': degrees})
+
+    return jsonify(ret)
+
+
+@bp.route('/api/game/challenge/pool', methods=['GET'])
+def challenge_pool_stats():
+    return jsonify(challenge_pool.stats())
+
+
+@bp.route('/api/game/challenge/validate', methods=['POST'])
+def validate_solution():
+    node_ids = game_utils.parse_solution(request.get_json(silent=True))
+    if node_ids is None:
         abort(400)
 
     degrees = len(node_ids) - 2
@@ -50,83 +91,165 @@ def validate_solution():
         response['error'] = 'Exceeded degrees'
         return jsonify(response)
 
-    players = {p.id: p for p in m.db.session.query(m.Player).filter(m.Player.id.in_(node_ids)).all()}
-    if len(node_ids) != len(players):
-        logger.error('Players not found in SQL DB', extra={'players': node_ids})
-        abort(400)
-
     # checking submitted solution
-    submitted_path = []
-    for i in range(len(node_ids) - 1):
-        first_node = node_ids[i]
-        second_node = node_ids[i + 1]
-        relationship = neo4j_client.get_relationship(first_node, second_node)
-        if not relationship:
-            response['valid'] = False
-            p1 = players[first_node]
-            p2 = players[second_node]
-            response['error'] = f'{p1.name} {p1.surname} and {p2.name} {p2.surname} have not played together in the last 3 years'
-            response['players_affected'] = [common.get_pretty_player(p) for p in (p1, p2)]
-            return jsonify(response)
-
-        submitted_path.append(relationship)
-
-    team_ids = list({r['team'] for r in submitted_path})
-    teams = {team.id: team for team in m.db.session.query(m.Team).filter(m.Team.id.in_(team_ids)).all()}
-    if len(team_ids) != len(teams):
-        logger.error('Teams not found in SQL DB', extra={'teams': team_ids})
+    pairs = list(zip(node_ids, node_ids[1:]))
+    relationships = game_utils.get_graph_client().get_relationships(pairs)
+    if relationships is None:
+        logger.error('Error while checking submitted path', extra={'node_ids': node_ids})
         abort(500)
 
-    # retrieving full info of the solution's entities
-    response['submitted_solution'] = [
-        {
-            'start': common.get_pretty_player(players[rel['start']]),
-            'team': common.get_pretty_team(teams[rel['team']]),
-            'end': common.get_pretty_player(players[rel['end']])
-        }
-        for rel in submitted_path
-    ]
+    missing_edge = next((pair for pair, relationship in zip(pairs, relationships) if not relationship), None)
+    if missing_edge is not None:
+        players = common.get_pretty_players(node_ids)
+        if len(node_ids) != len(players):
+            logger.error('Players not found in SQL DB', extra={'players': node_ids})
+            abort(400)
+        response.update(game_utils.get_missing_edge_error(players[missing_edge[0]], players[missing_edge[1]]))
+        return jsonify(response)
+    submitted_path = relationships
 
     # checking if solution is optimal
     optimal_path = game_utils.get_optimal_path(node_ids[0], node_ids[-1])
     if optimal_path is None:
         logger.error('Error while getting shortest path', extra={'node_ids': node_ids})
         abort(500)
+    is_optimal = len(submitted_path) == len(optimal_path)
+
+    # retrieving full info of the solution's entities: one query for players and one for teams at most
+    player_ids = set(node_ids)
+    team_ids = {r['team'] for r in submitted_path}
+    if not is_optimal:
+        for rel in optimal_path:
+            player_ids.update((rel['start'], rel['end']))
+            team_ids.add(rel['team'])
 
-    if len(response['submitted_solution']) == len(optimal_path):
-        response['is_optimal'] = True
+    players = common.get_pretty_players(player_ids)
+    if not set(node_ids).issubset(players):
+        logger.error('Players not found in SQL DB', extra={'players': node_ids})
+        abort(400)
+    teams = common.get_pretty_teams(team_ids)
+    if len(team_ids) != len(teams):
+        logger.error('Teams not found in SQL DB', extra={'teams': list(team_ids)})
+        abort(500)
+
+    response['submitted_solution'] = game_utils.get_pretty_solution(submitted_path, players, teams)
+    response['is_optimal'] = is_optimal
+    if is_optimal:
         return jsonify(response)
-    response['is_optimal'] = False
-
-    players_to_query = []
-    teams_to_query = []
-    for rel in optimal_path:
-        for key in ('start', 'end'):
-            if rel[key] not in players:
-                players_to_query.append(rel[key])
-        if rel['team'] not in teams:
-            teams_to_query.append(rel['team'])
-
-    players.update(
-        {p.id: p for p in m.db.session.query(m.Player).filter(m.Player.id.in_(players_to_query)).all()}
-    )
-    teams.update(
-        {team.id: team for team in m.db.session.query(m.Team).filter(m.Team.id.in_(teams_to_query)).all()}
-    )
-
-    response['optimal_solution'] = [
-        {
-            'start': common.get_pretty_player(players[rel['start']]),
-            'team': common.get_pretty_team(teams[rel['team']]),
-            'end': common.get_pretty_player(players[rel['end']])
-        }
-        for rel in optimal_path
-    ]
+
+    response['optimal_solution'] = game_utils.get_pretty_solution(optimal_path, players, teams)
     response['optimal_solution_degrees'] = len(optimal_path) - 2
 
     return jsonify(response)
 
 
+@bp.route('/api/game/challenge/session/<session_id>/hop', methods=['POST', 'DELETE'])
+def session_hop(session_id: str):
+    # one edge checked per call, instead of the whole path at every submission
+    if request.method == 'DELETE':
+        def undo(session):
+            if session['path']:
+                session['path'].pop()
+            return {'valid': True, 'error': None, 'hops': len(session['path']), 'complete': False}
+        return _update_session(session_id, undo)
+
+    body = request.get_json(silent=True)
+    try:
+        player_id = int(body['player_id'])
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+
+    def hop(session):
+        # runs on the latest session: concurrent hops of a session are applied one after the other
+        if challenge_sessions.is_complete(session):
+            abort(400)
+        # a path going back to one of its players is never optimal
+        if player_id == session['players'][0] or player_id in {rel['end'] for rel in session['path']}:
+            abort(400)
+
+        response = {'valid': True, 'error': None, 'hops': len(session['path']), 'complete': False}
+        if len(session['path']) >= game_utils.MAXIMUM_PATH_LENGTH:
+            response['valid'] = False
+            response['error'] = 'Exceeded degrees'
+            return response
+
+        previous = challenge_sessions.last_player(session)
+        relationship = game_utils.get_graph_client().get_relationship(previous, player_id)
+        players = common.get_pretty_players([previous, player_id])
+        if len(players) != 2:
+            abort(400)
+        if relationship is None:
+            response.update(game_utils.get_missing_edge_error(players[previous], players[player_id]))
+            return response
+
+        teams = common.get_pretty_teams([relationship['team']])
+        if relationship['team'] not in teams:
+            logger.error('Teams not found in SQL DB', extra={'teams': [relationship['team']]})
+            abort(500)
+
+        session['path'].append(relationship)
+        response['hops'] = len(session['path'])
+        response['complete'] = challenge_sessions.is_complete(session)
+        response['hop'] = game_utils.get_pretty_solution([relationship], players, teams)[0]
+        return response
+
+    return _update_session(session_id, hop)
+
+
+def _update_session(session_id: str, change):
+    try:
+        session, response = challenge_sessions.update(session_id, change)
+    except challenge_sessions.ConflictError as e:
+        logger.warning(f'Challenge session update failed -> {e}', extra={'session': session_id})
+        abort(409)
+    if session is None:
+        abort(404)
+    return jsonify(response)
+
+
+@bp.route('/api/game/challenge/session/<session_id>/validate', methods=['POST'])
+def validate_session(session_id: str):
+    # the edges were checked hop by hop and the optimal degrees are known since the challenge was created: the
+    # optimal path is only needed to show it to a player that didn't find it
+    session = challenge_sessions.get(session_id)
+    if session is None:
+        abort(404)
+
+    submitted_path = session['path']
+    degrees = max(len(submitted_path) - 1, 0)
+    response = {'valid': True, 'error': None, 'submitted_solution_degrees': degrees}
+    if not challenge_sessions.is_complete(session):
+        response['valid'] = False
+        response['error'] = 'Incomplete solution'
+        return jsonify(response)
+
+    is_optimal = degrees == session['optimal_degrees']
+    optimal_path = []
+    if not is_optimal:
+        optimal_path = game_utils.get_optimal_path(*session['players'])
+        if optimal_path is None:
+            logger.error('Error while getting shortest path', extra={'players': session['players']})
+            abort(500)
+
+    player_ids = {rel[k] for rel in submitted_path + optimal_path for k in ('start', 'end')}
+    team_ids = {rel['team'] for rel in submitted_path + optimal_path}
+    players = common.get_pretty_players(player_ids)
+    teams = common.get_pretty_teams(team_ids)
+    if len(players) != len(player_ids) or len(teams) != len(team_ids):
+        logger.error('Solution entities not found in SQL DB', extra={'session': session_id})
+        abort(500)
+
+    response['submitted_solution'] = game_utils.get_pretty_solution(submitted_path, players, teams)
+    response['is_optimal'] = is_optimal
+    if is_optimal:
+        return jsonify(response)
+
+    response['optimal_solution'] = game_utils.get_pretty_solution(optimal_path, players, teams)
+    response['optimal_solution_degrees'] = session['optimal_degrees']
+
+    return jsonify(response)
+
+
 @bp.route('/api/game/hint', methods=['POST'])
 def hint():
     body = request.get_json(silent=True)
@@ -137,10 +260,32 @@ def hint():
         player_id = body.get('player_id')
         if not player_id:
             abort(400)
-        player = m.db.session.query(m.Player).get(player_id)
-        if not player:
+        try:
+            player_id = int(player_id)
+        except (TypeError, ValueError):
+            abort(400)
+        team_id = common.get_current_team_id(player_id)
+        if team_id is None:
+            abort(400)
+        team = common.get_pretty_teams([team_id]).get(team_id)
+        if not team:
+            abort(500)
+        return jsonify(team)
+    elif hint_type == 'next_hop':
+        try:
+            player_id = int(body['player_id'])
+            target_id = int(body['target_id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+        hop = game_utils.get_graph_client().next_hop(player_id, target_id)
+        if hop is None:
+            # same player, unknown players or too far apart
             abort(400)
-        militancy = max(player.militancy, key=lambda mi: mi.start_date)
-        return jsonify(common.get_pretty_team(militancy.team))
+        players = common.get_pretty_players([hop['end']])
+        teams = common.get_pretty_teams([hop['team']])
+        if hop['end'] not in players or hop['team'] not in teams:
+            logger.error('Hint entities not found in SQL DB', extra={'hop': hop})
+            abort(500)
+        return jsonify({'player': players[hop['end']], 'team': teams[hop['team']], 'degrees': hop['distance'] - 1})
     else:
         abort(400)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import typing as t
+
+from sqlalchemy import select
+
+from app import model as m
+from app.routes import game_utils
+from app.utils import common, async_db, neo4j_async_client, graph_engine
+
+logger = logging.getLogger()
+
+
+async def fetch_players(player_ids: t.Iterable[int]) -> t.Dict[int, t.Dict[str, t.Any]]:
+    player_ids = list(player_ids)
+    if not player_ids:
+        return {}
+    async with async_db.session() as session:
+        res = await session.execute(select(m.Player).options(*common.image_options(m.Player)).where(
+            m.Player.id.in_(player_ids)))
+        return {p.id: common.get_pretty_player(p) for p in res.scalars()}
+
+
+async def fetch_teams(team_ids: t.Iterable[int]) -> t.Dict[int, t.Dict[str, t.Any]]:
+    team_ids = list(team_ids)
+    if not team_ids:
+        return {}
+    async with async_db.session() as session:
+        res = await session.execute(common.teams_with_current_league(team_ids))
+        return {team.id: common.get_pretty_team(team, league) for team, league in res}
+
+
+# the graph engine searches and the cache lookups (data version, shared store) are blocking: they run in the default
+# executor so that they don't stall the event loop
+async def get_relationships(pairs: t.List[t.Tuple[int, int]]) -> t.Optional[t.List[t.Optional[t.Dict[str, int]]]]:
+    if graph_engine.is_loaded():
+        return await asyncio.to_thread(graph_engine.get_relationships, pairs)
+    return await neo4j_async_client.get_relationships(pairs)
+
+
+async def get_player_values() -> game_utils.PlayerValues:
+    values = game_utils.cached_player_values()
+    if values is None:
+        async with async_db.session() as session:
+            rows = (await session.execute(game_utils.PLAYER_VALUES_QUERY)).all()
+        values = await asyncio.to_thread(game_utils.cache_player_values, rows)
+    return values
+
+
+async def get_optimal_path(player_id_1: int, player_id_2: int) -> t.Optional[t.List[t.Dict[str, int]]]:
+    key = game_utils.optimal_paths_key(player_id_1, player_id_2)
+    paths = await asyncio.to_thread(game_utils.get_cached_optimal_paths, key)
+    if paths is None:
+        version = game_utils.graph_version()
+        if graph_engine.is_loaded():
+            paths = await asyncio.to_thread(graph_engine.optimal_paths, *key)
+        else:
+            records = await neo4j_async_client.shortest_path_ids(*key)
+            paths = await asyncio.to_thread(game_utils.max_weight_id_paths, records, await get_player_values())
+        if not paths:
+            return None
+        await asyncio.to_thread(game_utils.cache_optimal_paths, key, paths, version)
+
+    return game_utils.choose_optimal_path(key, paths, player_id_1)
+
+
+async def validate_solution(body: t.Any) -> t.Tuple[int, t.Optional[t.Dict[str, t.Any]]]:
+    # same contract as routes.game.validate_solution; the optimal path doesn't depend on the submitted one, so
+    # it's computed while the submitted path is being checked
+    node_ids = game_utils.parse_solution(body)
+    if node_ids is None:
+        return 400, None
+
+    degrees = len(node_ids) - 2
+    response = {'valid': True, 'error': None, 'submitted_solution_degrees': degrees}
+    if not 0 < degrees < game_utils.MAXIMUM_PATH_LENGTH:
+        response['valid'] = False
+        response['error'] = 'Exceeded degrees'
+        return 200, response
+
+    pairs = list(zip(node_ids, node_ids[1:]))
+    optimal_task = asyncio.ensure_future(get_optimal_path(node_ids[0], node_ids[-1]))
+    optimal_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        players, relationships = await asyncio.gather(fetch_players(node_ids), get_relationships(pairs))
+        if len(node_ids) != len(players):
+            logger.error('Players not found in SQL DB', extra={'players': node_ids})
+            return 400, None
+        if relationships is None:
+            logger.error('Error while checking submitted path', extra={'node_ids': node_ids})
+            return 500, None
+
+        for (first_node, second_node), relationship in zip(pairs, relationships):
+            if not relationship:
+                response.update(game_utils.get_missing_edge_error(players[first_node], players[second_node]))
+                return 200, response
+        submitted_path = relationships
+
+        optimal_path = await optimal_task
+    finally:
+        if not optimal_task.done():
+            optimal_task.cancel()
+
+    if optimal_path is None:
+        logger.error('Error while getting shortest path', extra={'node_ids': node_ids})
+        return 500, None
+    is_optimal = len(submitted_path) == len(optimal_path)
+
+    team_ids = {r['team'] for r in submitted_path}
+    players_to_query = set()
+    if not is_optimal:
+        for rel in optimal_path:
+            team_ids.add(rel['team'])
+            players_to_query.update(rel[key] for key in ('start', 'end') if rel[key] not in players)
+
+    teams, other_players = await asyncio.gather(fetch_teams(team_ids), fetch_players(players_to_query))
+    if len(team_ids) != len(teams):
+        logger.error('Teams not found in SQL DB', extra={'teams': list(team_ids)})
+        return 500, None
+    players.update(other_players)
+
+    response['submitted_solution'] = game_utils.get_pretty_solution(submitted_path, players, teams)
+    response['is_optimal'] = is_optimal
+    if is_optimal:
+        return 200, response
+
+    response['optimal_solution'] = game_utils.get_pretty_solution(optimal_path, players, teams)
+    response['optimal_solution_degrees'] = len(optimal_path) - 2
+
+    return 200, response
@@ -1,13 +1,14 @@
+import array
+import bisect
 import random
 import typing as t
 import logging
-import traceback
 
 import sqlalchemy
 from sqlalchemy import func, select
 
 from app import model as m, app_config as config
-from app.utils import neo4j_client
+from app.utils import neo4j_client, graph_engine, challenge_pool, cache, data_version, distance_oracle, shared_store
 
 logger = logging.getLogger()
 
@@ -16,10 +17,70 @@ MINIMUM_PLAYER_VALUE_WITH_LEAGUES_FILTER = config.get_minimum_player_value_with_
 PLAYERS_SELECTION_LIMIT = config.players_selection_limit()
 MAXIMUM_PATH_LENGTH = config.get_maximum_path_length()
 CHALLENGE_GENERATION_ATTEMPTS = 10
+# an exact length is rarer than any length in range: more graph searches are allowed without the distance oracle
+DIFFICULTY_GENERATION_ATTEMPTS = 30
+# batch generation spreads the same number of candidate pairs per challenge over a few graph queries
+BATCH_GENERATION_ROUNDS = 3
+MAXIMUM_BATCH_CHALLENGES = config.get_maximum_batch_challenges()
+USE_DISTANCE_ORACLE = config.use_distance_oracle()
 
+OPTIMAL_PATH_CACHE_TTL = config.get_optimal_path_cache_ttl()
 
-def select_players_for_challenge(leagues_filter: t.List[int] = None
-                                 ) -> t.Tuple[t.Optional[m.Player], t.Optional[m.Player]]:
+_candidates_cache = cache.TTLCache(maxsize=config.get_candidates_cache_size(), ttl=config.get_candidates_cache_ttl())
+# shortest max weight paths by unordered player pair, oriented from the lowest id
+_optimal_paths_cache = cache.TTLCache(maxsize=config.get_optimal_path_cache_size(), ttl=OPTIMAL_PATH_CACHE_TTL)
+_player_values_cache = cache.TTLCache(maxsize=1)
+
+
+class CandidateSet:
+    def __init__(self, player_ids: t.List[int], player_values: t.List[float]):
+        self.player_ids = player_ids
+        self.cum_weights = []
+        total = 0.0
+        for value in player_values:
+            total += value
+            self.cum_weights.append(total)
+
+    @classmethod
+    def from_cum_weights(cls, player_ids: t.Sequence[int], cum_weights: t.Sequence[float]) -> 'CandidateSet':
+        # e.g. over arrays shared with another process
+        candidates = cls.__new__(cls)
+        candidates.player_ids = player_ids
+        candidates.cum_weights = cum_weights
+        return candidates
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def sample(self, k: int = 1) -> t.List[int]:
+        # weighted by player value, with replacement
+        total = self.cum_weights[-1]
+        last = len(self.player_ids) - 1
+        return [
+            self.player_ids[min(bisect.bisect_right(self.cum_weights, random.random() * total), last)]
+            for _ in range(k)
+        ]
+
+
+def get_graph_client():
+    # the in-memory engine exposes the same functions as neo4j_client
+    if graph_engine.is_loaded():
+        return graph_engine
+    return neo4j_client
+
+
+def get_candidates(leagues_filter: t.List[int] = None) -> CandidateSet:
+    data_version.get()
+    key = tuple(sorted(set(leagues_filter or ())))
+    candidates = _candidates_cache.get(key)
+    if candidates is None:
+        candidates = CandidateSet(*query_candidate_players(leagues_filter=list(key)))
+        _candidates_cache.set(key, candidates)
+
+    return candidates
+
+
+def query_candidate_players(leagues_filter: t.List[int] = None) -> t.Tuple[t.List[int], t.List[float]]:
     if leagues_filter:
         minimum_player_value = MINIMUM_PLAYER_VALUE_WITH_LEAGUES_FILTER
 
@@ -59,49 +120,285 @@ def select_players_for_challenge(leagues_filter: t.List[int] = None
     player_ids = [r[0] for r in high_value_players]
     player_values = [r[1] for r in high_value_players]
 
-    for _ in range(CHALLENGE_GENERATION_ATTEMPTS):
-        p1, p2 = random.choices(player_ids, weights=player_values, k=2)
+    return player_ids, player_values
+
+
+def challenge_lengths(degrees: t.Optional[int] = None) -> t.Sequence[int]:
+    # shortest path lengths accepted for a challenge; degrees, as in a validated answer, is the length - 1
+    if degrees is None:
+        return range(3, MAXIMUM_PATH_LENGTH + 1)
+    return [degrees + 1]
+
+
+def get_distance_oracle(leagues_filter: t.List[int], candidates: CandidateSet
+                        ) -> t.Optional[distance_oracle.DistanceMatrix]:
+    if not USE_DISTANCE_ORACLE or not candidates:
+        return None
+    key = tuple(sorted(set(leagues_filter or ())))
+    return distance_oracle.get(key, candidates.player_ids, candidates.cum_weights, MAXIMUM_PATH_LENGTH,
+                               data_version.get())
+
+
+def pick_challenge_pair(candidates: CandidateSet, attempts: int = CHALLENGE_GENERATION_ATTEMPTS,
+                        degrees: t.Optional[int] = None, oracle: t.Optional[distance_oracle.DistanceMatrix] = None
+                        ) -> t.Optional[t.Tuple[int, int, int]]:
+    if not candidates:
+        return None
+
+    lengths = challenge_lengths(degrees)
+    if oracle is not None:
+        # no graph query: the partner is drawn among the candidates at an accepted distance
+        for _ in range(attempts):
+            p1 = candidates.sample()[0]
+            partner = oracle.pick_partner(p1, lengths)
+            if partner is not None:
+                p2, length = partner
+                return p1, p2, length - 1
+        return None
+
+    graph_client = get_graph_client()
+    for _ in range(attempts):
+        p1, p2 = candidates.sample(k=2)
+        # neo4j's shortestPath fails on a path from a node to itself
+        if p1 == p2:
+            continue
+
+        length = graph_client.get_challenge_path_length(p1, p2, MAXIMUM_PATH_LENGTH)
+        if length is not None and length in lengths:
+            # same meaning as the submitted_solution_degrees of a validated answer
+            return p1, p2, length - 1
+
+    return None
+
+
+def pick_challenge_pairs(candidates: CandidateSet, count: int, degrees: t.Optional[int] = None,
+                         oracle: t.Optional[distance_oracle.DistanceMatrix] = None) -> t.List[t.Tuple[int, int, int]]:
+    # up to count distinct challenges; without the oracle, sampled pairs are checked in batched graph queries
+    if not candidates:
+        return []
 
-        if neo4j_client.validate_path_for_challenge_creation(p1, p2, MAXIMUM_PATH_LENGTH):
-            p1 = m.db.session.query(m.Player).get(p1)
-            p2 = m.db.session.query(m.Player).get(p2)
+    res = []
+    seen = set()
+    attempts = CHALLENGE_GENERATION_ATTEMPTS if degrees is None else DIFFICULTY_GENERATION_ATTEMPTS
+    if oracle is not None:
+        for _ in range(count * attempts):
+            if len(res) >= count:
+                break
+            pair = pick_challenge_pair(candidates, 1, degrees, oracle)
+            if pair is not None and frozenset(pair[:2]) not in seen:
+                seen.add(frozenset(pair[:2]))
+                res.append(pair)
+        return res
+
+    lengths = challenge_lengths(degrees)
+    graph_client = get_graph_client()
+    for _ in range(BATCH_GENERATION_ROUNDS):
+        missing = count - len(res)
+        if missing <= 0:
+            break
+        # enough pairs for the expected success rate of a single challenge, deduplicated before querying
+        batch = []
+        for _ in range(missing * attempts // BATCH_GENERATION_ROUNDS + 1):
+            p1, p2 = candidates.sample(k=2)
+            key = frozenset((p1, p2))
+            if p1 != p2 and key not in seen:
+                seen.add(key)
+                batch.append((p1, p2))
+
+        for (p1, p2), length in zip(batch, graph_client.get_challenge_path_lengths(batch, MAXIMUM_PATH_LENGTH)):
+            if length is not None and length in lengths and len(res) < count:
+                res.append((p1, p2, length - 1))
+
+    return res
 
-            return p1, p2
 
-    return None, None
+def generate_challenge_ids(leagues_filter: t.List[int] = None, count: int = 1, degrees: t.Optional[int] = None
+                           ) -> t.List[t.Tuple[int, int, int]]:
+    candidates = get_candidates(leagues_filter=leagues_filter)
+    return pick_challenge_pairs(candidates, count, degrees, get_distance_oracle(leagues_filter, candidates))
 
 
-def generate_challenge(leagues_filter: t.List = None) -> t.Optional[t.Tuple[m.Player, m.Player]]:
-    p1, p2 = select_players_for_challenge(leagues_filter=leagues_filter)
-    if not all((p1, p2)):
+def generate_challenge(leagues_filter: t.List = None, degrees: t.Optional[int] = None
+                       ) -> t.Optional[t.Tuple[int, int, int]]:
+    # pooled challenges have any difficulty
+    pair = challenge_pool.pop(leagues_filter) if degrees is None else None
+    if pair is None:
+        candidates = get_candidates(leagues_filter=leagues_filter)
+        attempts = CHALLENGE_GENERATION_ATTEMPTS if degrees is None else DIFFICULTY_GENERATION_ATTEMPTS
+        pair = pick_challenge_pair(candidates, attempts, degrees, get_distance_oracle(leagues_filter, candidates))
+    if pair is None:
         logger.warning('Could not generate challenge - Maximum attempts reached')
         return None
 
-    return p1, p2
+    return pair
 
 
-def get_optimal_path(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]
-                     ) -> t.Optional[t.List[t.Dict[str, int]]]:
-    records = neo4j_client.shortest_path(player_id_1, player_id_2)
-    if not records:
+def parse_solution(body: t.Any) -> t.Optional[t.List[int]]:
+    if body is None:
+        return None
+    if not isinstance(body, list):
+        return None
+    if not all((isinstance(n, int) or isinstance(n, str) for n in body)):
         return None
-    max_weight = max([r[1] for r in records])
-    records = [r for r in records if r[1] == max_weight]
-    pick = random.choice(records)
 
-    res = []
     try:
-        for rel in pick[0].relationships:
-            res.append({
-                'start': int(rel.start_node._properties['playerId']),
-                'team': int(rel._properties['team_id']),
-                'end': int(rel.end_node._properties['playerId']),
-            })
-    except Exception as e:
-        stack_trace = traceback.format_exc()
-        logger.error(f'Error while getting shortest path -> {e}', extra={
-            'start': player_id_1, 'end': player_id_2, 'stacktrace': stack_trace
-        })
+        node_ids = [int(n) for n in body]
+    except ValueError:
+        return None
+    if len(set(node_ids)) != len(node_ids):
         return None
 
+    return node_ids
+
+
+def get_missing_edge_error(p1: t.Dict[str, t.Any], p2: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    return {
+        'valid': False,
+        'error': f'{p1["name"]} and {p2["name"]} have not played together in the last 3 years',
+        'players_affected': [p1, p2]
+    }
+
+
+def get_pretty_solution(path: t.List[t.Dict[str, int]], players: t.Dict[int, t.Dict[str, t.Any]],
+                        teams: t.Dict[int, t.Dict[str, t.Any]]) -> t.List[t.Dict[str, t.Any]]:
+    return [
+        {
+            'start': players[rel['start']],
+            'team': teams[rel['team']],
+            'end': players[rel['end']]
+        }
+        for rel in path
+    ]
+
+
+def orient_path(path: t.List[t.Dict[str, int]], player_id: int) -> t.List[t.Dict[str, int]]:
+    # relationships in walking order from player_id: neo4j returns them in their stored direction
+    res = []
+    for rel in path:
+        if rel['start'] != player_id:
+            rel = {'start': rel['end'], 'team': rel['team'], 'end': rel['start']}
+        res.append(rel)
+        player_id = rel['end']
     return res
+
+
+def reverse_path(path: t.List[t.Dict[str, int]]) -> t.List[t.Dict[str, int]]:
+    return [{'start': rel['end'], 'team': rel['team'], 'end': rel['start']} for rel in reversed(path)]
+
+
+class PlayerValues:
+    """Player values by id, from SQL: weights of the paths found by neo4j without reading node properties."""
+
+    def __init__(self, rows: t.Iterable[t.Tuple[int, t.Optional[float]]]):
+        # rows sorted by id
+        self.player_ids = array.array('i')
+        self.values = array.array('d')
+        for player_id, value in rows:
+            self.player_ids.append(player_id)
+            self.values.append(value or 0.0)
+
+    def get(self, player_id: int) -> float:
+        i = bisect.bisect_left(self.player_ids, player_id)
+        if i < len(self.player_ids) and self.player_ids[i] == player_id:
+            return self.values[i]
+        return 0.0
+
+
+PLAYER_VALUES_QUERY = select(m.Player.id, m.Player.value).order_by(m.Player.id)
+
+
+def cached_player_values() -> t.Optional[PlayerValues]:
+    return _player_values_cache.get(None)
+
+
+def cache_player_values(rows: t.Iterable[t.Tuple[int, t.Optional[float]]]) -> PlayerValues:
+    values = PlayerValues(rows)
+    _player_values_cache.set(None, values)
+    return values
+
+
+def get_player_values() -> PlayerValues:
+    values = cached_player_values()
+    if values is None:
+        values = cache_player_values(m.db.session.execute(PLAYER_VALUES_QUERY))
+    return values
+
+
+def max_weight_id_paths(records: t.List[t.Tuple[t.List[int], t.List[int]]], values: PlayerValues
+                        ) -> t.Optional[t.List[t.List[t.Dict[str, int]]]]:
+    # every max weight path among the shortest ones, as relationships in walking order
+    if not records:
+        return None
+    weights = [sum(values.get(player_id) for player_id in player_ids) for player_ids, _ in records]
+    max_weight = max(weights)
+
+    return [
+        [
+            {'start': player_ids[k], 'team': team_ids[k], 'end': player_ids[k + 1]}
+            for k in range(len(team_ids))
+        ]
+        for (player_ids, team_ids), weight in zip(records, weights) if weight == max_weight
+    ]
+
+
+def optimal_paths(player_id_1: int, player_id_2: int) -> t.Optional[t.List[t.List[t.Dict[str, int]]]]:
+    if graph_engine.is_loaded():
+        return graph_engine.optimal_paths(player_id_1, player_id_2)
+    return max_weight_id_paths(neo4j_client.shortest_path_ids(player_id_1, player_id_2), get_player_values())
+
+
+def graph_version() -> t.Optional[int]:
+    # data version of the in-memory graph, read before using it (load() sets the graph first); None when neo4j
+    # serves the paths
+    version = graph_engine.graph_version
+    return version if graph_engine.is_loaded() else None
+
+
+def optimal_paths_key(player_id_1: int, player_id_2: int) -> t.Tuple[int, int]:
+    return min(player_id_1, player_id_2), max(player_id_1, player_id_2)
+
+
+def shared_optimal_paths_key(key: t.Tuple[int, int]) -> str:
+    # entries of older data versions are never read again and expire with their ttl
+    return f'optimal-paths:{data_version.get()}:{key[0]}:{key[1]}'
+
+
+def get_cached_optimal_paths(key: t.Tuple[int, int]) -> t.Optional[t.List[t.List[t.Dict[str, int]]]]:
+    paths = _optimal_paths_cache.get(key)
+    if paths is None and shared_store.get_store() is not None:
+        paths = shared_store.get(shared_optimal_paths_key(key))
+        if paths is not None:
+            _optimal_paths_cache.set(key, paths)
+    return paths
+
+
+def cache_optimal_paths(key: t.Tuple[int, int], paths: t.List[t.List[t.Dict[str, int]]], version: t.Optional[int]):
+    # paths computed on a graph still being reloaded for the current data version are the previous version's:
+    # served, but cached by neither cache
+    if version is not None and version != data_version.get():
+        return
+    _optimal_paths_cache.set(key, paths)
+    if shared_store.get_store() is not None:
+        shared_store.put(shared_optimal_paths_key(key), paths, OPTIMAL_PATH_CACHE_TTL)
+
+
+def choose_optimal_path(key: t.Tuple[int, int], paths: t.List[t.List[t.Dict[str, int]]], player_id_1: int
+                        ) -> t.List[t.Dict[str, int]]:
+    # cached paths start from the lowest player id; the tie is broken on every request
+    path = random.choice(paths)
+    return path if player_id_1 == key[0] else reverse_path(path)
+
+
+def get_optimal_path(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]
+                     ) -> t.Optional[t.List[t.Dict[str, int]]]:
+    player_id_1, player_id_2 = int(player_id_1), int(player_id_2)
+    key = optimal_paths_key(player_id_1, player_id_2)
+    paths = get_cached_optimal_paths(key)
+    if paths is None:
+        version = graph_version()
+        paths = optimal_paths(*key)
+        if not paths:
+            return None
+        cache_optimal_paths(key, paths, version)
+
+    return choose_optimal_path(key, paths, player_id_1)
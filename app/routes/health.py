@@ -0,0 +1,53 @@
+import logging
+
+from flask import jsonify, Blueprint
+from sqlalchemy import text
+
+from app import model as m
+from app.utils import neo4j_client, graph_engine
+
+bp = Blueprint('health', __name__)
+logger = logging.getLogger()
+
+
+def sql_pool_state():
+    pool = m.db.engine.pool
+    state = {'status': pool.status()}
+    for key in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, key):
+            state[key] = getattr(pool, key)()
+    return state
+
+
+@bp.route('/health/live', methods=['GET'])
+def live():
+    # the process is up and serving: no dependency is checked here
+    return jsonify({'status': 'ok'})
+
+
+@bp.route('/health/ready', methods=['GET'])
+def ready():
+    sql_ok = neo4j_ok = True
+    try:
+        with m.db.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+    except Exception as e:
+        logger.warning(f'Readiness: SQL DB unavailable -> {e}')
+        sql_ok = False
+
+    try:
+        neo4j_client.get_driver().verify_connectivity()
+    except Exception as e:
+        logger.warning(f'Readiness: neo4j unavailable -> {e}')
+        neo4j_ok = False
+
+    # with the graph loaded in memory the game endpoints don't need neo4j
+    is_ready = sql_ok and (neo4j_ok or graph_engine.is_loaded())
+    response = jsonify({
+        'status': 'ok' if is_ready else 'unavailable',
+        'sql': {'ok': sql_ok, 'pool': sql_pool_state()},
+        'neo4j': {'ok': neo4j_ok, 'pool': neo4j_client.pool_state()},
+        'graph_engine': {'loaded': graph_engine.is_loaded()},
+    })
+    response.status_code = 200 if is_ready else 503
+    return response
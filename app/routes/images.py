@@ -0,0 +1,56 @@
+import logging
+
+from flask import abort, Blueprint, request, Response
+
+from app import model as m
+
+bp = Blueprint('images', __name__)
+logger = logging.getLogger()
+
+IMAGE_MODELS = {'player': m.Player, 'team': m.Team, 'league': m.League}
+MAX_AGE = 365 * 24 * 3600
+SIGNATURES = (
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'<svg', 'image/svg+xml'),
+    (b'<?xml', 'image/svg+xml'),
+)
+
+
+def guess_mimetype(img: bytes) -> str:
+    if img[:4] == b'RIFF' and img[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mimetype in SIGNATURES:
+        if img.startswith(signature):
+            return mimetype
+    return 'application/octet-stream'
+
+
+def cacheable(response: Response, img_hash: str) -> Response:
+    # urls carry the content hash, so a given url never changes content
+    response.set_etag(img_hash)
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/api/img/<kind>/<int:entity_id>', methods=['GET'])
+def get_image(kind: str, entity_id: int):
+    model = IMAGE_MODELS.get(kind)
+    if model is None:
+        abort(404)
+
+    img_hash = m.db.session.query(model.img_hash).filter(model.id == entity_id).scalar()
+    if not img_hash:
+        abort(404)
+
+    if img_hash in request.if_none_match:
+        return cacheable(Response(status=304), img_hash)
+
+    img = m.db.session.query(model.img).filter(model.id == entity_id).scalar()
+    if not img:
+        abort(404)
+
+    return cacheable(Response(img, mimetype=guess_mimetype(img)), img_hash)
@@ -0,0 +1,59 @@
+from flask import Blueprint, Response
+
+from app.utils import instrumentation, neo4j_client, challenge_pool, cache, response_cache, db_routing
+
+bp = Blueprint('metrics', __name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def gauges():
+    pools = db_routing.pool_stats()
+    lines = ['# TYPE app_sql_pool_connections gauge']
+    for pool in pools:
+        for key in ('size', 'checkedout', 'overflow'):
+            lines.append(f'app_sql_pool_connections{{pool="{pool["pool"]}",state="{key}"}} {pool[key]}')
+    for name, key in (('app_sql_pool_checkouts_total', 'checkouts'), ('app_sql_pool_timeouts_total', 'timeouts'),
+                      ('app_sql_pool_wait_seconds_total', 'wait_time')):
+        lines.append(f'# TYPE {name} counter')
+        for pool in pools:
+            lines.append(f'{name}{{pool="{pool["pool"]}"}} {pool[key]}')
+
+    lines.append('# TYPE app_neo4j_pool_connections gauge')
+    for address, connections in neo4j_client.pool_state()['connections'].items():
+        for key in ('total', 'in_use'):
+            lines.append(f'app_neo4j_pool_connections{{address="{address}",state="{key}"}} {connections[key]}')
+
+    cache_stats = cache.stats()
+    lines.append('# TYPE app_cache_entries gauge')
+    lines.append(f'app_cache_entries {cache_stats["entries"]}')
+    # only counted for the caches bounded in bytes
+    lines.append('# TYPE app_cache_bytes gauge')
+    lines.append(f'app_cache_bytes {cache_stats["bytes"]}')
+    lines.append('# TYPE app_cache_lookups_total counter')
+    lines.append(f'app_cache_lookups_total{{result="hit"}} {cache_stats["hits"]}')
+    lines.append(f'app_cache_lookups_total{{result="miss"}} {cache_stats["misses"]}')
+
+    if response_cache.is_enabled():
+        stats = response_cache.stats()
+        lines.append('# TYPE app_response_cache_entries gauge')
+        lines.append(f'app_response_cache_entries {stats["entries"]}')
+        lines.append('# TYPE app_response_cache_lookups_total counter')
+        for result in ('hit', 'shared_hit', 'miss', 'not_modified'):
+            lines.append(f'app_response_cache_lookups_total{{result="{result}"}} {stats[result]}')
+
+    if challenge_pool.is_enabled():
+        stats = challenge_pool.stats()
+        lines.append('# TYPE app_challenge_pool_depth gauge')
+        lines.append(f'app_challenge_pool_depth {stats["depth"]}')
+        lines.append('# TYPE app_challenge_pool_lookups_total counter')
+        lines.append(f'app_challenge_pool_lookups_total{{result="hit"}} {stats["hits"]}')
+        lines.append(f'app_challenge_pool_lookups_total{{result="miss"}} {stats["misses"]}')
+    return lines
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    # per process: every worker reports its own counters
+    lines = instrumentation.metrics.render() + gauges()
+    return Response('\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
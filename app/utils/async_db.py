@@ -0,0 +1,27 @@
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app import app_config
+from app.utils import instrumentation
+
+_engine = None
+_sessionmaker = None
+
+
+def session() -> AsyncSession:
+    # one session per concurrent query: an AsyncSession can't run two statements at the same time
+    global _engine, _sessionmaker
+    if _sessionmaker is None:
+        _engine = create_async_engine(app_config.get_async_database_url(), pool_pre_ping=True,
+                                      pool_size=app_config.get_sql_pool_size('async'),
+                                      max_overflow=app_config.get_sql_max_overflow('async'),
+                                      pool_timeout=app_config.get_sql_pool_timeout())
+        instrumentation.instrument_engine(_engine.sync_engine)
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    return _sessionmaker()
+
+
+async def dispose():
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _sessionmaker = None
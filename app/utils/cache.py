@@ -0,0 +1,88 @@
+import collections
+import threading
+import time
+import typing as t
+import weakref
+
+_MISSING = object()
+
+# every cache holding data derived from the dataset, so that a data refresh can drop them all at once
+_registry: 't.MutableSet[TTLCache]' = weakref.WeakSet()
+# callbacks for derived structures that are rebuilt rather than dropped
+_listeners: t.List[t.Callable[[], None]] = []
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: t.Optional[float] = None, maxbytes: t.Optional[int] = None,
+                 sizeof: t.Optional[t.Callable[[t.Any], int]] = None):
+        # with maxbytes, entries are also evicted once the sizes given by sizeof add up to more than it
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data: t.Dict[t.Hashable, t.Tuple[float, t.Any, int]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        _registry.add(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: t.Hashable, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and self.ttl is not None and item[0] + self.ttl < time.monotonic():
+                del self._data[key]
+                self.bytes -= item[2]
+                item = _MISSING
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: t.Hashable, value):
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._data[key] = (time.monotonic(), value, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def pop(self, key: t.Hashable, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            if item is not _MISSING:
+                self.bytes -= item[2]
+        return default if item is _MISSING else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+
+def on_invalidate(callback: t.Callable[[], None]):
+    _listeners.append(callback)
+
+
+def invalidate_all():
+    for cache in list(_registry):
+        cache.clear()
+    for callback in list(_listeners):
+        callback()
+
+
+def stats() -> t.Dict[str, int]:
+    caches = list(_registry)
+    return {
+        'caches': len(caches), 'entries': sum(len(c) for c in caches), 'bytes': sum(c.bytes for c in caches),
+        'hits': sum(c.hits for c in caches), 'misses': sum(c.misses for c in caches)
+    }
@@ -0,0 +1,165 @@
+import array
+import logging
+import multiprocessing
+import time
+import typing as t
+from multiprocessing import shared_memory
+
+from app import app_config
+from app.utils import challenge_pool, data_version, graph_engine, shared_store
+
+logger = logging.getLogger()
+
+PROCESSES = app_config.get_challenge_generator_processes()
+QUEUE_SIZE = app_config.get_challenge_queue_size()
+# queues of an old data version are never read again: they expire
+QUEUE_TTL = app_config.get_challenge_queue_ttl()
+BATCH_SIZE = 50
+IDLE_INTERVAL = 1.0
+
+# (shared memory block name, typecode, length)
+ArraySpec = t.Tuple[str, str, int]
+
+# in the generator processes: the attached blocks (kept open for the views over them) and the candidates per key
+_blocks: t.List[shared_memory.SharedMemory] = []
+_candidates: t.Dict[challenge_pool.PoolKey, t.Any] = {}
+
+
+class SharedArrays:
+    """Arrays copied into shared memory blocks, created and unlinked by the parent process."""
+
+    def __init__(self):
+        self.blocks: t.List[shared_memory.SharedMemory] = []
+
+    def share(self, values: t.Sequence, typecode: str) -> ArraySpec:
+        # arrays and memoryviews of the right type are copied as bytes, anything else goes through an array
+        if not (isinstance(values, (array.array, memoryview)) and memoryview(values).format == typecode):
+            values = array.array(typecode, values)
+        data = memoryview(values).cast('B')
+        block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        block.buf[:len(data)] = data
+        self.blocks.append(block)
+        return block.name, typecode, len(values)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def _attach(spec: ArraySpec) -> memoryview:
+    name, typecode, length = spec
+    block = shared_memory.SharedMemory(name=name)
+    _blocks.append(block)
+    return block.buf[:length * array.array(typecode).itemsize].cast(typecode)
+
+
+def _init_process(graph_specs: t.List[ArraySpec],
+                  candidate_specs: t.Dict[challenge_pool.PoolKey, t.Tuple[ArraySpec, ArraySpec]]):
+    # the graph engine of this process runs on the shared arrays: nothing is copied per process
+    from app.routes import game_utils
+
+    graph_engine.graph = graph_engine.PlayedWithGraph(*(_attach(spec) for spec in graph_specs))
+    for key, (ids_spec, weights_spec) in candidate_specs.items():
+        _candidates[key] = game_utils.CandidateSet.from_cum_weights(_attach(ids_spec), _attach(weights_spec))
+
+
+def _generate(task: t.Tuple[challenge_pool.PoolKey, int]
+              ) -> t.Tuple[challenge_pool.PoolKey, t.List[challenge_pool.Challenge]]:
+    from app.routes import game_utils
+
+    key, count = task
+    return key, game_utils.pick_challenge_pairs(_candidates[key], count)
+
+
+class Generator:
+    """Fills the shared challenge queues of some leagues filters with a pool of processes.
+
+    The graph and the candidates of the current data version are copied once into shared memory; every process
+    samples and checks pairs on them, and the parent publishes the challenges to the shared store, where the
+    challenge pools of the web workers take them.
+    """
+
+    def __init__(self, keys: t.Iterable[challenge_pool.PoolKey], processes: int = PROCESSES,
+                 batch_size: int = BATCH_SIZE):
+        self.requested_keys = list(dict.fromkeys(keys))
+        # the requested keys with candidates in the current data version
+        self.keys: t.List[challenge_pool.PoolKey] = []
+        self.processes = processes
+        self.batch_size = batch_size
+        self.version: t.Optional[int] = None
+        self.arrays: t.Optional[SharedArrays] = None
+        self.pool = None
+
+    def start(self, version: int):
+        from app.routes import game_utils
+
+        start = time.perf_counter()
+        # the graph may already be there, loaded by the background load of the app before it was stopped
+        if graph_engine.graph is None or graph_engine.graph_version != version:
+            graph_engine.load(version)
+        graph = graph_engine.graph
+        self.arrays = SharedArrays()
+        graph_specs = [self.arrays.share(values, typecode) for values, typecode in (
+            (graph.node_ids, 'i'), (graph.values, 'd'), (graph.offsets, 'q'), (graph.neighbors, 'i'),
+            (graph.team_ids, 'i'))]
+        # the processes have their own copy of the graph engine: this one isn't used anymore
+        graph_engine.graph = None
+
+        candidate_specs = {}
+        for key in self.requested_keys:
+            candidates = game_utils.get_candidates(leagues_filter=list(key))
+            if not candidates:
+                logger.warning('No challenge candidates', extra={'leagues': list(key)})
+                continue
+            candidate_specs[key] = (self.arrays.share(candidates.player_ids, 'i'),
+                                    self.arrays.share(candidates.cum_weights, 'd'))
+
+        # spawn: the processes don't inherit the connections and threads of this one
+        self.pool = multiprocessing.get_context('spawn').Pool(
+            self.processes, initializer=_init_process, initargs=(graph_specs, candidate_specs))
+        self.keys = list(candidate_specs)
+        self.version = version
+        logger.info(f'Challenge generator started on data version {version} with {self.processes} processes in '
+                    f'{time.perf_counter() - start:.2f}s', extra={'leagues': [list(key) for key in self.keys]})
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.arrays is not None:
+            self.arrays.close()
+            self.arrays = None
+
+    def fill(self) -> int:
+        # one task per batch missing from a queue: the batches of all the keys run across the processes at once
+        tasks = []
+        for key in self.keys:
+            missing = QUEUE_SIZE - shared_store.length(challenge_pool.queue_key(self.version, key))
+            tasks += [(key, min(self.batch_size, missing - i)) for i in range(0, max(missing, 0), self.batch_size)]
+        if not tasks:
+            return 0
+
+        start = time.perf_counter()
+        generated = 0
+        for key, challenges in self.pool.imap_unordered(_generate, tasks):
+            shared_store.push(challenge_pool.queue_key(self.version, key), challenges, QUEUE_TTL)
+            generated += len(challenges)
+        elapsed = time.perf_counter() - start
+        logger.info(f'{generated} challenges generated in {elapsed:.2f}s ({generated / elapsed:.0f}/s)')
+        return generated
+
+    def run(self):
+        # runs in an app context; the processes are restarted on the data of every new version
+        try:
+            while True:
+                version = data_version.get()
+                if version != self.version:
+                    self.stop()
+                    self.start(version)
+                if not self.fill():
+                    time.sleep(IDLE_INTERVAL)
+        finally:
+            self.stop()
@@ -0,0 +1,192 @@
+import collections
+import logging
+import os
+import threading
+import typing as t
+
+from app import app_config
+from app.utils import cache, data_version, graph_engine, shared_store
+
+logger = logging.getLogger()
+
+# (player_id_1, player_id_2, optimal degrees)
+Challenge = t.Tuple[int, int, int]
+PoolKey = t.Tuple[int, ...]
+
+LOW_WATERMARK = app_config.get_challenge_pool_low_watermark()
+HIGH_WATERMARK = app_config.get_challenge_pool_high_watermark()
+MAX_KEYS = app_config.get_challenge_pool_max_keys()
+REFILL_INTERVAL = 5.0
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_pools: t.Dict[PoolKey, t.Deque[Challenge]] = collections.OrderedDict()
+_hits: t.Dict[PoolKey, int] = collections.Counter()
+_misses: t.Dict[PoolKey, int] = collections.Counter()
+# keys whose last refill produced nothing; they are skipped until requested again
+_stalled: t.Set[PoolKey] = set()
+# incremented when the data version changes: a refill started on the previous data is dropped
+_generation = 0
+
+_flask_app = None
+_generate: t.Optional[t.Callable[[t.List[int], int], t.List[Challenge]]] = None
+_worker: t.Optional[threading.Thread] = None
+_worker_pid = None
+
+
+def normalize_key(leagues_filter: t.Optional[t.Iterable[int]]) -> PoolKey:
+    return tuple(sorted(set(leagues_filter or ())))
+
+
+def queue_key(version: int, key: PoolKey) -> str:
+    # shared queue filled by the challenge generator process (flask generate-challenges)
+    return f'challenge-queue:{version}:{",".join(map(str, key)) or "all"}'
+
+
+def pop_shared(key: PoolKey, count: int) -> t.List[Challenge]:
+    return [tuple(c) for c in shared_store.pop(queue_key(data_version.get(), key), count)]
+
+
+def init_app(flask_app, generate: t.Callable[[t.List[int], int], t.List[Challenge]]):
+    global _flask_app, _generate
+    _flask_app = flask_app
+    _generate = generate
+    with _lock:
+        _pools.setdefault((), collections.deque())
+    cache.on_invalidate(_clear)
+
+
+def _clear():
+    # the pooled challenges (and their optimal degrees) were computed on the previous data version
+    global _generation
+    with _lock:
+        _generation += 1
+        for pool in _pools.values():
+            pool.clear()
+        _stalled.clear()
+    _wakeup.set()
+
+
+def is_enabled() -> bool:
+    return _flask_app is not None
+
+
+def _ensure_worker():
+    # the worker is started on first use so that it lives in the serving process, not in a pre-fork master
+    global _worker, _worker_pid
+    pid = os.getpid()
+    if _worker is not None and _worker_pid == pid and _worker.is_alive():
+        return
+    with _lock:
+        if _worker is not None and _worker_pid == pid and _worker.is_alive():
+            return
+        _worker_pid = pid
+        _worker = threading.Thread(target=_run, name='challenge-pool-refill', daemon=True)
+        _worker.start()
+
+
+def pop(leagues_filter: t.Optional[t.Iterable[int]] = None) -> t.Optional[Challenge]:
+    if not is_enabled():
+        return None
+    _ensure_worker()
+
+    key = normalize_key(leagues_filter)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = collections.deque()
+            while len(_pools) > MAX_KEYS:
+                evicted, _ = _pools.popitem(last=False)
+                _hits.pop(evicted, None)
+                _misses.pop(evicted, None)
+                _stalled.discard(evicted)
+        else:
+            _pools.move_to_end(key)
+        _stalled.discard(key)
+
+        challenge = pool.popleft() if pool else None
+        needs_refill = len(pool) < LOW_WATERMARK
+
+    if challenge is None:
+        shared = pop_shared(key, 1)
+        challenge = shared[0] if shared else None
+    with _lock:
+        if challenge is None:
+            _misses[key] += 1
+        else:
+            _hits[key] += 1
+
+    if needs_refill:
+        _wakeup.set()
+    return challenge
+
+
+def _refill(key: PoolKey):
+    with _lock:
+        pool = _pools.get(key)
+        missing = HIGH_WATERMARK - len(pool) if pool is not None else 0
+        generation = _generation
+    if missing <= 0:
+        return
+
+    try:
+        with _flask_app.app_context():
+            # challenges published by the generator process first; keys it doesn't serve are generated here
+            challenges = pop_shared(key, missing)
+            if not challenges:
+                if _is_reloading():
+                    # they would be computed on the graph of the previous data version: retried on the next pass
+                    return
+                challenges = _generate(list(key), missing)
+    except Exception as e:
+        logger.error(f'Error while refilling challenge pool -> {e}', extra={'leagues': list(key)})
+        challenges = []
+
+    with _lock:
+        if generation != _generation:
+            return
+        if not challenges:
+            _stalled.add(key)
+        pool = _pools.get(key)
+        if pool is not None:
+            pool.extend(challenges)
+
+    if not challenges:
+        logger.warning('Could not refill challenge pool', extra={'leagues': list(key)})
+
+
+def _is_reloading() -> bool:
+    # the in-memory graph is still the one of a previous data version
+    version = graph_engine.graph_version
+    return graph_engine.is_loaded() and version is not None and version != data_version.get()
+
+
+def _run():
+    while True:
+        with _lock:
+            keys = [key for key, pool in _pools.items() if len(pool) < LOW_WATERMARK and key not in _stalled]
+        for key in keys:
+            _refill(key)
+
+        _wakeup.wait(REFILL_INTERVAL)
+        _wakeup.clear()
+
+
+def stats() -> t.Dict[str, t.Any]:
+    with _lock:
+        pools = []
+        for key, pool in _pools.items():
+            requests = _hits[key] + _misses[key]
+            pools.append({
+                'leagues': list(key), 'depth': len(pool), 'hits': _hits[key], 'misses': _misses[key],
+                'miss_rate': _misses[key] / requests if requests else 0.0
+            })
+        hits = sum(_hits.values())
+        misses = sum(_misses.values())
+
+    return {
+        'enabled': is_enabled(), 'low_watermark': LOW_WATERMARK, 'high_watermark': HIGH_WATERMARK,
+        'depth': sum(p['depth'] for p in pools), 'hits': hits, 'misses': misses,
+        'miss_rate': misses / (hits + misses) if hits + misses else 0.0,
+        'pools': pools
+    }
@@ -0,0 +1,114 @@
+import contextlib
+import copy
+import secrets
+import threading
+import typing as t
+
+from app import app_config
+from app.utils import cache, data_version, shared_store
+
+TTL = app_config.get_challenge_session_ttl()
+LOCAL_SESSIONS = 10000
+# attempts of an update whose session keeps being changed by other calls in between
+UPDATE_ATTEMPTS = 10
+
+# sessions live in the shared store when there is one, so that any worker can serve the next call of a session;
+# otherwise in this worker only
+_sessions = cache.TTLCache(maxsize=LOCAL_SESSIONS, ttl=TTL)
+# local sessions: a lock per session being updated, with the count of the calls holding or waiting for it
+_locks: t.Dict[str, t.List] = {}
+_locks_lock = threading.Lock()
+
+
+class ConflictError(Exception):
+    pass
+
+
+def _key(session_id: str) -> str:
+    return f'challenge-session:{session_id}'
+
+
+def create(player_id_1: int, player_id_2: int, degrees: int) -> t.Dict[str, t.Any]:
+    session = {
+        'id': secrets.token_urlsafe(16),
+        'players': [player_id_1, player_id_2],
+        'optimal_degrees': degrees,
+        'data_version': data_version.get(),
+        # validated relationships, from the first player
+        'path': [],
+        # incremented by every update: a shared session is only written over the revision it was read at
+        'revision': 0,
+    }
+    save(session)
+    return session
+
+
+def get(session_id: str) -> t.Optional[t.Dict[str, t.Any]]:
+    if shared_store.get_store() is not None:
+        session = shared_store.get(_key(session_id))
+    else:
+        session = _sessions.get(session_id)
+    # a session is only valid for the data its optimal degrees were computed on
+    if session is None or session['data_version'] != data_version.get():
+        return None
+    return session
+
+
+def save(session: t.Dict[str, t.Any]):
+    if shared_store.get_store() is not None:
+        shared_store.put(_key(session['id']), session, TTL)
+    else:
+        _sessions.set(session['id'], session)
+
+
+def last_player(session: t.Dict[str, t.Any]) -> int:
+    return session['path'][-1]['end'] if session['path'] else session['players'][0]
+
+
+def is_complete(session: t.Dict[str, t.Any]) -> bool:
+    return last_player(session) == session['players'][1]
+
+
+@contextlib.contextmanager
+def _locked(session_id: str):
+    with _locks_lock:
+        entry = _locks.setdefault(session_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[session_id]
+
+
+def update(session_id: str, change: t.Callable[[t.Dict[str, t.Any]], t.Any]) -> t.Tuple[t.Optional[dict], t.Any]:
+    # the changes of a session are serialized: change(session) edits a copy of the current session and is called
+    # again on the new one if another call saved it in between; the session is saved if it was changed.
+    # (None, None) when there is no session
+    if shared_store.get_store() is None:
+        with _locked(session_id):
+            session = get(session_id)
+            if session is None:
+                return None, None
+            changed = copy.deepcopy(session)
+            result = change(changed)
+            if changed != session:
+                changed['revision'] = session.get('revision', 0) + 1
+                save(changed)
+            return changed, result
+
+    for _ in range(UPDATE_ATTEMPTS):
+        session = get(session_id)
+        if session is None:
+            return None, None
+        changed = copy.deepcopy(session)
+        result = change(changed)
+        if changed == session:
+            return changed, result
+        changed['revision'] = session.get('revision', 0) + 1
+        if shared_store.replace(_key(session_id), session, changed, TTL):
+            return changed, result
+    raise ConflictError(f'Challenge session {session_id} changed {UPDATE_ATTEMPTS} times during an update')
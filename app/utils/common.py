@@ -1,21 +1,59 @@
 import base64
+import typing as t
 
-from app import model as m
+import flask
+from sqlalchemy import func, select, and_, nullslast, Select
+from sqlalchemy.orm import undefer
+
+from app import model as m, app_config
+from app.utils import cache
+
+INLINE_IMAGES = app_config.inline_images()
+
+ENTRY_OVERHEAD = 256
+
+
+def entity_size(pretty: t.Dict[str, t.Any]) -> int:
+    # approximate: the inline image, when there is one, is most of an entry
+    return ENTRY_OVERHEAD + len(pretty.get('img') or '')
+
+
+# bounded in bytes too: with inline images an entry's size follows its image
+_players_cache = cache.TTLCache(maxsize=app_config.get_entity_cache_size(),
+                                maxbytes=app_config.get_entity_cache_max_bytes(), sizeof=entity_size)
+_teams_cache = cache.TTLCache(maxsize=app_config.get_entity_cache_size(),
+                              maxbytes=app_config.get_entity_cache_max_bytes(), sizeof=entity_size)
+
+
+def image_options(model: t.Type[t.Union[m.Player, m.Team, m.League]]) -> list:
+    # img columns are deferred: load them only when the pretty functions inline them
+    if INLINE_IMAGES:
+        return [undefer(model.img)]
+    return []
+
+
+def get_pretty_image(kind: str, entity: t.Union[m.Player, m.Team, m.League]) -> t.Dict[str, t.Optional[str]]:
+    if INLINE_IMAGES:
+        return {'img': base64.b64encode(entity.img).decode("utf-8") if entity.img else None}
+
+    img_hash = entity.img_hash
+    return {
+        'img_url': f'/api/img/{kind}/{entity.id}?v={img_hash}' if img_hash else None,
+        'img_hash': img_hash
+    }
 
 
 def get_pretty_player(p: m.Player):
     return {
         'id': p.id, 'name': f'{p.name} {p.surname}',
-        'img': base64.b64encode(p.img).decode("utf-8") if p.img else None
+        **get_pretty_image('player', p)
     }
 
 
-def get_pretty_team(team: m.Team):
-    recent_militancy = max(team.militancy, key=lambda mi: mi.year)
-    league = recent_militancy.league
+def get_pretty_team(team: m.Team, league: m.League):
     return {
         'id': team.id, 'name': team.name,
-        'img': base64.b64encode(team.img).decode("utf-8") if team.img else None,
+        **get_pretty_image('team', team),
         'league_id': league.id, 'league_name': league.display_name
     }
 
@@ -23,6 +61,72 @@ def get_pretty_team(team: m.Team):
 def get_pretty_league(league: m.League):
     return {
         'id': league.id, 'name': league.display_name,
-        'img': base64.b64encode(league.img).decode("utf-8") if league.img else None,
+        **get_pretty_image('league', league),
         'country_code': league.country_code
     }
+
+
+def stream_json_array(items: t.Iterable[t.Any]) -> t.Iterator[str]:
+    # same encoding as jsonify, one element at a time
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + flask.json.dumps(item, separators=(',', ':'))
+    yield ']\n'
+
+
+def get_pretty_players(player_ids: t.Iterable[t.Union[str, int]]) -> t.Dict[int, t.Dict[str, t.Any]]:
+    # cached by id; ids that don't exist are simply missing from the result
+    res = {}
+    missing = []
+    for player_id in {int(i) for i in player_ids}:
+        pretty = _players_cache.get(player_id)
+        if pretty is None:
+            missing.append(player_id)
+        else:
+            res[player_id] = pretty
+
+    if missing:
+        for p in m.db.session.query(m.Player).options(*image_options(m.Player)).filter(m.Player.id.in_(missing)):
+            res[p.id] = get_pretty_player(p)
+            _players_cache.set(p.id, res[p.id])
+
+    return res
+
+
+def get_pretty_teams(team_ids: t.Iterable[t.Union[str, int]]) -> t.Dict[int, t.Dict[str, t.Any]]:
+    res = {}
+    missing = []
+    for team_id in {int(i) for i in team_ids}:
+        pretty = _teams_cache.get(team_id)
+        if pretty is None:
+            missing.append(team_id)
+        else:
+            res[team_id] = pretty
+
+    if missing:
+        for team, league in m.db.session.execute(teams_with_current_league(missing)):
+            if team.id in res:
+                continue
+            res[team.id] = get_pretty_team(team, league)
+            _teams_cache.set(team.id, res[team.id])
+
+    return res
+
+
+def teams_with_current_league(team_ids: t.List[int]) -> Select:
+    # teams and the league of their latest season in a single query (teamMilitancy is indexed on team, year)
+    latest = select(m.TeamMilitancy.team_id, func.max(m.TeamMilitancy.year).label('year')).filter(
+        m.TeamMilitancy.team_id.in_(team_ids)).group_by(m.TeamMilitancy.team_id).subquery('latest')
+    return select(m.Team, m.League).options(*image_options(m.Team)).join(
+        latest, latest.c.team_id == m.Team.id).join(
+        m.TeamMilitancy, and_(m.TeamMilitancy.team_id == latest.c.team_id,
+                              m.TeamMilitancy.year == latest.c.year)).join(
+        m.League, m.League.id == m.TeamMilitancy.league_id).filter(m.Team.id.in_(team_ids))
+
+
+def get_current_team_id(player_id: int) -> t.Optional[int]:
+    # latest militancy of the player through the (player_id, start_date) index, without loading the others
+    return m.db.session.execute(
+        select(m.Militancy.team_id).filter(m.Militancy.player_id == player_id).order_by(
+            nullslast(m.Militancy.start_date.desc()), m.Militancy.year.desc()).limit(1)
+    ).scalar()
@@ -0,0 +1,102 @@
+import gzip
+import typing as t
+import zlib
+
+import flask
+
+from app import app_config
+
+try:
+    import brotli
+except ImportError:
+    # optional: without it responses are only gzip-compressed
+    brotli = None
+
+MIN_SIZE = app_config.get_compression_min_size()
+GZIP_LEVEL = app_config.get_compression_level()
+BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html', 'image/svg+xml'}
+
+_enabled = False
+
+
+def negotiate(accept_encoding: str) -> t.Optional[str]:
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compressor(encoding: str) -> t.Tuple[t.Callable[[bytes], bytes], t.Callable[[], bytes]]:
+    # (process, finish) pair compressing a stream chunk by chunk
+    if encoding == 'br':
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, c.flush
+
+
+def _compress_stream(chunks: t.Iterable[t.Union[bytes, str]], encoding: str) -> t.Iterator[bytes]:
+    process, finish = compressor(encoding)
+    for chunk in chunks:
+        out = process(chunk.encode() if isinstance(chunk, str) else chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def accepted_encoding() -> t.Optional[str]:
+    return negotiate(flask.request.headers.get('Accept-Encoding', ''))
+
+
+def compress_response(response: flask.Response) -> flask.Response:
+    if response.status_code != 200 or 'Content-Encoding' in response.headers or \
+            response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    encoding = accepted_encoding()
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) >= MIN_SIZE:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(flask_app):
+    global _enabled
+    _enabled = True
+    flask_app.after_request(compress_response)
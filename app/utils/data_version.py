@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+import typing as t
+
+from sqlalchemy import select, update, insert
+
+from app import model as m, app_config
+from app.utils import cache
+
+logger = logging.getLogger()
+
+POLL_INTERVAL = app_config.get_data_version_poll_interval()
+
+_lock = threading.Lock()
+_version: t.Optional[int] = None
+_checked_at = 0.0
+
+
+def _read() -> int:
+    with m.db.engine.connect() as conn:
+        version = conn.execute(select(m.DataVersion.version).where(m.DataVersion.id == 1)).scalar()
+    return version or 0
+
+
+def get() -> int:
+    # the version is shared by all workers through the database and polled at most every POLL_INTERVAL seconds;
+    # a change drops every local cache
+    global _version, _checked_at
+    now = time.monotonic()
+    if _version is not None and now - _checked_at < POLL_INTERVAL:
+        return _version
+
+    with _lock:
+        if _version is not None and now - _checked_at < POLL_INTERVAL:
+            return _version
+        try:
+            version = _read()
+        except Exception as e:
+            logger.warning(f'Error while reading data version -> {e}')
+            version = _version or 0
+        _checked_at = now
+
+        if _version is not None and version != _version:
+            logger.info(f'Data version changed from {_version} to {version}, invalidating caches')
+            cache.invalidate_all()
+        _version = version
+
+    return version
+
+
+def bump() -> int:
+    global _version, _checked_at
+    m.DataVersion.__table__.create(bind=m.db.engine, checkfirst=True)
+    with m.db.engine.begin() as conn:
+        version = conn.execute(update(m.DataVersion).where(m.DataVersion.id == 1).values(
+            version=m.DataVersion.version + 1).returning(m.DataVersion.version)).scalar()
+        if version is None:
+            version = 1
+            conn.execute(insert(m.DataVersion).values(id=1, version=version))
+
+    with _lock:
+        _version = version
+        _checked_at = time.monotonic()
+        cache.invalidate_all()
+
+    return version
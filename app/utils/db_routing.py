@@ -0,0 +1,206 @@
+import contextvars
+import importlib.util
+import itertools
+import logging
+import threading
+import time
+import typing as t
+import weakref
+
+import sqlalchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from app import app_config
+from app.utils import instrumentation
+
+logger = logging.getLogger()
+
+DEFAULT = 'default'
+# blueprint -> workload: a workload with its own pool settings gets its own connections, so search traffic and
+# challenge generation don't wait on each other
+BLUEPRINT_WORKLOADS = {'players': 'search', 'game': 'game'}
+REPLICA_RETRY_INTERVAL = app_config.get_replica_retry_interval()
+
+_workload: 'contextvars.ContextVar[str]' = contextvars.ContextVar('sql_workload', default=DEFAULT)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool counting checkouts, the time spent waiting for them and the ones that timed out."""
+
+    pools: 't.MutableSet[InstrumentedQueuePool]' = weakref.WeakSet()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        InstrumentedQueuePool.pools.add(self)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.checkouts += 1
+            self.wait_time += time.perf_counter() - start
+
+
+def driver_url(url: str) -> str:
+    # server-side prepared statements need psycopg 3: it prepares a statement once it has run prepare_threshold
+    # times on a connection, which covers the fixed hot queries
+    if not app_config.use_prepared_statements():
+        return url
+    if importlib.util.find_spec('psycopg') is None:
+        logger.warning('SQL_PREPARED_STATEMENTS is set but psycopg 3 is not installed: statements are not prepared')
+        return url
+    return str(sqlalchemy.make_url(url).set(drivername='postgresql+psycopg'))
+
+
+def engine_options(workload: str = DEFAULT, name: str = 'primary') -> t.Dict[str, t.Any]:
+    options = {
+        'pool_pre_ping': True,
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': app_config.get_sql_pool_size(workload),
+        'max_overflow': app_config.get_sql_max_overflow(workload),
+        'pool_timeout': app_config.get_sql_pool_timeout(),
+        'pool_logging_name': f'{workload}.{name}',
+    }
+    if app_config.use_prepared_statements() and importlib.util.find_spec('psycopg') is not None:
+        options['connect_args'] = {'prepare_threshold': app_config.get_prepare_threshold()}
+    return options
+
+
+class ReplicaSet:
+    """Round robin over the replicas, skipping for a while the ones whose connections failed."""
+
+    def __init__(self, urls: t.List[str], workload: str):
+        self.engines = []
+        for i, url in enumerate(urls):
+            engine = sqlalchemy.create_engine(driver_url(url), **engine_options(workload, f'replica{i}'))
+            event.listen(engine, 'handle_error', self._on_error)
+            instrumentation.instrument_engine(engine)
+            self.engines.append(engine)
+        self._down_until = {engine: 0.0 for engine in self.engines}
+        self._next = itertools.count()
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            engine = context.engine
+            logger.warning(f'SQL replica {engine.url.host or engine.url.database} unavailable for '
+                           f'{REPLICA_RETRY_INTERVAL}s -> {context.original_exception}')
+            self._down_until[engine] = time.monotonic() + REPLICA_RETRY_INTERVAL
+
+    def pick(self) -> t.Optional[sqlalchemy.Engine]:
+        now = time.monotonic()
+        start = next(self._next)
+        for i in range(len(self.engines)):
+            engine = self.engines[(start + i) % len(self.engines)]
+            if self._down_until[engine] <= now:
+                return engine
+        return None
+
+
+_lock = threading.Lock()
+_replicas: t.Dict[str, ReplicaSet] = {}
+_primaries: t.Dict[str, sqlalchemy.Engine] = {}
+
+
+def _replica_set(workload: str) -> t.Optional[ReplicaSet]:
+    replicas = _replicas.get(workload)
+    if replicas is None:
+        urls = app_config.get_replica_database_urls()
+        if not urls:
+            return None
+        with _lock:
+            replicas = _replicas.get(workload)
+            if replicas is None:
+                replicas = _replicas[workload] = ReplicaSet(urls, workload)
+    return replicas
+
+
+def _primary(workload: str) -> t.Optional[sqlalchemy.Engine]:
+    # None for workloads without pool settings of their own: they share the default engine
+    if workload == DEFAULT or not app_config.has_sql_pool_settings(workload):
+        return None
+    engine = _primaries.get(workload)
+    if engine is None:
+        with _lock:
+            engine = _primaries.get(workload)
+            if engine is None:
+                engine = _primaries[workload] = sqlalchemy.create_engine(
+                    driver_url(app_config.get_database_url()), **engine_options(workload))
+                instrumentation.instrument_engine(engine)
+    return engine
+
+
+def read_engine() -> t.Optional[sqlalchemy.Engine]:
+    workload = _workload.get()
+    replicas = _replica_set(workload)
+    engine = replicas.pick() if replicas is not None else None
+    return engine or _primary(workload)
+
+
+def set_workload(workload: str):
+    _workload.set(workload)
+
+
+def is_write(clause) -> bool:
+    return isinstance(clause, sqlalchemy.sql.dml.UpdateBase) or (
+        isinstance(clause, sqlalchemy.TextClause) and not clause.text.lstrip().upper().startswith('SELECT'))
+
+
+# session.info key of the engine the reads of the current transaction go to
+READ_BIND = 'read_bind'
+PRIMARY = 'primary'
+
+
+class RoutingSession(Session):
+    # the app only reads through the session (writes go through db.engine). The read engine is picked at the first
+    # statement of a transaction and kept until it ends, so that its reads see a single replica; a transaction that
+    # flushes or runs DML stays on the primary from then on
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if is_write(clause):
+                self.info[READ_BIND] = PRIMARY
+            engine = self.info.get(READ_BIND)
+            if engine is None:
+                engine = self.info[READ_BIND] = read_engine() or PRIMARY
+            if engine is not PRIMARY:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _pin_primary(session, flush_context, instances):
+    session.info[READ_BIND] = PRIMARY
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _release_read_bind(session, transaction):
+    # commit, rollback and close end the root transaction: the next one picks again
+    if transaction.parent is None:
+        session.info.pop(READ_BIND, None)
+
+
+def pool_stats() -> t.List[t.Dict[str, t.Any]]:
+    res = []
+    for pool in list(InstrumentedQueuePool.pools):
+        res.append({
+            'pool': getattr(pool, 'logging_name', None) or DEFAULT, 'size': pool.size(),
+            'checkedout': pool.checkedout(), 'overflow': pool.overflow(), 'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts, 'wait_time': pool.wait_time,
+        })
+    return sorted(res, key=lambda r: r['pool'])
+
+
+def init_app(flask_app):
+    import flask
+
+    @flask_app.before_request
+    def select_workload():
+        set_workload(BLUEPRINT_WORKLOADS.get(flask.request.blueprint, DEFAULT))
@@ -0,0 +1,249 @@
+import array
+import bisect
+import itertools
+import logging
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import typing as t
+
+from app import app_config
+from app.utils import cache, graph_engine
+
+logger = logging.getLogger()
+
+DIRECTORY = app_config.get_distance_oracle_dir()
+MAX_KEYS = app_config.get_distance_oracle_max_keys()
+# the matrix and the partner lists grow with the square of this: the most valuable candidates are kept
+MAX_PLAYERS = app_config.get_distance_oracle_max_players()
+# value-weighted partners drawn before falling back to a scan of the partner lists
+PARTNER_SAMPLES = 32
+# distances are stored as one byte: anything farther than the search bound is UNREACHABLE
+UNREACHABLE = 255
+MAGIC = b'DORC'
+FORMAT_VERSION = 1
+# magic, format version, number of players, data version
+HEADER = struct.Struct('<4sHIq')
+
+# distance -> translation table turning a row into a mask of the cells at that distance
+_MASKS = [bytes(int(d == distance) for d in range(256)) for distance in range(256)]
+
+_matrices = cache.TTLCache(maxsize=MAX_KEYS)
+_lock = threading.Lock()
+_building: t.Set[t.Tuple[int, ...]] = set()
+
+
+class DistanceMatrix:
+    """Shortest path lengths between every pair of challenge candidates.
+
+    ``distances[i * n + j]`` is the distance between ``player_ids[i]`` and ``player_ids[j]``; ``partners(i)[d]``
+    lists the positions of the players at distance ``d`` from position ``i``.
+    """
+
+    def __init__(self, player_ids: t.Sequence[int], distances: t.Sequence[int], data_version: int):
+        self.player_ids = player_ids
+        self.distances = distances
+        self.data_version = data_version
+        self.positions = {player_id: i for i, player_id in enumerate(player_ids)}
+        # cumulative player values, as in CandidateSet: partners are drawn uniformly until they are set
+        self.cum_weights: t.Optional[t.List[float]] = None
+
+        # position -> distance -> partner positions, built from the row of a player the first time it is picked:
+        # loading a matrix doesn't scan its n * n cells
+        self._partners: t.Dict[int, t.Dict[int, array.array]] = {}
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def set_weights(self, weights: t.Dict[int, float]):
+        self.cum_weights = list(itertools.accumulate(max(weights.get(p) or 0.0, 0.0) for p in self.player_ids))
+        if not self.cum_weights or not self.cum_weights[-1]:
+            self.cum_weights = None
+
+    def distance(self, player_id_1: int, player_id_2: int) -> t.Optional[int]:
+        i, j = self.positions.get(player_id_1), self.positions.get(player_id_2)
+        if i is None or j is None:
+            return None
+        d = self.distances[i * len(self.player_ids) + j]
+        return None if d == UNREACHABLE else d
+
+    def partners(self, i: int) -> t.Dict[int, array.array]:
+        res = self._partners.get(i)
+        if res is None:
+            n = len(self.player_ids)
+            row = bytes(self.distances[i * n:(i + 1) * n])
+            positions = range(n)
+            # a mask of the cells at each distance of the row selects the positions; 0 is the player itself
+            res = self._partners[i] = {
+                d: array.array('I', itertools.compress(positions, row.translate(_MASKS[d])))
+                for d in set(row).difference((0, UNREACHABLE))
+            }
+        return res
+
+    def _weight(self, j: int) -> float:
+        return self.cum_weights[j] - (self.cum_weights[j - 1] if j else 0.0)
+
+    def pick_partner(self, player_id: int, lengths: t.Iterable[int]) -> t.Optional[t.Tuple[int, int]]:
+        # a player at one of the given distances from player_id, with that distance; weighted by value like
+        # CandidateSet.sample once the weights are set
+        i = self.positions.get(player_id)
+        if i is None:
+            return None
+        lengths = set(lengths)
+        n = len(self.player_ids)
+        if self.cum_weights is not None:
+            # drawn from all the candidates, kept if at an accepted distance: most draws are, and the partner lists
+            # are only needed for the rare distances
+            total_weight = self.cum_weights[-1]
+            for _ in range(PARTNER_SAMPLES):
+                j = min(bisect.bisect_right(self.cum_weights, random.random() * total_weight), n - 1)
+                d = self.distances[i * n + j]
+                if j != i and d in lengths:
+                    return self.player_ids[j], d
+
+        by_distance = self.partners(i)
+        rows = [(d, by_distance[d]) for d in lengths if d in by_distance]
+        if self.cum_weights is None:
+            total = sum(len(row) for _, row in rows)
+            if not total:
+                return None
+            k = random.randrange(total)
+            for d, row in rows:
+                if k < len(row):
+                    return self.player_ids[row[k]], d
+                k -= len(row)
+            return None
+
+        # rare distances: weighted choice over the partners at those distances
+        partners = [(j, d) for d, row in rows for j in row]
+        weights = [self._weight(j) for j, _ in partners]
+        if not sum(weights):
+            return None
+        j, d = random.choices(partners, weights=weights)[0]
+        return self.player_ids[j], d
+
+
+def candidate_weights(player_ids: t.Sequence[int], cum_weights: t.Sequence[float]) -> t.Dict[int, float]:
+    # player values back from the cumulative weights of a CandidateSet
+    return {p: w - (cum_weights[i - 1] if i else 0.0) for i, (p, w) in enumerate(zip(player_ids, cum_weights))}
+
+
+def compute(graph: 'graph_engine.PlayedWithGraph', player_ids: t.Sequence[int], max_len: int,
+            data_version: int, weights: t.Optional[t.Dict[int, float]] = None) -> DistanceMatrix:
+    # one BFS per candidate, stopped as soon as all the other candidates have been reached
+    player_ids = [p for p in player_ids if graph.index(p) is not None]
+    if len(player_ids) > MAX_PLAYERS:
+        if weights is not None:
+            player_ids.sort(key=lambda p: weights.get(p) or 0.0, reverse=True)
+        logger.warning(f'Distance oracle limited to {MAX_PLAYERS} of {len(player_ids)} candidates')
+        player_ids = player_ids[:MAX_PLAYERS]
+    nodes = [graph.index(p) for p in player_ids]
+    targets = set(nodes)
+    n = len(nodes)
+    distances = bytearray([UNREACHABLE]) * (n * n)
+    for i, source in enumerate(nodes):
+        dist = graph.distances_from(source, max_len, targets)
+        for j, target in enumerate(nodes):
+            d = dist.get(target)
+            if d is not None:
+                distances[i * n + j] = d
+
+    matrix = DistanceMatrix(array.array('i', player_ids), distances, data_version)
+    if weights is not None:
+        matrix.set_weights(weights)
+    return matrix
+
+
+def path_for(key: t.Tuple[int, ...]) -> str:
+    name = '-'.join(str(k) for k in key) or 'all'
+    return os.path.join(DIRECTORY, f'distances-{name}.bin')
+
+
+def save(matrix: DistanceMatrix, path: str):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(matrix), matrix.data_version))
+        f.write(array.array('i', matrix.player_ids).tobytes())
+        f.write(bytes(matrix.distances))
+    # readers never see a partially written file
+    os.replace(tmp_path, path)
+
+
+def read_data_version(path: str) -> int:
+    with open(path, 'rb') as f:
+        magic, version, _, data_version = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f'{path} is not a distance oracle file')
+    return data_version
+
+
+def load(path: str) -> DistanceMatrix:
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, n, data_version = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f'{path} is not a distance oracle file')
+    ids_end = HEADER.size + 4 * n
+    if len(buffer) != ids_end + n * n:
+        raise ValueError(f'{path} is truncated')
+
+    player_ids = array.array('i')
+    player_ids.frombytes(buffer[HEADER.size:ids_end])
+    return DistanceMatrix(player_ids, memoryview(buffer)[ids_end:], data_version)
+
+
+def _build_in_background(key: t.Tuple[int, ...], player_ids: t.List[int], max_len: int, data_version: int,
+                         weights: t.Dict[int, float]):
+    def run():
+        try:
+            start = time.perf_counter()
+            # the version first: load() sets the graph before it, so the graph is never older than its label
+            version = graph_engine.graph_version
+            graph = graph_engine.graph
+            if version != data_version:
+                return
+            matrix = compute(graph, player_ids, max_len, version, weights)
+            _matrices.set(key, matrix)
+            if DIRECTORY:
+                save(matrix, path_for(key))
+            logger.info(f'Distance oracle built for leagues {list(key)}: {len(matrix)} players '
+                        f'in {time.perf_counter() - start:.2f}s')
+        except Exception as e:
+            logger.error(f'Error while building distance oracle -> {e}', extra={'leagues': list(key)})
+        finally:
+            with _lock:
+                _building.discard(key)
+
+    with _lock:
+        if key in _building:
+            return
+        _building.add(key)
+    threading.Thread(target=run, name='distance-oracle', daemon=True).start()
+
+
+def get(key: t.Tuple[int, ...], player_ids: t.List[int], cum_weights: t.Sequence[float], max_len: int,
+        data_version: int) -> t.Optional[DistanceMatrix]:
+    # None until a matrix for the current data version is available: callers fall back to graph queries
+    matrix = _matrices.get(key)
+    if matrix is not None and matrix.data_version == data_version:
+        return matrix
+
+    path = path_for(key) if DIRECTORY else None
+    if path and os.path.exists(path):
+        try:
+            # a file built for another data version is left to the next build
+            if read_data_version(path) == data_version:
+                matrix = load(path)
+                matrix.set_weights(candidate_weights(player_ids, cum_weights))
+                _matrices.set(key, matrix)
+                return matrix
+        except (OSError, ValueError) as e:
+            logger.warning(f'Could not load distance oracle -> {e}', extra={'leagues': list(key)})
+
+    # not on a graph still being reloaded for this data version: its distances are the previous version's
+    if graph_engine.is_loaded() and graph_engine.graph_version == data_version:
+        _build_in_background(key, player_ids, max_len, data_version, candidate_weights(player_ids, cum_weights))
+    return None
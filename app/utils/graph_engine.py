@@ -0,0 +1,556 @@
+import array
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import typing as t
+
+from app import app_config
+from app.utils import instrumentation, cache, data_version
+
+logger = logging.getLogger()
+
+# mirrors the bound used by the allShortestPaths query in neo4j_client.shortest_path_ids
+SHORTEST_PATH_MAX_LENGTH = 6
+ALL_SHORTEST_PATHS_CAP = 10000
+# distance layers store one byte per node
+LAYER_UNREACHABLE = 255
+
+SNAPSHOT_PATH = app_config.get_graph_snapshot_path()
+SNAPSHOT_MAGIC = b'PWGS'
+SNAPSHOT_FORMAT_VERSION = 1
+# magic, format version, data version, nodes, half edges (each undirected edge is stored in both rows)
+SNAPSHOT_HEADER = struct.Struct('<4sIqqq')
+
+
+class PlayedWithGraph:
+    """PLAYED_WITH graph in CSR form.
+
+    Nodes are addressed by their position in the sorted ``node_ids`` array; the neighbors of node ``i`` are
+    ``neighbors[offsets[i]:offsets[i + 1]]`` (sorted) and ``team_ids`` holds the team of each of those edges.
+    """
+
+    def __init__(self, node_ids: t.Sequence[int], values: t.Sequence[float], offsets: t.Sequence[int],
+                 neighbors: t.Sequence[int], team_ids: t.Sequence[int]):
+        self.node_ids = node_ids
+        self.values = values
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.team_ids = team_ids
+
+    @classmethod
+    def from_edges(cls, values: t.Dict[int, float], edges: t.Iterable[t.Tuple[int, int, int]]) -> 'PlayedWithGraph':
+        edges = list(edges)
+        ids = set(values)
+        for a, b, _ in edges:
+            ids.add(a)
+            ids.add(b)
+        node_ids = array.array('i', sorted(ids))
+        index = {player_id: i for i, player_id in enumerate(node_ids)}
+
+        half_edges = []
+        for a, b, team_id in edges:
+            if a == b:
+                continue
+            half_edges.append((index[a], index[b], team_id))
+            half_edges.append((index[b], index[a], team_id))
+        half_edges.sort()
+
+        offsets = array.array('q', bytes(8 * (len(node_ids) + 1)))
+        neighbors = array.array('i')
+        team_ids = array.array('i')
+        previous = None
+        for src, dst, team_id in half_edges:
+            # parallel edges (same players, different teams) collapse into the one with the lowest team id
+            if (src, dst) == previous:
+                continue
+            previous = (src, dst)
+            neighbors.append(dst)
+            team_ids.append(team_id)
+            offsets[src + 1] += 1
+        for i in range(len(node_ids)):
+            offsets[i + 1] += offsets[i]
+
+        node_values = array.array('d', (float(values.get(player_id) or 0.0) for player_id in node_ids))
+
+        return cls(node_ids, node_values, offsets, neighbors, team_ids)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.neighbors) // 2
+
+    def index(self, player_id: t.Union[str, int]) -> t.Optional[int]:
+        player_id = int(player_id)
+        i = bisect.bisect_left(self.node_ids, player_id)
+        if i < len(self.node_ids) and self.node_ids[i] == player_id:
+            return i
+        return None
+
+    def edge_team(self, i: int, j: int) -> t.Optional[int]:
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        k = bisect.bisect_left(self.neighbors, j, lo, hi)
+        if k < hi and self.neighbors[k] == j:
+            return self.team_ids[k]
+        return None
+
+    def _expand(self, frontier: t.List[int], dist: t.Dict[int, int], other: t.Dict[int, int], depth: int
+                ) -> t.Tuple[t.List[int], t.List[int]]:
+        offsets, neighbors = self.offsets, self.neighbors
+        next_frontier = []
+        meeting = []
+        for u in frontier:
+            for k in range(offsets[u], offsets[u + 1]):
+                v = neighbors[k]
+                if v in dist:
+                    continue
+                dist[v] = depth
+                next_frontier.append(v)
+                if v in other:
+                    meeting.append(v)
+        return next_frontier, meeting
+
+    def bidirectional_search(self, source: int, target: int, max_len: int
+                             ) -> t.Optional[t.Tuple[int, t.Dict[int, int], t.Dict[int, int], t.List[int]]]:
+        if source == target:
+            return 0, {source: 0}, {target: 0}, [source]
+
+        dist_s, dist_t = {source: 0}, {target: 0}
+        frontier_s, frontier_t = [source], [target]
+        depth_s = depth_t = 0
+        while frontier_s and frontier_t and depth_s + depth_t < max_len:
+            # always grow the cheaper side; a full layer is expanded before checking for a meeting so that
+            # every meeting node lies on a shortest path
+            if len(frontier_s) <= len(frontier_t):
+                depth_s += 1
+                frontier_s, meeting = self._expand(frontier_s, dist_s, dist_t, depth_s)
+            else:
+                depth_t += 1
+                frontier_t, meeting = self._expand(frontier_t, dist_t, dist_s, depth_t)
+            if meeting:
+                return depth_s + depth_t, dist_s, dist_t, meeting
+
+        return None
+
+    def shortest_path_length(self, source: int, target: int, max_len: int) -> t.Optional[int]:
+        res = self.bidirectional_search(source, target, max_len)
+        return res[0] if res else None
+
+    def distances_from(self, source: int, max_len: int, targets: t.Optional[t.Set[int]] = None) -> t.Dict[int, int]:
+        # single-source BFS up to max_len hops; stops early once every node in ``targets`` has been reached
+        dist = {source: 0}
+        frontier = [source]
+        remaining = len(targets - {source}) if targets is not None else None
+        for depth in range(1, max_len + 1):
+            if not frontier or remaining == 0:
+                break
+            frontier, _ = self._expand(frontier, dist, {}, depth)
+            if targets is not None:
+                remaining -= sum(1 for v in frontier if v in targets)
+        return dist
+
+    def distance_layer(self, source: int, max_len: int) -> bytearray:
+        # distance from source of every node, LAYER_UNREACHABLE past max_len hops
+        offsets, neighbors = self.offsets, self.neighbors
+        layer = bytearray([LAYER_UNREACHABLE]) * len(self.node_ids)
+        layer[source] = 0
+        frontier = [source]
+        for depth in range(1, max_len + 1):
+            next_frontier = []
+            for u in frontier:
+                for k in range(offsets[u], offsets[u + 1]):
+                    v = neighbors[k]
+                    if layer[v] == LAYER_UNREACHABLE:
+                        layer[v] = depth
+                        next_frontier.append(v)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return layer
+
+    def _paths_to(self, node: int, dist: t.Dict[int, int]) -> t.Iterator[t.List[int]]:
+        # yields every shortest path from the BFS root of ``dist`` to ``node`` (root first)
+        d = dist[node]
+        if d == 0:
+            yield [node]
+            return
+        offsets, neighbors = self.offsets, self.neighbors
+        for k in range(offsets[node], offsets[node + 1]):
+            u = neighbors[k]
+            if dist.get(u) == d - 1:
+                for path in self._paths_to(u, dist):
+                    path.append(node)
+                    yield path
+
+    def all_shortest_paths(self, source: int, target: int, max_len: int, cap: int = ALL_SHORTEST_PATHS_CAP
+                           ) -> t.List[t.List[int]]:
+        res = self.bidirectional_search(source, target, max_len)
+        if not res:
+            return []
+        _, dist_s, dist_t, meeting = res
+
+        paths = []
+        for m in meeting:
+            tails = [list(reversed(p)) for p in self._paths_to(m, dist_t)]
+            for head in self._paths_to(m, dist_s):
+                for tail in tails:
+                    paths.append(head + tail[1:])
+                    if len(paths) >= cap:
+                        return paths
+        return paths
+
+    def _best_weight(self, node: int, dist: t.Dict[int, int], best: t.Dict[int, float]) -> float:
+        # max weight of a shortest path from the BFS root of ``dist`` to node, memoized in ``best``
+        w = best.get(node)
+        if w is None:
+            d = dist[node]
+            w = self.values[node]
+            if d:
+                offsets, neighbors = self.offsets, self.neighbors
+                w += max(self._best_weight(neighbors[k], dist, best) for k in range(offsets[node], offsets[node + 1])
+                         if dist.get(neighbors[k]) == d - 1)
+            best[node] = w
+        return w
+
+    def _best_paths_to(self, node: int, dist: t.Dict[int, int], best: t.Dict[int, float]) -> t.Iterator[t.List[int]]:
+        # like _paths_to, following only the predecessors that reach the memoized best weight
+        d = dist[node]
+        if d == 0:
+            yield [node]
+            return
+        offsets, neighbors = self.offsets, self.neighbors
+        for k in range(offsets[node], offsets[node + 1]):
+            u = neighbors[k]
+            if dist.get(u) == d - 1 and self.values[node] + best.get(u, float('-inf')) == best[node]:
+                for path in self._best_paths_to(u, dist, best):
+                    path.append(node)
+                    yield path
+
+    def max_weight_shortest_paths(self, source: int, target: int, max_len: int, cap: int = ALL_SHORTEST_PATHS_CAP
+                                  ) -> t.List[t.List[int]]:
+        # the shortest paths of max weight, without enumerating all the shortest paths: dynamic programming over
+        # the BFS layers of both searches gives the best weight from each end to every meeting node
+        res = self.bidirectional_search(source, target, max_len)
+        if not res:
+            return []
+        _, dist_s, dist_t, meeting = res
+
+        best_s, best_t = {}, {}
+        weights = [
+            (self._best_weight(m, dist_s, best_s) + self._best_weight(m, dist_t, best_t) - self.values[m], m)
+            for m in meeting
+        ]
+        max_weight = max(w for w, _ in weights)
+
+        paths = []
+        for w, m in weights:
+            if w != max_weight:
+                continue
+            tails = [list(reversed(p)) for p in self._best_paths_to(m, dist_t, best_t)]
+            for head in self._best_paths_to(m, dist_s, best_s):
+                for tail in tails:
+                    paths.append(head + tail[1:])
+                    if len(paths) >= cap:
+                        return paths
+        return paths
+
+    def path_relationships(self, path: t.List[int]) -> t.List[t.Dict[str, int]]:
+        return [
+            {
+                'start': self.node_ids[a],
+                'team': self.edge_team(a, b),
+                'end': self.node_ids[b],
+            }
+            for a, b in zip(path, path[1:])
+        ]
+
+
+graph: t.Optional[PlayedWithGraph] = None
+# data version the graph was loaded for, None when unknown
+graph_version: t.Optional[int] = None
+# target node -> (graph, distance layer): hints of an active challenge all walk towards the same target
+_layers = cache.TTLCache(maxsize=app_config.get_hint_cache_size())
+_flask_app = None
+_lock = threading.Lock()
+_loading = False
+_stale = False
+# off in processes that load the graph themselves
+_background = True
+_thread: t.Optional[threading.Thread] = None
+
+
+def is_loaded() -> bool:
+    return graph is not None
+
+
+def save_snapshot(played_with: PlayedWithGraph, path: str, version: int):
+    # 8 byte arrays first so that every array is aligned on its item size
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, version, len(played_with),
+                                     len(played_with.neighbors)))
+        for values in (played_with.offsets, played_with.values, played_with.node_ids, played_with.neighbors,
+                       played_with.team_ids):
+            f.write(bytes(values))
+    # workers loading the snapshot never see a partially written file
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> t.Tuple[PlayedWithGraph, int]:
+    # the arrays are memoryviews over a shared read-only mapping: no copy, and every worker mapping the same file
+    # uses the same page cache
+    if sys.byteorder != 'little':
+        raise ValueError('graph snapshots are little-endian')
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, format_version, version, n, m = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f'{path} is not a graph snapshot')
+    if len(buffer) != SNAPSHOT_HEADER.size + 8 * (n + 1) + 8 * n + 4 * n + 8 * m:
+        raise ValueError(f'{path} is truncated')
+
+    view = memoryview(buffer)
+    arrays = []
+    offset = SNAPSHOT_HEADER.size
+    for typecode, length in (('q', n + 1), ('d', n), ('i', n), ('i', m), ('i', m)):
+        size = length * (8 if typecode in 'qd' else 4)
+        arrays.append(view[offset:offset + size].cast(typecode))
+        offset += size
+    offsets, values, node_ids, neighbors, team_ids = arrays
+
+    return PlayedWithGraph(node_ids, values, offsets, neighbors, team_ids), version
+
+
+def load_from_neo4j() -> PlayedWithGraph:
+    from app.utils import neo4j_client
+
+    values = {}
+    edges = []
+    with neo4j_client.get_driver().session() as session:
+        for record in session.run('MATCH (p:Player) RETURN p.playerId AS player_id, p.value AS value'):
+            values[int(record['player_id'])] = record['value']
+        for record in session.run(
+                """
+                MATCH (start:Player)-[r:PLAYED_WITH]->(end:Player)
+                RETURN start.playerId AS start_id, end.playerId AS end_id, r.team_id AS team_id
+                """):
+            edges.append((int(record['start_id']), int(record['end_id']), int(record['team_id'])))
+
+    return PlayedWithGraph.from_edges(values, edges)
+
+
+def load(version: t.Optional[int] = None):
+    global graph, graph_version
+    start = time.perf_counter()
+    loaded = None
+    source = 'neo4j'
+    if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
+        try:
+            snapshot, snapshot_version = load_snapshot(SNAPSHOT_PATH)
+            if version is None or snapshot_version == version:
+                loaded, source = snapshot, SNAPSHOT_PATH
+            else:
+                logger.info(f'Graph snapshot is for data version {snapshot_version} instead of {version}, '
+                            f'loading from neo4j')
+        except (OSError, ValueError) as e:
+            logger.warning(f'Could not load graph snapshot -> {e}')
+    if loaded is None:
+        loaded = load_from_neo4j()
+
+    # the graph before its version: a reader taking the version first never pairs it with an older graph
+    graph = loaded
+    graph_version = version
+    logger.info(f'PLAYED_WITH graph loaded from {source}: {len(loaded)} players, {loaded.edge_count} edges '
+                f'in {time.perf_counter() - start:.2f}s')
+
+
+def load_in_background(flask_app=None):
+    # until the graph is loaded callers keep using neo4j_client (or the graph of the previous data version)
+    global _flask_app, _loading, _stale, _thread
+    if flask_app is not None and _flask_app is None:
+        _flask_app = flask_app
+        cache.on_invalidate(load_in_background)
+
+    def run():
+        global _loading, _stale
+        try:
+            while True:
+                with _lock:
+                    if not _background:
+                        break
+                version = None
+                if _flask_app is not None:
+                    with _flask_app.app_context():
+                        version = data_version.get()
+                load(version)
+                with _lock:
+                    # a reload requested while loading needs another pass
+                    reload = _stale
+                    _stale = False
+                if not reload:
+                    break
+        except Exception as e:
+            logger.error(f'Could not load PLAYED_WITH graph in memory, falling back to neo4j -> {e}')
+        finally:
+            with _lock:
+                _loading = False
+
+    with _lock:
+        if not _background:
+            return
+        if _loading:
+            _stale = True
+            return
+        _loading = True
+        _thread = threading.Thread(target=run, name='graph-engine-load', daemon=True)
+    _thread.start()
+
+
+def stop_background_load():
+    # for processes loading the graph themselves (flask generate-challenges): no load is started anymore, neither
+    # at boot nor on a data version change. A load already running is waited for, its graph can still be used
+    global _background
+    with _lock:
+        _background = False
+        thread = _thread
+    if thread is not None:
+        thread.join()
+
+
+def _restart_after_fork():
+    # the load thread doesn't survive a fork (e.g. gunicorn --preload forking mid-load): the child restarts the load
+    # instead of waiting forever for a thread that isn't there
+    global _lock, _loading, _stale, _thread
+    _lock = threading.Lock()
+    _thread = None
+    interrupted = _loading
+    _loading = _stale = False
+    if interrupted:
+        load_in_background()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+@instrumentation.traced('graph')
+def validate_path_for_challenge_creation(player_id_1: int, player_id_2: int, max_len: int, min_len=2) -> bool:
+    # like every query below, on a single graph: load() can replace the module one in the middle of the call
+    g = graph
+    i, j = g.index(player_id_1), g.index(player_id_2)
+    if i is None or j is None:
+        return False
+
+    # checking if they have played together (if yes, there's no challenge)
+    if g.edge_team(i, j) is not None:
+        return False
+
+    length = g.shortest_path_length(i, j, max_len)
+    return length is not None and length > min_len
+
+
+@instrumentation.traced('graph')
+def get_challenge_path_length(player_id_1: int, player_id_2: int, max_len: int, min_len=2) -> t.Optional[int]:
+    g = graph
+    i, j = g.index(player_id_1), g.index(player_id_2)
+    if i is None or j is None:
+        return None
+
+    length = g.shortest_path_length(i, j, max_len)
+    if length is None or length <= min_len:
+        return None
+    return length
+
+
+@instrumentation.traced('graph')
+def get_challenge_path_lengths(pairs: t.Sequence[t.Tuple[int, int]], max_len: int, min_len=2
+                               ) -> t.List[t.Optional[int]]:
+    g = graph
+    lengths = []
+    for player_id_1, player_id_2 in pairs:
+        i, j = g.index(player_id_1), g.index(player_id_2)
+        length = g.shortest_path_length(i, j, max_len) if i is not None and j is not None and i != j else None
+        lengths.append(length if length is not None and length > min_len else None)
+    return lengths
+
+
+@instrumentation.traced('graph')
+def have_played_together(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]) -> bool:
+    g = graph
+    i, j = g.index(player_id_1), g.index(player_id_2)
+    if i is None or j is None:
+        return False
+    return g.edge_team(i, j) is not None
+
+
+def _relationship(g: PlayedWithGraph, player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]
+                  ) -> t.Optional[t.Dict[str, int]]:
+    i, j = g.index(player_id_1), g.index(player_id_2)
+    if i is None or j is None:
+        return None
+    team_id = g.edge_team(i, j)
+    if team_id is None:
+        return None
+
+    return {'start': int(player_id_1), 'team': team_id, 'end': int(player_id_2)}
+
+
+@instrumentation.traced('graph')
+def get_relationship(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]) -> t.Optional[t.Dict[str, int]]:
+    return _relationship(graph, player_id_1, player_id_2)
+
+
+@instrumentation.traced('graph')
+def get_relationships(pairs: t.Sequence[t.Tuple[t.Union[str, int], t.Union[str, int]]]
+                      ) -> t.Optional[t.List[t.Optional[t.Dict[str, int]]]]:
+    g = graph
+    return [_relationship(g, p1, p2) for p1, p2 in pairs]
+
+
+def _distance_layer(g: PlayedWithGraph, target: int) -> bytearray:
+    entry = _layers.get(target)
+    # a layer computed on a graph that has been reloaded since is recomputed
+    if entry is None or entry[0] is not g:
+        entry = (g, g.distance_layer(target, SHORTEST_PATH_MAX_LENGTH))
+        _layers.set(target, entry)
+    return entry[1]
+
+
+@instrumentation.traced('graph')
+def next_hop(player_id: t.Union[str, int], target_id: t.Union[str, int]) -> t.Optional[t.Dict[str, int]]:
+    # the most valuable teammate of player_id one step closer to target_id, and the current distance
+    g = graph
+    i, j = g.index(player_id), g.index(target_id)
+    if i is None or j is None or i == j:
+        return None
+    layer = _distance_layer(g, j)
+    d = layer[i]
+    if d == LAYER_UNREACHABLE:
+        return None
+
+    values, neighbors = g.values, g.neighbors
+    best = None
+    for k in range(g.offsets[i], g.offsets[i + 1]):
+        if layer[neighbors[k]] == d - 1 and (best is None or values[neighbors[k]] > values[neighbors[best]]):
+            best = k
+    return {
+        'start': int(player_id), 'team': g.team_ids[best], 'end': g.node_ids[neighbors[best]], 'distance': d
+    }
+
+
+@instrumentation.traced('graph')
+def optimal_paths(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]
+                  ) -> t.Optional[t.List[t.List[t.Dict[str, int]]]]:
+    # every max weight shortest path, as relationships from player_id_1
+    g = graph
+    i, j = g.index(player_id_1), g.index(player_id_2)
+    if i is None or j is None:
+        return None
+
+    paths = [p for p in g.max_weight_shortest_paths(i, j, SHORTEST_PATH_MAX_LENGTH) if len(p) - 1 > 2]
+    return [g.path_relationships(p) for p in paths] or None
@@ -0,0 +1,279 @@
+import csv
+import datetime
+import hashlib
+import heapq
+import logging
+import os
+import time
+import typing as t
+
+import sqlalchemy
+from sqlalchemy import select, delete, update, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import model as m
+from app.utils import data_version, rankings
+
+logger = logging.getLogger()
+
+BATCH_SIZE = 5000
+# images are read in smaller batches to hash them
+IMAGE_BATCH_SIZE = 500
+COPY_BLOCK_SIZE = 1 << 20
+# parents first: loads follow this order. Seasonal tables are the ones an incremental refresh replaces
+TABLES = (m.League, m.LeagueSeasons, m.Team, m.TeamMilitancy, m.Player, m.Militancy)
+SEASONAL_TABLES = (m.LeagueSeasons, m.TeamMilitancy, m.Militancy)
+# rankings referencing a table's rows, dropped with them (and recomputed after every load)
+RANKINGS = ((m.Team, m.TeamRanking.team_id), (m.League, m.LeagueRanking.league_id))
+IMAGE_TABLES = (m.League, m.Team, m.Player)
+
+# (player_id_1, player_id_2, team_id) with player_id_1 < player_id_2
+Edge = t.Tuple[int, int, int]
+
+
+def derive_edges(militancies: t.Iterable[t.Tuple[int, int, t.Optional[datetime.date], t.Optional[datetime.date]]]
+                 ) -> t.List[Edge]:
+    # sort and sweep per team: spells are sorted by start date and every spell is paired with the spells still
+    # active when it starts, so the cost follows the number of edges instead of the square of the squad sizes.
+    # A pair that overlapped at several teams keeps the team of its latest overlap
+    spells: t.Dict[int, t.List[t.Tuple[datetime.date, datetime.date, int]]] = {}
+    for player_id, team_id, start_date, end_date in militancies:
+        # missing dates: the spell is open on that side
+        spells.setdefault(team_id, []).append(
+            (start_date or datetime.date.min, end_date or datetime.date.max, player_id))
+
+    edges: t.Dict[t.Tuple[int, int], t.Tuple[datetime.date, int]] = {}
+    for team_id, team_spells in spells.items():
+        team_spells.sort()
+        active: t.List[t.Tuple[datetime.date, int]] = []
+        for start_date, end_date, player_id in team_spells:
+            # a spell ending the day another one starts is a transfer, not an overlap
+            while active and active[0][0] <= start_date:
+                heapq.heappop(active)
+            for _, other_id in active:
+                if other_id == player_id:
+                    continue
+                pair = (other_id, player_id) if other_id < player_id else (player_id, other_id)
+                known = edges.get(pair)
+                if known is None or known[0] <= start_date:
+                    edges[pair] = (start_date, team_id)
+            heapq.heappush(active, (end_date, player_id))
+
+    return [(p1, p2, team_id) for (p1, p2), (_, team_id) in edges.items()]
+
+
+def read_militancies(team_ids: t.Optional[t.Collection[int]] = None
+                     ) -> t.Iterator[t.Tuple[int, int, t.Optional[datetime.date], t.Optional[datetime.date]]]:
+    query = select(m.Militancy.player_id, m.Militancy.team_id, m.Militancy.start_date, m.Militancy.end_date)
+    if team_ids is not None:
+        query = query.filter(m.Militancy.team_id.in_(team_ids))
+    with m.db.engine.connect() as conn:
+        yield from conn.execute(query.execution_options(yield_per=BATCH_SIZE))
+
+
+def image_hash(img: t.Optional[bytes]) -> t.Optional[str]:
+    return hashlib.md5(img).hexdigest() if img else None
+
+
+def hash_images(conn: sqlalchemy.Connection, table: sqlalchemy.Table, ids: t.Optional[sqlalchemy.Select] = None,
+                only_missing: bool = False) -> int:
+    # fills img_hash from img, for the rows of ids (all by default), by pages of ids
+    statement = update(table).where(table.c.id == bindparam('row_id')).values(img_hash=bindparam('row_hash'))
+    updated = 0
+    last_id = None
+    while True:
+        query = select(table.c.id, table.c.img).order_by(table.c.id).limit(IMAGE_BATCH_SIZE)
+        if ids is not None:
+            query = query.where(table.c.id.in_(ids))
+        if only_missing:
+            query = query.where(table.c.img_hash.is_(None), table.c.img.is_not(None))
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        rows = conn.execute(query).all()
+        if not rows:
+            return updated
+        conn.execute(statement, [{'row_id': row_id, 'row_hash': image_hash(img)} for row_id, img in rows])
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+
+def _parse(column: sqlalchemy.Column, value: str) -> t.Any:
+    # same text representation as a postgres CSV COPY
+    if value == '':
+        return None
+    if isinstance(column.type, sqlalchemy.Integer):
+        return int(value)
+    if isinstance(column.type, sqlalchemy.Float):
+        return float(value)
+    if isinstance(column.type, sqlalchemy.Date):
+        return datetime.date.fromisoformat(value)
+    if isinstance(column.type, sqlalchemy.LargeBinary):
+        return bytes.fromhex(value[2:]) if value.startswith('\\x') else value.encode()
+    return value
+
+
+def _stage(conn: sqlalchemy.Connection, table: sqlalchemy.Table, path: str) -> t.Tuple[sqlalchemy.Table, t.List[str]]:
+    # the CSV is loaded into a temporary copy of the table, merged by the caller
+    with open(path, newline='') as f:
+        columns = next(csv.reader(f))
+    unknown = set(columns) - set(table.c.keys())
+    if unknown:
+        raise ValueError(f'{path}: unknown columns {sorted(unknown)}')
+
+    staging = sqlalchemy.Table(f'staging_{table.name}', sqlalchemy.MetaData(),
+                               *(sqlalchemy.Column(c, table.c[c].type) for c in columns), prefixes=['TEMPORARY'])
+    staging.drop(conn, checkfirst=True)
+    staging.create(conn)
+
+    if conn.dialect.name == 'postgresql':
+        copy = f'COPY {staging.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER)'
+        with open(path, 'rb') as f:
+            cursor = conn.connection.cursor()
+            # psycopg 3 when SQL_PREPARED_STATEMENTS is set, psycopg2 otherwise
+            if conn.dialect.driver == 'psycopg':
+                with cursor.copy(copy) as copy_in:
+                    while block := f.read(COPY_BLOCK_SIZE):
+                        copy_in.write(block)
+            else:
+                cursor.copy_expert(copy, f)
+    else:
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            batch = []
+            for row in reader:
+                batch.append({c: _parse(table.c[c], row[c]) for c in columns})
+                if len(batch) >= BATCH_SIZE:
+                    conn.execute(staging.insert(), batch)
+                    batch = []
+            if batch:
+                conn.execute(staging.insert(), batch)
+    return staging, columns
+
+
+def _merge(conn: sqlalchemy.Connection, table: sqlalchemy.Table, staging: sqlalchemy.Table, columns: t.List[str],
+           season: t.Optional[int]) -> int:
+    # sqlite needs a WHERE clause to parse an upsert from a select
+    rows = select(*(staging.c[c] for c in columns)).where(sqlalchemy.true())
+    if season is not None and table in (model.__table__ for model in SEASONAL_TABLES):
+        # the season is replaced as a whole: spells that disappeared from the source disappear here too
+        conn.execute(delete(table).where(table.c.year == season))
+        rows = rows.where(staging.c.year == season)
+
+    insert = postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(table).from_select(columns, rows)
+    keys = [c.name for c in table.primary_key.columns]
+    updates = {c: statement.excluded[c] for c in columns if c not in keys}
+    statement = statement.on_conflict_do_update(index_elements=keys, set_=updates) if updates else \
+        statement.on_conflict_do_nothing(index_elements=keys)
+    return conn.execute(statement).rowcount
+
+
+def _prune(conn: sqlalchemy.Connection, table: sqlalchemy.Table, staging: sqlalchemy.Table) -> int:
+    # rows missing from a full load are removed, after the ones of their children
+    keys = [c.name for c in table.primary_key.columns]
+    if not set(keys).issubset(staging.c.keys()):
+        return 0
+    loaded = select(*(staging.c[k] for k in keys))
+    for model, column in RANKINGS:
+        if model.__table__ is table:
+            conn.execute(delete(column.table).where(column.not_in(loaded)))
+    return conn.execute(delete(table).where(sqlalchemy.tuple_(*(table.c[k] for k in keys)).not_in(loaded))).rowcount
+
+
+def load_sql(directory: str, season: t.Optional[int] = None) -> t.Dict[str, t.Tuple[int, int]]:
+    # one CSV per table, named after it and with a header of column names (bytea values in postgres hex format).
+    # Rows are upserted, then a full load removes the rows that are not in the files anymore and an incremental
+    # one replaces the rows of its season. Everything is committed in one transaction
+    res = {}
+    staged = []
+    with m.db.engine.begin() as conn:
+        for model in TABLES:
+            table = model.__table__
+            path = os.path.join(directory, f'{table.name}.csv')
+            if not os.path.exists(path):
+                continue
+            staging, columns = _stage(conn, table, path)
+            staged.append((table, staging))
+            res[table.name] = (_merge(conn, table, staging, columns, season), 0)
+            if model in IMAGE_TABLES and {'id', 'img'}.issubset(columns):
+                hash_images(conn, table, select(staging.c.id))
+
+        for table, staging in reversed(staged):
+            if season is None:
+                res[table.name] = (res[table.name][0], _prune(conn, table, staging))
+            staging.drop(conn)
+
+        if conn.dialect.name == 'postgresql':
+            conn.execute(sqlalchemy.text('ANALYZE'))
+    return res
+
+
+def _batches(rows: t.Sequence, size: int = BATCH_SIZE) -> t.Iterator[t.Sequence]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def load_graph(season: t.Optional[int] = None) -> t.Tuple[int, int]:
+    # Player nodes and PLAYED_WITH edges are merged in batches tagged with this load: every query keeps seeing a
+    # complete graph while it runs. A full load then removes what wasn't tagged; an incremental one only
+    # re-derives the edges of the teams of the season, and never removes any
+    from app.utils import neo4j_client
+
+    driver = neo4j_client.get_driver()
+    load_id = time.time_ns()
+    driver.execute_query('CREATE INDEX player_id IF NOT EXISTS FOR (p:Player) ON (p.playerId)')
+
+    with m.db.engine.connect() as conn:
+        players = conn.execute(select(m.Player.id, m.Player.value)).all()
+        team_ids = None
+        if season is not None:
+            team_ids = conn.execute(select(m.Militancy.team_id).where(m.Militancy.year == season).distinct()
+                                    ).scalars().all()
+
+    for batch in _batches(players):
+        driver.execute_query(
+            """
+            UNWIND $rows AS row
+            MERGE (p:Player {playerId: row[0]})
+            SET p.value = row[1], p.load_id = $load_id
+            """, rows=[(str(player_id), value or 0.0) for player_id, value in batch], load_id=load_id)
+
+    edges = derive_edges(read_militancies(team_ids))
+    for batch in _batches(edges):
+        driver.execute_query(
+            """
+            UNWIND $rows AS row
+            MATCH (start:Player {playerId: row[0]}), (end:Player {playerId: row[1]})
+            MERGE (start)-[r:PLAYED_WITH]-(end)
+            SET r.team_id = row[2], r.load_id = $load_id
+            """, rows=[(str(p1), str(p2), team_id) for p1, p2, team_id in batch], load_id=load_id)
+
+    if season is None:
+        for query in ('MATCH ()-[r:PLAYED_WITH]->() WHERE r.load_id IS NULL OR r.load_id <> $load_id '
+                      'WITH r LIMIT $limit DELETE r RETURN count(*) AS deleted',
+                      'MATCH (p:Player) WHERE p.load_id IS NULL OR p.load_id <> $load_id '
+                      'WITH p LIMIT $limit DETACH DELETE p RETURN count(*) AS deleted'):
+            while True:
+                records, _, _ = driver.execute_query(query, load_id=load_id, limit=BATCH_SIZE)
+                if not records or not records[0]['deleted']:
+                    break
+
+    return len(players), len(edges)
+
+
+def ingest(directory: t.Optional[str] = None, season: t.Optional[int] = None, graph: bool = True) -> int:
+    # SQL first, then the graph from the SQL data, then the version bump: workers only drop their caches (and
+    # reload the graph engine) once both stores hold the new data
+    start = time.perf_counter()
+    if directory:
+        counts = load_sql(directory, season)
+        logger.info(f'SQL data loaded in {time.perf_counter() - start:.2f}s', extra={
+            'rows': {table: {'upserted': upserted, 'removed': removed} for table, (upserted, removed) in counts.items()}
+        })
+    if graph:
+        players, edges = load_graph(season)
+        logger.info(f'Graph loaded in {time.perf_counter() - start:.2f}s: {players} players, {edges} edges')
+
+    rankings.refresh()
+    return data_version.bump()
+
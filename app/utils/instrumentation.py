@@ -0,0 +1,245 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+import typing as t
+
+from sqlalchemy import event
+
+from app import app_config
+
+logger = logging.getLogger()
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_THRESHOLD = app_config.get_slow_request_threshold()
+STATEMENT_PREVIEW_LENGTH = 200
+# queries issued outside of a request, e.g. by the challenge pool or the search index builder
+BACKGROUND = 'background'
+
+_enabled = False
+
+
+class RequestTrace:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        # (backend, statement, duration, rows)
+        self.queries: t.List[t.Tuple[str, str, float, int]] = []
+        self.token = None
+
+    def totals(self) -> t.Dict[str, t.Tuple[int, float, int]]:
+        res = {}
+        for backend, _, duration, rows in self.queries:
+            count, total, total_rows = res.get(backend, (0, 0.0, 0))
+            res[backend] = (count + 1, total + duration, total_rows + max(rows, 0))
+        return res
+
+    def server_timing(self, duration: float) -> str:
+        entries = [
+            f'{backend};dur={total * 1000:.1f};desc="{count} queries, {rows} rows"'
+            for backend, (count, total, rows) in self.totals().items()
+        ]
+        entries.append(f'total;dur={duration * 1000:.1f}')
+        return ', '.join(entries)
+
+
+_current: 'contextvars.ContextVar[t.Optional[RequestTrace]]' = contextvars.ContextVar('request_trace', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: t.Sequence[float] = DURATION_BUCKETS):
+        self.buckets = buckets
+        # labels -> per bucket counts, sum, count
+        self.values: t.Dict[t.Tuple, t.List] = {}
+
+    def observe(self, labels: t.Tuple, value: float):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (endpoint, method, status) -> count
+        self.requests: t.Dict[t.Tuple[str, str, str], int] = {}
+        self.request_duration = Histogram()
+        # (backend, endpoint) -> count, duration, rows
+        self.queries: t.Dict[t.Tuple[str, str], t.List] = {}
+        self.query_duration = Histogram()
+        self.slow_requests = 0
+
+    def observe_request(self, endpoint: str, method: str, status: int, duration: float, slow: bool = False):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_duration.observe((endpoint,), duration)
+            self.slow_requests += slow
+
+    def observe_query(self, backend: str, endpoint: str, duration: float, rows: int):
+        with self._lock:
+            entry = self.queries.get((backend, endpoint))
+            if entry is None:
+                entry = self.queries[(backend, endpoint)] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] += max(rows, 0)
+            self.query_duration.observe((backend,), duration)
+
+    def render(self) -> t.List[str]:
+        # prometheus text exposition format
+        with self._lock:
+            lines = ['# TYPE app_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'app_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            lines.extend(render_histogram('app_request_duration_seconds', ('endpoint',), self.request_duration))
+
+            for name, i in (('app_queries_total', 0), ('app_query_seconds_total', 1), ('app_query_rows_total', 2)):
+                lines.append(f'# TYPE {name} counter')
+                for (backend, endpoint), entry in sorted(self.queries.items()):
+                    lines.append(f'{name}{{backend="{backend}",endpoint="{endpoint}"}} {entry[i]}')
+            lines.extend(render_histogram('app_query_duration_seconds', ('backend',), self.query_duration))
+
+            lines.append('# TYPE app_slow_requests_total counter')
+            lines.append(f'app_slow_requests_total {self.slow_requests}')
+        return lines
+
+
+def render_histogram(name: str, label_names: t.Sequence[str], histogram: Histogram) -> t.List[str]:
+    lines = [f'# TYPE {name} histogram']
+    for labels, (counts, total, count) in sorted(histogram.values.items()):
+        label_str = ','.join(f'{k}="{v}"' for k, v in zip(label_names, labels))
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{label_str},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label_str},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{label_str}}} {total}')
+        lines.append(f'{name}_count{{{label_str}}} {count}')
+    return lines
+
+
+metrics = Metrics()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def record_query(backend: str, statement: str, duration: float, rows: int):
+    if not _enabled:
+        return
+    trace = _current.get()
+    if trace is not None:
+        trace.queries.append((backend, statement, duration, rows))
+    metrics.observe_query(backend, trace.endpoint if trace is not None else BACKGROUND, duration, rows)
+
+
+def traced(backend: str):
+    # for query functions that don't go through an instrumented client, e.g. the in-memory graph engine
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            res = func(*args, **kwargs)
+            rows = len(res) if isinstance(res, list) else 1
+            record_query(backend, func.__name__, time.perf_counter() - start, rows)
+            return res
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'instrumentation_start', None)
+    if start is not None:
+        record_query('sql', statement, time.perf_counter() - start, cursor.rowcount)
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def start(endpoint: str) -> t.Optional[RequestTrace]:
+    if not _enabled:
+        return None
+    trace = RequestTrace(endpoint)
+    trace.token = _current.set(trace)
+    return trace
+
+
+def finish(trace: RequestTrace, method: str, path: str, status: int) -> str:
+    # returns the Server-Timing header value
+    duration = time.perf_counter() - trace.start
+    try:
+        _current.reset(trace.token)
+    except ValueError:
+        # finished from another context (e.g. a teardown after a failed request)
+        _current.set(None)
+    slow = duration >= SLOW_REQUEST_THRESHOLD
+    metrics.observe_request(trace.endpoint, method, status, duration, slow)
+
+    if slow:
+        logger.warning(f'Slow request: {method} {path} took {duration * 1000:.1f}ms', extra={
+            'endpoint': trace.endpoint,
+            'status': status,
+            'totals': {
+                backend: {'count': count, 'duration_ms': round(total * 1000, 1), 'rows': rows}
+                for backend, (count, total, rows) in trace.totals().items()
+            },
+            'queries': [
+                {'backend': backend, 'duration_ms': round(d * 1000, 1), 'rows': rows,
+                 'statement': ' '.join(statement.split())[:STATEMENT_PREVIEW_LENGTH]}
+                for backend, statement, d, rows in trace.queries
+            ],
+        })
+
+    return trace.server_timing(duration)
+
+
+def init_app(flask_app):
+    import flask
+    from app import model as m
+
+    global _enabled
+    _enabled = True
+    with flask_app.app_context():
+        instrument_engine(m.db.engine)
+
+    @flask_app.before_request
+    def start_trace():
+        flask.g.trace = start(flask.request.endpoint or 'unmatched')
+
+    @flask_app.after_request
+    def finish_trace(response):
+        trace = flask.g.pop('trace', None)
+        if trace is None:
+            return response
+        if response.is_streamed:
+            # the body, and the queries it runs, comes after this: the trace stays current until the response is
+            # closed, and its timing only goes to the metrics (the headers are already sent by then)
+            method, path = flask.request.method, flask.request.path
+            response.call_on_close(lambda: finish(trace, method, path, response.status_code))
+        else:
+            response.headers['Server-Timing'] = finish(trace, flask.request.method, flask.request.path,
+                                                       response.status_code)
+        return response
+
+    @flask_app.teardown_request
+    def finish_failed_trace(exc):
+        # after_request doesn't run when the view raised
+        trace = flask.g.pop('trace', None)
+        if trace is not None:
+            finish(trace, flask.request.method, flask.request.path, 500)
@@ -0,0 +1,55 @@
+import time
+import typing as t
+import logging
+
+from neo4j import AsyncGraphDatabase
+
+from app import app_config
+from app.utils import neo4j_client, instrumentation
+
+logger = logging.getLogger()
+
+_driver = None
+
+
+def get_driver():
+    # created on first use, inside the event loop serving the requests
+    global _driver
+    if _driver is None:
+        _driver = AsyncGraphDatabase.driver(app_config.get_neo4j_uri(), **neo4j_client.driver_options())
+    return _driver
+
+
+async def execute_query(query: str, **parameters):
+    start = time.perf_counter()
+    records, summary, keys = await get_driver().execute_query(query, **parameters)
+    instrumentation.record_query('neo4j', query, time.perf_counter() - start, len(records))
+    return records, summary, keys
+
+
+async def close():
+    global _driver
+    if _driver is not None:
+        await _driver.close()
+        _driver = None
+
+
+async def get_relationships(pairs: t.Sequence[t.Tuple[t.Union[str, int], t.Union[str, int]]]
+                            ) -> t.Optional[t.List[t.Optional[t.Dict[str, int]]]]:
+    if not pairs:
+        return []
+
+    records, _, _ = await execute_query(
+        neo4j_client.GET_RELATIONSHIPS_QUERY, pairs=[[str(p1), str(p2)] for p1, p2 in pairs]
+    )
+
+    return neo4j_client.parse_relationships(pairs, records)
+
+
+async def shortest_path_ids(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int],
+                            cap: int = neo4j_client.SHORTEST_PATHS_CAP) -> t.List[t.Tuple[t.List[int], t.List[int]]]:
+    records, _, _ = await execute_query(
+        neo4j_client.SHORTEST_PATH_IDS_QUERY, start_id=str(player_id_1), end_id=str(player_id_2), cap=cap
+    )
+
+    return neo4j_client.parse_path_ids(records)
@@ -1,3 +1,6 @@
+import os
+import threading
+import time
 import typing as t
 import traceback
 import logging
@@ -5,13 +8,79 @@ import logging
 from neo4j import GraphDatabase
 
 from app import app_config
+from app.utils import instrumentation
 
-driver = GraphDatabase.driver(app_config.get_neo4j_uri(),
-                              auth=(app_config.get_neo4j_user(), app_config.get_neo4j_password()))
-driver.verify_connectivity()
+logger = logging.getLogger()
 
+_driver = None
+_lock = threading.Lock()
 
-logger = logging.getLogger()
+
+def driver_options() -> t.Dict[str, t.Any]:
+    return {
+        'auth': (app_config.get_neo4j_user(), app_config.get_neo4j_password()),
+        'max_connection_pool_size': app_config.get_neo4j_max_pool_size(),
+        'connection_acquisition_timeout': app_config.get_neo4j_connection_acquisition_timeout(),
+        'connection_timeout': app_config.get_neo4j_connection_timeout(),
+    }
+
+
+def get_driver():
+    # created on first use, so that importing this module (and booting a worker) doesn't need neo4j
+    global _driver
+    if _driver is None:
+        with _lock:
+            if _driver is None:
+                _driver = GraphDatabase.driver(app_config.get_neo4j_uri(), **driver_options())
+    return _driver
+
+
+def _reset_after_fork():
+    # connections opened before a fork belong to the parent: the child opens its own pool
+    global _driver, _lock
+    _driver = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def execute_query(query: str, **parameters):
+    start = time.perf_counter()
+    records, summary, keys = get_driver().execute_query(query, **parameters)
+    instrumentation.record_query('neo4j', query, time.perf_counter() - start, len(records))
+    return records, summary, keys
+
+
+def close():
+    global _driver
+    with _lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+
+def pool_state() -> t.Dict[str, t.Any]:
+    state = {
+        'created': _driver is not None,
+        'max_size': app_config.get_neo4j_max_pool_size(),
+        'acquisition_timeout': app_config.get_neo4j_connection_acquisition_timeout(),
+        'connections': {}
+    }
+    if _driver is None:
+        return state
+
+    try:
+        # not part of the public driver api: reported on a best effort basis
+        for address, connections in list(_driver._pool.connections.items()):
+            connections = list(connections)
+            state['connections'][str(address)] = {
+                'total': len(connections), 'in_use': sum(1 for c in connections if c.in_use)
+            }
+    except Exception as e:
+        logger.warning(f'Could not read neo4j pool state -> {e}')
+
+    return state
 
 
 def validate_path_for_challenge_creation(player_id_1: int, player_id_2: int, max_len: int, min_len=2) -> bool:
@@ -20,21 +89,67 @@ def validate_path_for_challenge_creation(player_id_1: int, player_id_2: int, max
         return False
 
     # checking if there's a path between the 2 of length between min and max len
-    records, _, _ = driver.execute_query(
-        """
+    records, _, _ = execute_query(
+        f"""
         OPTIONAL MATCH
-          (start:Player {playerId: $start_id}),
-          (end:Player {playerId: $end_id}),""" +
-        f'path = shortestPath((start)-[:PLAYED_WITH*..{max_len}]-(end))' +
-        """RETURN path IS NOT NULL AND length(path) > $min_len
+          (start:Player {{playerId: $start_id}}),
+          (end:Player {{playerId: $end_id}}),
+          path = shortestPath((start)-[:PLAYED_WITH*..{max_len}]-(end))
+        RETURN path IS NOT NULL AND length(path) > $min_len
         """, start_id=str(player_id_1), end_id=str(player_id_2), min_len=min_len
     )
 
     return records[0][0]
 
 
+def get_challenge_path_length(player_id_1: int, player_id_2: int, max_len: int, min_len=2) -> t.Optional[int]:
+    # same check as validate_path_for_challenge_creation in a single query: a shortest path longer than min_len
+    # already implies that the players have not played together
+    records, _, _ = execute_query(
+        f"""
+        OPTIONAL MATCH
+          (start:Player {{playerId: $start_id}}),
+          (end:Player {{playerId: $end_id}}),
+          path = shortestPath((start)-[:PLAYED_WITH*..{max_len}]-(end))
+        RETURN length(path)
+        """, start_id=str(player_id_1), end_id=str(player_id_2)
+    )
+
+    length = records[0][0] if records else None
+    if length is None or length <= min_len:
+        return None
+    return length
+
+
+def get_challenge_path_lengths(pairs: t.Sequence[t.Tuple[int, int]], max_len: int, min_len=2
+                               ) -> t.List[t.Optional[int]]:
+    # get_challenge_path_length for many pairs in one round trip: one entry per pair, in order
+    if not pairs:
+        return []
+
+    records, _, _ = execute_query(
+        f"""
+        UNWIND range(0, size($pairs) - 1) AS idx
+        WITH idx, $pairs[idx] AS pair
+        MATCH
+          (start:Player {{playerId: pair[0]}}),
+          (end:Player {{playerId: pair[1]}})
+        WHERE start <> end
+        OPTIONAL MATCH path = shortestPath((start)-[:PLAYED_WITH*..{max_len}]-(end))
+        RETURN idx, length(path) AS length
+        """, pairs=[[str(p1), str(p2)] for p1, p2 in pairs]
+    )
+
+    lengths = [None] * len(pairs)
+    for record in records:
+        length = record['length']
+        if length is not None and length > min_len:
+            lengths[record['idx']] = length
+    return lengths
+
+
 def have_played_together(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]) -> bool:
-    records, _, _ = driver.execute_query(
+    records, _, _ = execute_query(
         """
         MATCH
         (start:Player {playerId: $start_id}),
@@ -47,7 +162,7 @@ def have_played_together(player_id_1: t.Union[str, int], player_id_2: t.Union[st
 
 
 def get_relationship(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int]) -> t.Optional[t.Dict[str, int]]:
-    records, _, _ = driver.execute_query(
+    records, _, _ = execute_query(
         """
         MATCH
         (start:Player {playerId: $start_id}),
@@ -75,18 +190,90 @@ def get_relationship(player_id_1: t.Union[str, int], player_id_2: t.Union[str, i
         return None
 
 
-def shortest_path(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int], limit: int = 10
-                  ) -> t.Optional[t.List]:
-    records, _, _ = driver.execute_query(
-        """
-        MATCH
-          (start:Player {playerId: $start_id}),
-          (end:Player {playerId: $end_id}),
-          path = allShortestPaths((start)-[:PLAYED_WITH*..6]-(end))
-        WHERE length(path) > 2
-        RETURN path, reduce(weight = 0.0, n IN nodes(path) | weight + n.value) as weight
-        ORDER BY length(path) ASC, weight DESC LIMIT $limit
-        """, start_id=str(player_id_1), end_id=str(player_id_2), limit=limit
+GET_RELATIONSHIPS_QUERY = """
+    UNWIND range(0, size($pairs) - 1) AS idx
+    WITH idx, $pairs[idx] AS pair
+    OPTIONAL MATCH
+      (start:Player {playerId: pair[0]})-[r:PLAYED_WITH]-(end:Player {playerId: pair[1]})
+    WITH idx, collect(r)[0] AS r
+    RETURN idx, r.team_id AS team_id
+    ORDER BY idx
+    """
+
+NEXT_HOP_QUERY = """
+    MATCH
+      (start:Player {playerId: $start_id}),
+      (end:Player {playerId: $end_id}),
+      path = shortestPath((start)-[:PLAYED_WITH*..6]-(end))
+    WHERE start <> end
+    RETURN nodes(path)[1].playerId AS player_id, relationships(path)[0].team_id AS team_id, length(path) AS distance
+    """
+
+# every shortest path as plain ids, weighted in the app: no node property maps and no truncation to the top few
+SHORTEST_PATH_IDS_QUERY = """
+    MATCH
+      (start:Player {playerId: $start_id}),
+      (end:Player {playerId: $end_id}),
+      path = allShortestPaths((start)-[:PLAYED_WITH*..6]-(end))
+    WHERE length(path) > 2
+    RETURN [n IN nodes(path) | n.playerId] AS player_ids, [r IN relationships(path) | r.team_id] AS team_ids
+    LIMIT $cap
+    """
+SHORTEST_PATHS_CAP = 10000
+
+
+def parse_relationships(pairs: t.Sequence[t.Tuple[t.Union[str, int], t.Union[str, int]]], records: t.List
+                        ) -> t.Optional[t.List[t.Optional[t.Dict[str, int]]]]:
+    try:
+        return [
+            {'start': int(p1), 'team': int(record['team_id']), 'end': int(p2)}
+            if record['team_id'] is not None else None
+            for (p1, p2), record in zip(pairs, records)
+        ]
+    except Exception as e:
+        stack_trace = traceback.format_exc()
+        logger.error(f'Error while getting relationships -> {e}', extra={
+            'pairs': pairs, 'stacktrace': stack_trace
+        })
+        return None
+
+
+def parse_path_ids(records: t.List) -> t.List[t.Tuple[t.List[int], t.List[int]]]:
+    return [([int(i) for i in record['player_ids']], [int(i) for i in record['team_ids']]) for record in records]
+
+
+def get_relationships(pairs: t.Sequence[t.Tuple[t.Union[str, int], t.Union[str, int]]]
+                      ) -> t.Optional[t.List[t.Optional[t.Dict[str, int]]]]:
+    # one entry per pair, in order: None where the players have not played together
+    if not pairs:
+        return []
+
+    records, _, _ = execute_query(
+        GET_RELATIONSHIPS_QUERY, pairs=[[str(p1), str(p2)] for p1, p2 in pairs]
+    )
+
+    return parse_relationships(pairs, records)
+
+
+def next_hop(player_id: t.Union[str, int], target_id: t.Union[str, int]) -> t.Optional[t.Dict[str, int]]:
+    # first hop of a shortest path; the in-memory engine picks the most valuable of all the possible ones
+    records, _, _ = execute_query(
+        NEXT_HOP_QUERY, start_id=str(player_id), end_id=str(target_id)
+    )
+    if not records:
+        return None
+
+    return {
+        'start': int(player_id), 'team': int(records[0]['team_id']), 'end': int(records[0]['player_id']),
+        'distance': records[0]['distance']
+    }
+
+
+def shortest_path_ids(player_id_1: t.Union[str, int], player_id_2: t.Union[str, int], cap: int = SHORTEST_PATHS_CAP
+                      ) -> t.List[t.Tuple[t.List[int], t.List[int]]]:
+    # (player ids from player_id_1, team ids) of every shortest path
+    records, _, _ = execute_query(
+        SHORTEST_PATH_IDS_QUERY, start_id=str(player_id_1), end_id=str(player_id_2), cap=cap
     )
 
-    return records or None
+    return parse_path_ids(records)
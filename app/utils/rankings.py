@@ -0,0 +1,82 @@
+import logging
+import threading
+
+from sqlalchemy import func, select, tuple_, nullslast, delete, insert
+
+from app import model as m
+
+logger = logging.getLogger()
+
+
+def _create_tables():
+    m.TeamRanking.__table__.create(bind=m.db.engine, checkfirst=True)
+    m.LeagueRanking.__table__.create(bind=m.db.engine, checkfirst=True)
+
+
+def refresh():
+    # team value: sum of the values of the players in the team's latest season
+    # league value: sum of the values of the teams in the league's latest season
+    # ranks follow value DESC NULLS LAST, ties broken by id
+    _create_tables()
+
+    militancies = select(m.Militancy.team_id, m.Militancy.player_id).filter(
+        tuple_(m.Militancy.team_id, m.Militancy.year).in_(
+            select(m.Militancy.team_id, func.max(m.Militancy.year).label('max_year')).group_by(m.Militancy.team_id)
+        )).cte('militancies')
+    teams_by_value = select(m.Team.id.label('team_id'), func.sum(m.Player.value).label('team_value')
+                            ).join(militancies, m.Team.id == militancies.c.team_id, isouter=True
+                                   ).join(m.Player, militancies.c.player_id == m.Player.id, isouter=True
+                                          ).group_by(m.Team.id).cte('teams_by_value')
+    ranked_teams = select(teams_by_value.c.team_id, teams_by_value.c.team_value, func.row_number().over(
+        order_by=(nullslast(teams_by_value.c.team_value.desc()), teams_by_value.c.team_id)))
+
+    teammilitancies = select(m.TeamMilitancy.league_id, m.TeamMilitancy.team_id).filter(
+        tuple_(m.TeamMilitancy.league_id, m.TeamMilitancy.year).in_(
+            select(m.TeamMilitancy.league_id, func.max(m.TeamMilitancy.year).label('max_year')
+                   ).group_by(m.TeamMilitancy.league_id))).cte('teammilitancies')
+    leagues_by_value = select(m.League.id.label('league_id'), func.sum(m.TeamRanking.team_value).label('league_value')
+                              ).join(teammilitancies, m.League.id == teammilitancies.c.league_id, isouter=True
+                                     ).join(m.TeamRanking, teammilitancies.c.team_id == m.TeamRanking.team_id,
+                                            isouter=True).group_by(m.League.id).cte('leagues_by_value')
+    ranked_leagues = select(leagues_by_value.c.league_id, leagues_by_value.c.league_value, func.row_number().over(
+        order_by=(nullslast(leagues_by_value.c.league_value.desc()), leagues_by_value.c.league_id)))
+
+    # a single transaction: readers keep seeing the previous snapshot until commit
+    with m.db.engine.begin() as conn:
+        conn.execute(delete(m.LeagueRanking))
+        conn.execute(delete(m.TeamRanking))
+        conn.execute(insert(m.TeamRanking).from_select(['team_id', 'team_value', 'rank'], ranked_teams))
+        conn.execute(insert(m.LeagueRanking).from_select(['league_id', 'league_value', 'rank'], ranked_leagues))
+        teams = conn.execute(select(func.count()).select_from(m.TeamRanking)).scalar()
+        leagues = conn.execute(select(func.count()).select_from(m.LeagueRanking)).scalar()
+
+    logger.info(f'Rankings refreshed: {teams} teams, {leagues} leagues')
+    return teams, leagues
+
+
+def refresh_if_empty() -> bool:
+    # databases initialized before the ranking tables existed have them empty until a refresh, and every ranking
+    # join comes back empty meanwhile
+    _create_tables()
+    with m.db.engine.connect() as conn:
+        if conn.execute(select(m.TeamRanking.team_id).limit(1)).first() is not None:
+            return False
+    refresh()
+    return True
+
+
+def init_app(flask_app):
+    # at startup, in the background: the first requests don't wait for it
+    def run():
+        from app.utils import data_version
+
+        try:
+            with flask_app.app_context():
+                if refresh_if_empty():
+                    # workers may have cached the empty rankings
+                    data_version.bump()
+        except Exception as e:
+            # e.g. another worker filling them at the same time
+            logger.warning(f'Could not fill empty rankings -> {e}')
+
+    threading.Thread(target=run, name='rankings-fill', daemon=True).start()
@@ -0,0 +1,158 @@
+import base64
+import functools
+import logging
+import threading
+import typing as t
+from urllib.parse import urlencode
+
+import flask
+
+from app import app_config
+from app.utils import cache, compression, data_version, shared_store
+
+logger = logging.getLogger()
+
+MAX_AGE = app_config.get_http_cache_max_age()
+SHARED_TTL = app_config.get_response_cache_ttl()
+# larger bodies (e.g. a top-leagues page with a huge page_size) are served but not kept
+MAX_BODY_SIZE = 1 << 20
+# headers replayed with a cached body
+CACHED_HEADERS = ('Content-Type', 'X-Pagination', 'Content-Encoding')
+
+# (data version, route with sorted args, accepted encoding) -> body, headers; dropped on a version change, and
+# after the ttl of the shared copies
+_responses = cache.TTLCache(maxsize=app_config.get_response_cache_size(), ttl=SHARED_TTL)
+_lock = threading.Lock()
+_stats = {'hit': 0, 'shared_hit': 0, 'miss': 0, 'not_modified': 0}
+_enabled = False
+
+
+def _count(result: str):
+    with _lock:
+        _stats[result] += 1
+
+
+def stats() -> t.Dict[str, int]:
+    with _lock:
+        return dict(_stats, entries=len(_responses))
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def etag(version: int) -> str:
+    # every cached endpoint only depends on the dataset, so the data version is a valid tag for all of them
+    return f'dv{version}'
+
+
+def request_key(version: int) -> t.Tuple[int, str, t.Optional[str]]:
+    request = flask.request
+    route = request.path
+    if request.args:
+        route += '?' + urlencode(sorted(request.args.items(multi=True)))
+    encoding = compression.accepted_encoding() if compression.is_enabled() else None
+    return version, route, encoding
+
+
+def shared_key(key: t.Tuple[int, str, t.Optional[str]]) -> str:
+    version, route, encoding = key
+    return f'response:{version}:{encoding or "identity"}:{route}'
+
+
+def add_validators(response: flask.Response, version: int) -> flask.Response:
+    # weak: the representation depends on the negotiated encoding
+    response.set_etag(etag(version), weak=True)
+    response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    if compression.is_enabled():
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def _lookup(key) -> t.Optional[t.Tuple[bytes, t.List[t.Tuple[str, str]]]]:
+    hit = _responses.get(key)
+    if hit is not None:
+        _count('hit')
+        return hit
+
+    value = shared_store.get(shared_key(key))
+    if value is not None:
+        hit = base64.b64decode(value['body']), [tuple(h) for h in value['headers']]
+        _responses.set(key, hit)
+        _count('shared_hit')
+        return hit
+
+    _count('miss')
+    return None
+
+
+def store(key, body: bytes, headers: t.List[t.Tuple[str, str]]):
+    if len(body) > MAX_BODY_SIZE:
+        return
+    _responses.set(key, (body, headers))
+    shared_store.put(shared_key(key), {'body': base64.b64encode(body).decode(), 'headers': headers}, SHARED_TTL)
+
+
+def _tee_stream(chunks: t.Iterable[t.Union[bytes, str]], key, headers: t.List[t.Tuple[str, str]]
+                ) -> t.Iterator[bytes]:
+    body, size = [], 0
+    for chunk in chunks:
+        chunk = chunk.encode() if isinstance(chunk, str) else chunk
+        if body is not None:
+            body.append(chunk)
+            size += len(chunk)
+            if size > MAX_BODY_SIZE:
+                body = None
+        yield chunk
+    # only a stream that ran to completion is cached
+    if body is not None:
+        store(key, b''.join(body), headers)
+
+
+def cached(view):
+    # for views whose response only depends on the url and the data version
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return view(*args, **kwargs)
+
+        version = data_version.get()
+        if flask.request.if_none_match.contains_weak(etag(version)):
+            _count('not_modified')
+            return add_validators(flask.Response(status=304), version)
+
+        key = request_key(version)
+        hit = _lookup(key)
+        if hit is not None:
+            body, headers = hit
+            return add_validators(flask.Response(body, headers=headers), version)
+
+        flask.g.response_cache_key = key
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def skip():
+    # for a cached view whose response shouldn't be kept, e.g. one built by a fallback
+    flask.g.pop('response_cache_key', None)
+
+
+def store_response(response: flask.Response) -> flask.Response:
+    # runs after compression, so the encoded body is what gets kept
+    key = flask.g.pop('response_cache_key', None)
+    if key is None or response.status_code != 200:
+        return response
+
+    add_validators(response, key[0])
+    headers = [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+    if response.is_streamed:
+        response.response = _tee_stream(response.response, key, headers)
+    else:
+        store(key, response.get_data(), headers)
+    return response
+
+
+def init_app(flask_app):
+    global _enabled
+    _enabled = True
+    flask_app.after_request(store_response)
@@ -0,0 +1,133 @@
+import array
+import logging
+import os
+import threading
+import time
+import typing as t
+
+from sqlalchemy import select, nullslast
+from unidecode import unidecode
+
+from app import model as m
+from app.utils import cache
+
+logger = logging.getLogger()
+
+
+def normalize(text: str) -> str:
+    return unidecode(text).lower()
+
+
+def trigrams(text: str) -> t.Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PlayerSearchIndex:
+    """Trigram index over unidecoded, lowercased "surname name" strings.
+
+    Players are stored by decreasing value, and every posting list is sorted by that position, so the first
+    ``limit`` verified matches are the top-ranked ones.
+    """
+
+    def __init__(self, rows: t.Iterable[t.Tuple[int, t.Optional[str], t.Optional[str]]]):
+        self.player_ids = array.array('i')
+        self.names: t.List[str] = []
+        postings: t.Dict[str, t.List[int]] = {}
+        for position, (player_id, name, surname) in enumerate(rows):
+            full_name = normalize(f'{surname or ""} {name or ""}')
+            self.player_ids.append(player_id)
+            self.names.append(full_name)
+            for gram in trigrams(full_name):
+                postings.setdefault(gram, []).append(position)
+
+        self.postings = {gram: array.array('i', positions) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def search(self, query: str, limit: int = 5) -> t.List[int]:
+        query = normalize(query)
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        shortest = None
+        for gram in grams:
+            positions = self.postings.get(gram)
+            if positions is None:
+                return []
+            if shortest is None or len(positions) < len(shortest):
+                shortest = positions
+
+        res = []
+        names = self.names
+        for position in shortest:
+            if query in names[position]:
+                res.append(self.player_ids[position])
+                if len(res) >= limit:
+                    break
+        return res
+
+
+_index: t.Optional[PlayerSearchIndex] = None
+_lock = threading.Lock()
+_flask_app = None
+_building_pid = None
+_stale = False
+
+
+def build() -> PlayerSearchIndex:
+    rows = m.db.session.execute(
+        select(m.Player.id, m.Player.name, m.Player.surname).order_by(
+            nullslast(m.Player.value.desc()), m.Player.id)
+    ).all()
+    return PlayerSearchIndex(rows)
+
+
+def _build_in_background():
+    global _index, _building_pid, _stale
+    try:
+        while True:
+            start = time.perf_counter()
+            with _flask_app.app_context():
+                index = build()
+            with _lock:
+                _index = index
+                # a refresh requested while building needs another pass
+                rebuild = _stale
+                _stale = False
+            logger.info(f'Player search index built: {len(index)} players in {time.perf_counter() - start:.2f}s')
+            if not rebuild:
+                break
+    except Exception as e:
+        logger.error(f'Error while building player search index -> {e}')
+    finally:
+        with _lock:
+            _building_pid = None
+
+
+def refresh():
+    global _building_pid, _stale
+    if _flask_app is None:
+        return
+    pid = os.getpid()
+    with _lock:
+        if _building_pid == pid:
+            _stale = True
+            return
+        _building_pid = pid
+    threading.Thread(target=_build_in_background, name='player-search-index', daemon=True).start()
+
+
+def init_app(flask_app):
+    global _flask_app
+    _flask_app = flask_app
+    cache.on_invalidate(refresh)
+    refresh()
+
+
+def get() -> t.Optional[PlayerSearchIndex]:
+    # None until the first build completes: callers fall back to SQL
+    if _index is None and _flask_app is not None and _building_pid != os.getpid():
+        refresh()
+    return _index
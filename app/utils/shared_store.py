@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+
+from app import app_config
+
+logger = logging.getLogger()
+
+URL = app_config.get_shared_store_url()
+FILE_STORE_MAX_ENTRIES = app_config.get_shared_store_max_entries()
+# expired and excess entries of the file store are pruned every PRUNE_INTERVAL writes
+PRUNE_INTERVAL = 1000
+
+
+class FileStore:
+    """Key-value store in a sqlite file, shared by the workers of a host."""
+
+    def __init__(self, path: str, max_entries: int = FILE_STORE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS queue '
+                         '(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, value TEXT, expires_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_queue_key ON queue (key, id)')
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread and process: sqlite connections can't cross either
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> t.Any:
+        row = self._connection().execute(
+            'SELECT value FROM store WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: t.Any, ttl: t.Optional[float] = None):
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO store (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, json.dumps(value), time.time() + ttl if ttl else None))
+        self._writes += 1
+        if self._writes % PRUNE_INTERVAL == 0:
+            self.prune(conn)
+
+    def replace(self, key: str, expected: t.Any, value: t.Any, ttl: t.Optional[float] = None) -> bool:
+        cursor = self._connection().execute(
+            'UPDATE store SET value = ?, expires_at = ? WHERE key = ? AND value = ? '
+            'AND (expires_at IS NULL OR expires_at > ?)',
+            (json.dumps(value), time.time() + ttl if ttl else None, key, json.dumps(expected), time.time()))
+        return cursor.rowcount == 1
+
+    def prune(self, conn: sqlite3.Connection):
+        conn.execute('DELETE FROM store WHERE expires_at <= ?', (time.time(),))
+        conn.execute('DELETE FROM store WHERE rowid NOT IN (SELECT rowid FROM store ORDER BY rowid DESC LIMIT ?)',
+                     (self.max_entries,))
+        conn.execute('DELETE FROM queue WHERE expires_at <= ?', (time.time(),))
+
+    def push(self, key: str, values: t.List[t.Any], ttl: t.Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('INSERT INTO queue (key, value, expires_at) VALUES (?, ?, ?)',
+                             [(key, json.dumps(value), expires_at) for value in values])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._writes += len(values)
+        if self._writes % PRUNE_INTERVAL < len(values):
+            self.prune(conn)
+
+    def pop(self, key: str, count: int) -> t.List[t.Any]:
+        conn = self._connection()
+        # the write lock is taken before reading, so that concurrent pops never return the same values
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT id, value FROM queue WHERE key = ? AND (expires_at IS NULL OR expires_at > ?) '
+                                'ORDER BY id LIMIT ?', (key, time.time(), count)).fetchall()
+            if rows:
+                conn.execute(f'DELETE FROM queue WHERE id IN ({",".join("?" * len(rows))})', [r[0] for r in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [json.loads(r[1]) for r in rows]
+
+    def length(self, key: str) -> int:
+        return self._connection().execute(
+            'SELECT count(*) FROM queue WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)', (key, time.time())
+        ).fetchone()[0]
+
+
+# compare and set in one step: the value is only written if the key still holds the expected one
+REDIS_REPLACE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[3] == '0' then
+    redis.call('SET', KEYS[1], ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+"""
+
+
+class RedisStore:
+    def __init__(self, url: str):
+        # optional dependency: only needed when a redis url is configured
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._replace = self.client.register_script(REDIS_REPLACE_SCRIPT)
+
+    def get(self, key: str) -> t.Any:
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: t.Any, ttl: t.Optional[float] = None):
+        self.client.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def replace(self, key: str, expected: t.Any, value: t.Any, ttl: t.Optional[float] = None) -> bool:
+        return bool(self._replace(keys=[key], args=[json.dumps(expected), json.dumps(value), int(ttl) if ttl else 0]))
+
+    def push(self, key: str, values: t.List[t.Any], ttl: t.Optional[float] = None):
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, *(json.dumps(value) for value in values))
+        if ttl:
+            pipeline.expire(key, int(ttl))
+        pipeline.execute()
+
+    def pop(self, key: str, count: int) -> t.List[t.Any]:
+        return [json.loads(value) for value in self.client.lpop(key, count) or []]
+
+    def length(self, key: str) -> int:
+        return self.client.llen(key)
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def create(url: str):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisStore(url)
+    if url.startswith('file://'):
+        return FileStore(url[len('file://'):])
+    raise ValueError(f'Unsupported shared store url: {url}')
+
+
+def get_store():
+    # None when no store is configured (or it can't be created): callers only use their local caches
+    global _store, URL
+    if _store is None and URL:
+        with _lock:
+            if _store is None and URL:
+                try:
+                    _store = create(URL)
+                except Exception as e:
+                    logger.error(f'Could not create shared store, using local caches only -> {e}')
+                    URL = None
+    return _store
+
+
+def get(key: str) -> t.Any:
+    store = get_store()
+    if store is None:
+        return None
+    try:
+        return store.get(key)
+    except Exception as e:
+        logger.warning(f'Shared store read failed -> {e}', extra={'key': key})
+        return None
+
+
+def put(key: str, value: t.Any, ttl: t.Optional[float] = None):
+    store = get_store()
+    if store is None:
+        return
+    try:
+        store.set(key, value, ttl)
+    except Exception as e:
+        logger.warning(f'Shared store write failed -> {e}', extra={'key': key})
+
+
+def replace(key: str, expected: t.Any, value: t.Any, ttl: t.Optional[float] = None) -> bool:
+    # False when the key doesn't hold the expected value anymore (or the write failed): the caller reads it again
+    store = get_store()
+    if store is None:
+        return False
+    try:
+        return store.replace(key, expected, value, ttl)
+    except Exception as e:
+        logger.warning(f'Shared store write failed -> {e}', extra={'key': key})
+        return False
+
+
+def push(key: str, values: t.List[t.Any], ttl: t.Optional[float] = None):
+    # queues: values are popped in push order, each by a single consumer
+    store = get_store()
+    if store is None or not values:
+        return
+    try:
+        store.push(key, values, ttl)
+    except Exception as e:
+        logger.warning(f'Shared store push failed -> {e}', extra={'key': key})
+
+
+def pop(key: str, count: int = 1) -> t.List[t.Any]:
+    store = get_store()
+    if store is None:
+        return []
+    try:
+        return store.pop(key, count)
+    except Exception as e:
+        logger.warning(f'Shared store pop failed -> {e}', extra={'key': key})
+        return []
+
+
+def length(key: str) -> int:
+    store = get_store()
+    if store is None:
+        return 0
+    try:
+        return store.length(key)
+    except Exception as e:
+        logger.warning(f'Shared store read failed -> {e}', extra={'key': key})
+        return 0
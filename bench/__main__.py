@@ -0,0 +1,162 @@
+"""Benchmark and load-test harness for the game and entity endpoints.
+
+Seeds a dedicated database with synthetic data (every dataset table is wiped first) and measures each endpoint
+in-process through the Flask test client and, with --http-url, under concurrent load against a running server:
+
+    DB_USER=... DB_PASSWORD=... DB_NAME=football_bench python -m bench --seed --players 20000 --output run.json
+    python -m bench --http-url http://localhost:8080 --concurrency 16 --compare run.json
+
+--async-url runs the same load against the ASGI entry point (python -m app.asgi_starter, or uvicorn with
+--factory app.asgi_starter:create_app) to compare its tail latencies with the WSGI server of --http-url.
+
+--graph memory (default) serves the graph queries from graph_engine built from the synthetic edges, --graph neo4j
+seeds and queries the configured neo4j instance.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import typing as t
+from dataclasses import asdict
+
+from bench import datagen, runner
+
+logger = logging.getLogger()
+
+REGRESSION_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'sql_queries_per_request', 'graph_queries_per_request')
+
+
+def parse_args(argv: t.List[str]) -> argparse.Namespace:
+    defaults = datagen.Scale()
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', help='wipe and seed the configured SQL database')
+    parser.add_argument('--graph', choices=('memory', 'neo4j'), default='memory')
+    parser.add_argument('--leagues', type=int, default=defaults.leagues)
+    parser.add_argument('--teams-per-league', type=int, default=defaults.teams_per_league)
+    parser.add_argument('--players', type=int, default=defaults.players)
+    parser.add_argument('--first-year', type=int, default=defaults.first_year)
+    parser.add_argument('--last-year', type=int, default=defaults.last_year)
+    parser.add_argument('--image-bytes', type=int, default=defaults.image_bytes)
+    parser.add_argument('--random-seed', type=int, default=defaults.seed)
+    parser.add_argument('--scenarios', nargs='*', help='only run these scenarios (default: all)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario (in-process)')
+    parser.add_argument('--http-url', help='also load test a running server, e.g. http://localhost:8080')
+    parser.add_argument('--async-url', help='also load test a running ASGI server, e.g. http://localhost:8081')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='previous results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative increase reported as a regression')
+    return parser.parse_args(argv)
+
+
+def git_commit() -> t.Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_app(args: argparse.Namespace, data: datagen.Dataset):
+    from app import factory
+    from bench import seed
+
+    if args.graph == 'memory':
+        # loaded below from the synthetic edges rather than from neo4j
+        os.environ['GRAPH_ENGINE_ENABLED'] = 'false'
+    flask_app = factory.create_app('bench')
+    with flask_app.app_context():
+        if args.seed:
+            seed.seed_sql(data)
+            if args.graph == 'neo4j':
+                seed.seed_neo4j(data)
+        if args.graph == 'memory':
+            seed.load_graph_engine(data)
+    return flask_app
+
+
+def compare(previous: t.Dict[str, t.Any], current: t.Dict[str, t.Any], threshold: float) -> t.List[str]:
+    regressions = []
+    for mode in ('in_process', 'http', 'http_async'):
+        for name, summary in current.get(mode, {}).items():
+            before = previous.get(mode, {}).get(name)
+            if not before:
+                continue
+            for metric in REGRESSION_METRICS:
+                old, new = before.get(metric), summary.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                line = f'{mode:10} {name:18} {metric:26} {old:>10} -> {new:>10} ({change:+.1%})'
+                print(line)
+                if change > threshold:
+                    regressions.append(line)
+    return regressions
+
+
+def main(argv: t.List[str]) -> int:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    scale = datagen.Scale(
+        leagues=args.leagues, teams_per_league=args.teams_per_league, players=args.players,
+        first_year=args.first_year, last_year=args.last_year, image_bytes=args.image_bytes, seed=args.random_seed
+    )
+    data = datagen.generate(scale)
+    logger.info(f'synthetic dataset: {data.summary()}')
+
+    scenarios = runner.build_scenarios(data, seed=args.random_seed)
+    if args.scenarios:
+        scenarios = [s for s in scenarios if s.name in args.scenarios]
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'graph': args.graph,
+            'scale': asdict(scale),
+            'dataset': data.summary(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'in_process': {},
+    }
+
+    flask_app = create_app(args, data)
+    for scenario in scenarios:
+        summary = runner.run_in_process(flask_app, scenario, args.requests, args.random_seed, args.warmup).summary()
+        results['in_process'][scenario.name] = summary
+        logger.info(f'in-process {scenario.name}: {summary}')
+
+    for mode, url in (('http', args.http_url), ('http_async', args.async_url)):
+        if not url:
+            continue
+        results[mode] = {}
+        for scenario in scenarios:
+            summary = runner.run_http(url.rstrip('/'), scenario, args.requests, args.concurrency,
+                                      args.random_seed).summary()
+            results[mode][scenario.name] = summary
+            logger.info(f'{mode} {scenario.name}: {summary}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.0%}:')
+            print('\n'.join(regressions))
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
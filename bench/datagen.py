@@ -0,0 +1,126 @@
+import datetime
+import hashlib
+import random
+import typing as t
+from dataclasses import dataclass, field
+
+SYLLABLES = ('ma', 'ri', 'lo', 'san', 'tè', 'vi', 'chè', 'gon', 'zá', 'bel', 'rö', 'dí', 'ka', 'mü', 'ne', 'os',
+             'ta', 'ñu', 'le', 'ar')
+COUNTRIES = ('it', 'gb-eng', 'es', 'de', 'fr', 'pt', 'nl', 'br', 'ar', 'be')
+# 1x1 png, padded to the requested size so that payloads carry realistic image bytes
+PNG_HEADER = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15'
+              b'\xc4\x89')
+
+
+@dataclass
+class Scale:
+    leagues: int = 10
+    teams_per_league: int = 20
+    players: int = 20000
+    first_year: int = 2015
+    last_year: int = 2023
+    image_bytes: int = 2048
+    seed: int = 36
+
+
+@dataclass
+class Dataset:
+    scale: Scale
+    leagues: t.List[t.Dict[str, t.Any]] = field(default_factory=list)
+    league_seasons: t.List[t.Dict[str, t.Any]] = field(default_factory=list)
+    teams: t.List[t.Dict[str, t.Any]] = field(default_factory=list)
+    team_militancies: t.List[t.Dict[str, t.Any]] = field(default_factory=list)
+    players: t.List[t.Dict[str, t.Any]] = field(default_factory=list)
+    militancies: t.List[t.Dict[str, t.Any]] = field(default_factory=list)
+    # (player_id_1, player_id_2, team_id), one edge per pair of players
+    edges: t.List[t.Tuple[int, int, int]] = field(default_factory=list)
+
+    @property
+    def player_values(self) -> t.Dict[int, float]:
+        return {p['id']: p['value'] for p in self.players}
+
+    def summary(self) -> t.Dict[str, int]:
+        return {
+            'leagues': len(self.leagues), 'teams': len(self.teams), 'players': len(self.players),
+            'militancies': len(self.militancies), 'team_militancies': len(self.team_militancies),
+            'edges': len(self.edges)
+        }
+
+
+def _name(rng: random.Random, syllables: int) -> str:
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def _image(rng: random.Random, size: int) -> t.Optional[bytes]:
+    if size <= 0:
+        return None
+    return PNG_HEADER + rng.randbytes(max(size - len(PNG_HEADER), 0))
+
+
+def _with_image(rng: random.Random, size: int) -> t.Dict[str, t.Any]:
+    img = _image(rng, size)
+    # hashed like the ingestion does
+    return {'img': img, 'img_hash': hashlib.md5(img).hexdigest() if img else None, 'img_url': None}
+
+
+def generate(scale: Scale) -> Dataset:
+    rng = random.Random(scale.seed)
+    data = Dataset(scale=scale)
+    years = list(range(scale.first_year, scale.last_year + 1))
+
+    team_league = {}
+    for league_id in range(1, scale.leagues + 1):
+        data.leagues.append({
+            'id': league_id, 'display_name': f'{_name(rng, 2)} League', **_with_image(rng, scale.image_bytes),
+            'country_code': COUNTRIES[(league_id - 1) % len(COUNTRIES)]
+        })
+        for year in years:
+            data.league_seasons.append({
+                'league_id': league_id, 'year': year, 'start_date': datetime.date(year, 8, 1),
+                'end_date': datetime.date(year + 1, 6, 30)
+            })
+        for _ in range(scale.teams_per_league):
+            team_id = len(data.teams) + 1
+            team_league[team_id] = league_id
+            data.teams.append({
+                'id': team_id, 'name': f'{_name(rng, 3)} FC', **_with_image(rng, scale.image_bytes)
+            })
+            for year in years:
+                data.team_militancies.append({'team_id': team_id, 'league_id': league_id, 'year': year})
+
+    # heavy-tailed values: a few stars, many low value players
+    for player_id in range(1, scale.players + 1):
+        data.players.append({
+            'id': player_id, 'name': _name(rng, 2), 'surname': _name(rng, rng.randint(2, 4)),
+            **_with_image(rng, scale.image_bytes),
+            'value': round(min(rng.paretovariate(1.5) * 5, 200.0), 2)
+        })
+
+    # careers: a random span of seasons, staying at the same team with a fixed probability
+    squads: t.Dict[t.Tuple[int, int], t.List[int]] = {}
+    team_ids = list(team_league)
+    for player in data.players:
+        career = rng.randint(3, 12)
+        start = rng.randint(scale.first_year - career + 1, scale.last_year)
+        team_id = rng.choice(team_ids)
+        for year in range(max(start, scale.first_year), min(start + career, scale.last_year + 1)):
+            if rng.random() > 0.7:
+                team_id = rng.choice(team_ids)
+            squads.setdefault((team_id, year), []).append(player['id'])
+            data.militancies.append({
+                'player_id': player['id'], 'team_id': team_id, 'year': year,
+                'start_date': datetime.date(year, 8, 1), 'end_date': datetime.date(year + 1, 6, 30),
+                'appearences': rng.randint(0, 38)
+            })
+
+    seen = set()
+    for (team_id, _), squad in sorted(squads.items()):
+        for i in range(len(squad)):
+            for j in range(i + 1, len(squad)):
+                pair = (min(squad[i], squad[j]), max(squad[i], squad[j]))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                data.edges.append((pair[0], pair[1], team_id))
+
+    return data
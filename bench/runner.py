@@ -0,0 +1,233 @@
+import functools
+import random
+import threading
+import time
+import typing as t
+from dataclasses import dataclass, field
+
+import requests as http
+from sqlalchemy import event
+
+from app import model as m
+from app.utils import graph_engine, neo4j_client
+from bench.datagen import Dataset
+
+# graph calls made by the routes, one round trip each, in whichever of neo4j_client and graph_engine defines them
+GRAPH_QUERIES = ('validate_path_for_challenge_creation', 'get_challenge_path_length', 'get_challenge_path_lengths',
+                 'have_played_together', 'get_relationship', 'get_relationships', 'next_hop', 'shortest_path_ids',
+                 'optimal_paths')
+VALIDATE_PATHS = 200
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    json: t.Any = None
+
+
+@dataclass
+class Scenario:
+    name: str
+    make_request: t.Callable[[random.Random], Request]
+
+
+@dataclass
+class Measurement:
+    latencies: t.List[float] = field(default_factory=list)
+    errors: int = 0
+    sql_queries: int = 0
+    graph_queries: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> t.Dict[str, t.Any]:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        res = {
+            'requests': count,
+            'errors': self.errors,
+            'throughput_rps': round(count / self.elapsed, 2) if self.elapsed else None,
+        }
+        for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            res[f'{name}_ms'] = round(percentile(latencies, q) * 1000, 3) if count else None
+        res['mean_ms'] = round(sum(latencies) / count * 1000, 3) if count else None
+        if count:
+            res['sql_queries_per_request'] = round(self.sql_queries / count, 2)
+            res['graph_queries_per_request'] = round(self.graph_queries / count, 2)
+        return res
+
+
+def percentile(sorted_values: t.Sequence[float], q: float) -> float:
+    # nearest-rank percentile
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class QueryCounter:
+    """Counts SQL statements and graph calls issued by the current process."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sql = 0
+        self.graph = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = []
+
+    def _on_sql(self, *_):
+        with self._lock:
+            self.sql += 1
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # calls nested in another graph call (e.g. get_relationships -> get_relationship) aren't round trips
+            depth = getattr(self._local, 'depth', 0)
+            if not depth:
+                with self._lock:
+                    self.graph += 1
+            self._local.depth = depth + 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+        return wrapper
+
+    def install(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_sql)
+        for module in (neo4j_client, graph_engine):
+            for name in GRAPH_QUERIES:
+                func = getattr(module, name, None)
+                if func is None:
+                    continue
+                self._originals.append((module, name, func))
+                setattr(module, name, self._wrap(func))
+
+    def uninstall(self):
+        event.remove(self.engine, 'before_cursor_execute', self._on_sql)
+        for module, name, func in self._originals:
+            setattr(module, name, func)
+        self._originals.clear()
+
+    def snapshot(self) -> t.Tuple[int, int]:
+        with self._lock:
+            return self.sql, self.graph
+
+
+def sample_paths(data: Dataset, rng: random.Random, count: int = VALIDATE_PATHS) -> t.List[t.List[int]]:
+    # shortest paths between random players, as a player would submit them
+    graph = graph_engine.PlayedWithGraph.from_edges(data.player_values, data.edges)
+    paths = []
+    for _ in range(count * 20):
+        if len(paths) >= count:
+            break
+        i, j = rng.randrange(len(graph)), rng.randrange(len(graph))
+        found = graph.all_shortest_paths(i, j, graph_engine.SHORTEST_PATH_MAX_LENGTH, cap=1)
+        if found and 4 <= len(found[0]) <= 6:
+            paths.append([graph.node_ids[k] for k in found[0]])
+    return paths
+
+
+def build_scenarios(data: Dataset, seed: int) -> t.List[Scenario]:
+    rng = random.Random(seed)
+    league_ids = [league['id'] for league in data.leagues]
+    paths = sample_paths(data, rng)
+
+    def fragment(name: str, r: random.Random) -> str:
+        start = r.randrange(max(len(name) - 3, 1))
+        return name[start:start + r.randint(3, 5)]
+
+    def validate(r: random.Random) -> Request:
+        path = list(r.choice(paths))
+        if r.random() < 0.2:
+            # a broken chain: the response reports the missing edge
+            path[1] = r.choice(data.players)['id']
+            path = list(dict.fromkeys(path))
+        return Request('POST', '/api/game/challenge/validate', path)
+
+    scenarios = [
+        Scenario('challenge', lambda r: Request('GET', '/api/game/challenge')),
+        Scenario('challenge_leagues', lambda r: Request(
+            'GET', '/api/game/challenge?' + '&'.join(f'leagues={i}' for i in r.sample(league_ids, 2)))),
+        Scenario('player', lambda r: Request('GET', f'/api/entities/player/{r.choice(data.players)["id"]}')),
+        Scenario('player_search', lambda r: Request(
+            'GET', f'/api/entities/player/search/{fragment(r.choice(data.players)["surname"], r)}')),
+        Scenario('team_search', lambda r: Request(
+            'GET', f'/api/entities/team/search/{r.choice(data.teams)["name"][:3]}')),
+        Scenario('league_search', lambda r: Request(
+            'GET', f'/api/entities/league/search/{r.choice(data.leagues)["display_name"][:3]}')),
+        Scenario('top_leagues', lambda r: Request(
+            'GET', f'/api/entities/league/top-leagues?page_n={r.randint(1, 2)}&page_size=5')),
+        Scenario('hint', lambda r: Request(
+            'POST', '/api/game/hint', {'type': 'player_team', 'player_id': r.choice(data.militancies)['player_id']})),
+    ]
+    if paths:
+        scenarios.append(Scenario('validate', validate))
+    return scenarios
+
+
+def run_in_process(flask_app, scenario: Scenario, requests: int, seed: int, warmup: int = 0) -> Measurement:
+    rng = random.Random(seed)
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        counter = QueryCounter(m.db.engine)
+    measurement = Measurement()
+
+    for _ in range(warmup):
+        req = scenario.make_request(rng)
+        client.open(req.path, method=req.method, json=req.json)
+
+    counter.install()
+    try:
+        started = time.perf_counter()
+        for _ in range(requests):
+            req = scenario.make_request(rng)
+            start = time.perf_counter()
+            response = client.open(req.path, method=req.method, json=req.json)
+            response.get_data()
+            measurement.latencies.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                measurement.errors += 1
+        measurement.elapsed = time.perf_counter() - started
+        measurement.sql_queries, measurement.graph_queries = counter.snapshot()
+    finally:
+        counter.uninstall()
+
+    return measurement
+
+
+def run_http(base_url: str, scenario: Scenario, requests: int, concurrency: int, seed: int,
+             timeout: float = 30.0) -> Measurement:
+    measurement = Measurement()
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(worker_seed: int):
+        rng = random.Random(worker_seed)
+        with http.Session() as session:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                req = scenario.make_request(rng)
+                start = time.perf_counter()
+                try:
+                    response = session.request(req.method, base_url + req.path, json=req.json, timeout=timeout)
+                    failed = response.status_code >= 500
+                except http.RequestException:
+                    failed = True
+                latency = time.perf_counter() - start
+                with lock:
+                    measurement.latencies.append(latency)
+                    measurement.errors += failed
+
+    threads = [threading.Thread(target=worker, args=(seed + i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    measurement.elapsed = time.perf_counter() - started
+
+    return measurement
@@ -0,0 +1,80 @@
+import logging
+import time
+import typing as t
+
+from sqlalchemy import insert, text
+
+from app import model as m
+from app.utils import graph_engine, data_version, rankings
+from bench.datagen import Dataset
+
+logger = logging.getLogger()
+
+BATCH_SIZE = 5000
+
+# parents first: inserts follow this order, deletes the reverse one
+TABLES = (
+    (m.League, 'leagues'),
+    (m.LeagueSeasons, 'league_seasons'),
+    (m.Team, 'teams'),
+    (m.TeamMilitancy, 'team_militancies'),
+    (m.Player, 'players'),
+    (m.Militancy, 'militancies'),
+)
+
+
+def _batches(rows: t.Sequence, size: int = BATCH_SIZE) -> t.Iterator[t.Sequence]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def seed_sql(data: Dataset):
+    # wipes the dataset tables: only meant for a dedicated benchmark database
+    start = time.perf_counter()
+    m.db.create_all()
+    with m.db.engine.begin() as conn:
+        for model in (m.LeagueRanking, m.TeamRanking) + tuple(model for model, _ in reversed(TABLES)):
+            conn.execute(model.__table__.delete())
+        for model, attr in TABLES:
+            for batch in _batches(getattr(data, attr)):
+                conn.execute(insert(model.__table__), batch)
+        if m.db.engine.dialect.name == 'postgresql':
+            conn.execute(text('ANALYZE'))
+
+    rankings.refresh()
+    data_version.bump()
+    logger.info(f'SQL database seeded in {time.perf_counter() - start:.2f}s')
+
+
+def seed_neo4j(data: Dataset):
+    from app.utils import neo4j_client
+
+    start = time.perf_counter()
+    driver = neo4j_client.get_driver()
+    driver.execute_query('CREATE INDEX player_id IF NOT EXISTS FOR (p:Player) ON (p.playerId)')
+    while True:
+        records, _, _ = driver.execute_query(
+            'MATCH (p:Player) WITH p LIMIT 10000 DETACH DELETE p RETURN count(*) AS deleted')
+        if not records or not records[0]['deleted']:
+            break
+
+    for batch in _batches(data.players):
+        driver.execute_query(
+            'UNWIND $rows AS row CREATE (:Player {playerId: row.id, value: row.value})',
+            rows=[{'id': str(p['id']), 'value': p['value']} for p in batch])
+    for batch in _batches(data.edges):
+        driver.execute_query(
+            """
+            UNWIND $rows AS row
+            MATCH (start:Player {playerId: row[0]}), (end:Player {playerId: row[1]})
+            CREATE (start)-[:PLAYED_WITH {team_id: row[2]}]->(end)
+            """, rows=[(str(a), str(b), team_id) for a, b, team_id in batch])
+
+    logger.info(f'neo4j seeded in {time.perf_counter() - start:.2f}s')
+
+
+def load_graph_engine(data: Dataset):
+    # in-memory stand-in for neo4j: every graph query of the app is served by graph_engine
+    graph_engine.graph = graph_engine.PlayedWithGraph.from_edges(data.player_values, data.edges)
+    # in an app context: the graph is the data of the current version
+    graph_engine.graph_version = data_version.get()
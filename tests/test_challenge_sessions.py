@@ -0,0 +1,157 @@
+import collections
+
+import flask
+import pytest
+
+from app.routes import game, game_utils
+from app.utils import challenge_pool, challenge_sessions, common, data_version, graph_engine, shared_store
+
+# player -> teammates, with the team they played at
+TEAMMATES = {
+    1: {2: 10},
+    2: {1: 10, 3: 20},
+    3: {2: 20, 4: 30},
+    4: {3: 30},
+}
+
+
+class Graph:
+    @staticmethod
+    def get_relationship(player_id_1, player_id_2):
+        team = TEAMMATES.get(player_id_1, {}).get(player_id_2)
+        return None if team is None else {'start': player_id_1, 'team': team, 'end': player_id_2}
+
+
+def game_client(monkeypatch):
+    monkeypatch.setattr(game_utils, 'get_graph_client', lambda: Graph)
+    monkeypatch.setattr(common, 'get_pretty_players', lambda ids: {int(i): {'id': int(i), 'name': str(i)} for i in ids})
+    monkeypatch.setattr(common, 'get_pretty_teams', lambda ids: {int(i): {'id': int(i)} for i in ids})
+    flask_app = flask.Flask(__name__)
+    flask_app.register_blueprint(game.bp)
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def version(monkeypatch):
+    current = [1]
+    monkeypatch.setattr(data_version, 'get', lambda: current[0])
+    return current
+
+
+@pytest.fixture(params=['local', 'shared'])
+def client(request, tmp_path, monkeypatch, version):
+    store = shared_store.FileStore(str(tmp_path / 'store.db')) if request.param == 'shared' else None
+    monkeypatch.setattr(shared_store, 'get_store', lambda: store)
+    challenge_sessions._sessions.clear()
+    return game_client(monkeypatch)
+
+
+def hop(client, session_id, player_id):
+    return client.post(f'/api/game/challenge/session/{session_id}/hop', json={'player_id': player_id})
+
+
+def test_hops_and_undo(client):
+    session = challenge_sessions.create(1, 4, 3)
+
+    assert hop(client, session['id'], 2).json['hops'] == 1
+    response = hop(client, session['id'], 4)
+    assert not response.json['valid']
+    assert response.json['hops'] == 1
+
+    undone = client.delete(f'/api/game/challenge/session/{session["id"]}/hop')
+    assert undone.json['hops'] == 0
+    assert hop(client, session['id'], 2).json['hops'] == 1
+    assert hop(client, session['id'], 3).json['hops'] == 2
+    response = hop(client, session['id'], 4)
+    assert response.json['complete']
+    assert response.json['hop']['team'] == {'id': 30}
+
+    saved = challenge_sessions.get(session['id'])
+    assert [rel['end'] for rel in saved['path']] == [2, 3, 4]
+    assert saved['revision'] == 5
+
+
+@pytest.mark.parametrize('player_id', [1, 2])
+def test_hops_back_to_a_player_of_the_path_are_rejected(client, player_id):
+    session = challenge_sessions.create(1, 4, 3)
+    hop(client, session['id'], 2)
+    hop(client, session['id'], 3)
+
+    assert hop(client, session['id'], player_id).status_code == 400
+    assert len(challenge_sessions.get(session['id'])['path']) == 2
+
+
+def test_sessions_of_another_data_version_are_gone(client, version):
+    session = challenge_sessions.create(1, 4, 3)
+    version[0] = 2
+    assert hop(client, session['id'], 2).status_code == 404
+
+
+def test_shared_session_changed_by_every_other_call_is_a_conflict(tmp_path, monkeypatch, version):
+    store = shared_store.FileStore(str(tmp_path / 'store.db'))
+    monkeypatch.setattr(shared_store, 'get_store', lambda: store)
+    session = challenge_sessions.create(1, 4, 3)
+    # every write finds the session at another revision than the one it read
+    monkeypatch.setattr(shared_store, 'replace', lambda *args: False)
+
+    changes = []
+    with pytest.raises(challenge_sessions.ConflictError):
+        challenge_sessions.update(session['id'], lambda s: changes.append(s['path'].append({})))
+    assert len(changes) == challenge_sessions.UPDATE_ATTEMPTS
+
+    assert hop(game_client(monkeypatch), session['id'], 2).status_code == 409
+    assert challenge_sessions.get(session['id'])['revision'] == 0
+
+
+@pytest.fixture
+def pool(monkeypatch, version):
+    generated = []
+
+    def generate(leagues, count):
+        generated.append(count)
+        return [(1, 4, 3)] * count
+
+    monkeypatch.setattr(shared_store, 'get_store', lambda: None)
+    monkeypatch.setattr(challenge_pool, '_pools', collections.OrderedDict({(): collections.deque()}))
+    monkeypatch.setattr(challenge_pool, '_stalled', set())
+    monkeypatch.setattr(challenge_pool, '_flask_app', flask.Flask(__name__))
+    monkeypatch.setattr(challenge_pool, '_generate', generate)
+    monkeypatch.setattr(graph_engine, 'graph', None)
+    monkeypatch.setattr(graph_engine, 'graph_version', None)
+    return generated
+
+
+def test_pool_is_dropped_on_a_version_change(pool):
+    challenge_pool._refill(())
+    assert challenge_pool.stats()['depth'] == challenge_pool.HIGH_WATERMARK
+
+    generation = challenge_pool._generation
+    challenge_pool._clear()
+    assert challenge_pool._generation == generation + 1
+    assert challenge_pool.stats()['depth'] == 0
+
+
+def test_refill_started_before_a_version_change_is_dropped(pool, monkeypatch):
+    def generate(leagues, count):
+        challenge_pool._clear()
+        return [(1, 4, 3)] * count
+
+    monkeypatch.setattr(challenge_pool, '_generate', generate)
+    challenge_pool._refill(())
+    assert challenge_pool.stats()['depth'] == 0
+
+
+def test_refill_waits_for_the_graph_of_the_data_version(pool, monkeypatch, version):
+    monkeypatch.setattr(graph_engine, 'graph', object())
+    monkeypatch.setattr(graph_engine, 'graph_version', 1)
+    version[0] = 2
+
+    challenge_pool._refill(())
+    assert pool == []
+    assert challenge_pool.stats()['depth'] == 0
+    assert () not in challenge_pool._stalled
+
+    monkeypatch.setattr(graph_engine, 'graph_version', 2)
+    challenge_pool._refill(())
+    assert pool == [challenge_pool.HIGH_WATERMARK]
+    assert challenge_pool.stats()['depth'] == challenge_pool.HIGH_WATERMARK
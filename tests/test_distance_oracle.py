@@ -0,0 +1,106 @@
+import array
+import os
+import random
+
+import pytest
+
+from app.routes import game_utils
+from app.utils import distance_oracle, graph_engine
+from app.utils.graph_engine import PlayedWithGraph
+
+MAX_LEN = 6
+
+
+@pytest.fixture
+def graph():
+    rng = random.Random(7)
+    ids = list(range(1, 81))
+    values = {player_id: float(rng.randint(1, 50)) for player_id in ids}
+    # a chain through every player, so that all the distances show up, plus a few shortcuts
+    edges = [(a, a + 1, 1) for a in ids[:-1]] + [(rng.choice(ids), rng.choice(ids), 2) for _ in range(20)]
+    return PlayedWithGraph.from_edges(values, edges), values
+
+
+@pytest.fixture
+def matrix(graph):
+    g, values = graph
+    return distance_oracle.compute(g, list(values), MAX_LEN, 3, values)
+
+
+def test_distances_match_the_graph(graph, matrix):
+    g, values = graph
+    for p1 in list(values)[:20]:
+        for p2 in values:
+            length = g.shortest_path_length(g.index(p1), g.index(p2), MAX_LEN)
+            assert matrix.distance(p1, p2) == length
+
+
+def test_partners_match_the_distances(matrix):
+    for i, p1 in enumerate(matrix.player_ids):
+        expected = {}
+        for j, p2 in enumerate(matrix.player_ids):
+            d = matrix.distance(p1, p2)
+            if i != j and d is not None:
+                expected.setdefault(d, []).append(j)
+        assert {d: list(row) for d, row in matrix.partners(i).items()} == expected
+
+
+def test_file_round_trip(tmp_path, matrix):
+    path = str(tmp_path / 'distances-all.bin')
+    distance_oracle.save(matrix, path)
+
+    assert distance_oracle.read_data_version(path) == 3
+    loaded = distance_oracle.load(path)
+    assert loaded.data_version == 3
+    assert list(loaded.player_ids) == list(matrix.player_ids)
+    assert bytes(loaded.distances) == bytes(matrix.distances)
+    assert not os.path.exists(f'{path}.tmp')
+
+
+def test_truncated_and_foreign_files_are_rejected(tmp_path, matrix):
+    path = str(tmp_path / 'distances-all.bin')
+    distance_oracle.save(matrix, path)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    with open(path, 'wb') as f:
+        f.write(data[:-1])
+    with pytest.raises(ValueError, match='truncated'):
+        distance_oracle.load(path)
+
+    with open(path, 'wb') as f:
+        f.write(b'XXXX' + data[4:])
+    with pytest.raises(ValueError, match='not a distance oracle'):
+        distance_oracle.load(path)
+    with pytest.raises(ValueError, match='not a distance oracle'):
+        distance_oracle.read_data_version(path)
+
+
+@pytest.mark.parametrize('degrees', [2, 3, 4, 5])
+def test_challenge_pairs_at_a_difficulty(matrix, degrees):
+    candidates = game_utils.CandidateSet(list(matrix.player_ids), [1.0] * len(matrix))
+    pairs = game_utils.pick_challenge_pairs(candidates, 10, degrees=degrees, oracle=matrix)
+
+    assert len(pairs) == 10
+    assert len({frozenset(pair[:2]) for pair in pairs}) == 10
+    for p1, p2, pair_degrees in pairs:
+        assert pair_degrees == degrees
+        assert matrix.distance(p1, p2) == degrees + 1
+
+
+def test_no_build_on_a_graph_of_another_version(monkeypatch, graph):
+    g, values = graph
+    builds = []
+    monkeypatch.setattr(distance_oracle, 'DIRECTORY', None)
+    monkeypatch.setattr(distance_oracle, '_build_in_background', lambda *args: builds.append(args[3]))
+    monkeypatch.setattr(graph_engine, 'graph', g)
+    cum_weights = array.array('d', range(1, len(values) + 1))
+
+    # the graph of version 4 is still being loaded
+    monkeypatch.setattr(graph_engine, 'graph_version', 3)
+    assert distance_oracle.get(('stale',), list(values), cum_weights, MAX_LEN, 4) is None
+    assert builds == []
+
+    monkeypatch.setattr(graph_engine, 'graph_version', 4)
+    assert distance_oracle.get(('current',), list(values), cum_weights, MAX_LEN, 4) is None
+    assert builds == [4]
@@ -0,0 +1,46 @@
+from app.routes import game_utils
+
+
+class PathLengths:
+    # stands in for neo4j_client, whose shortestPath fails from a node to itself
+    def __init__(self, length):
+        self.length = length
+        self.pairs = []
+
+    def get_challenge_path_length(self, p1, p2, max_len):
+        assert p1 != p2
+        self.pairs.append((p1, p2))
+        return self.length
+
+
+def test_pick_challenge_pair_never_queries_a_player_with_itself(monkeypatch):
+    graph_client = PathLengths(4)
+    monkeypatch.setattr(game_utils, 'get_graph_client', lambda: graph_client)
+    # one player carries most of the weight: most samples draw it twice
+    candidates = game_utils.CandidateSet([1, 2], [10.0, 1.0])
+
+    for _ in range(50):
+        pair = game_utils.pick_challenge_pair(candidates, attempts=200)
+        assert pair is not None and pair[0] != pair[1] and pair[2] == 3
+
+
+def test_optimal_paths_of_a_graph_being_reloaded_are_not_cached(monkeypatch):
+    paths = [[{'start': 1, 'team': 10, 'end': 2}, {'start': 2, 'team': 11, 'end': 3}]]
+    stored = {}
+    monkeypatch.setattr(game_utils.graph_engine, 'graph', object())
+    monkeypatch.setattr(game_utils, 'optimal_paths', lambda *key: paths)
+    monkeypatch.setattr(game_utils.data_version, 'get', lambda: 4)
+    monkeypatch.setattr(game_utils.shared_store, 'get_store', lambda: object())
+    monkeypatch.setattr(game_utils.shared_store, 'get', stored.get)
+    monkeypatch.setattr(game_utils.shared_store, 'put', lambda key, value, ttl: stored.__setitem__(key, value))
+    game_utils._optimal_paths_cache.clear()
+
+    # the graph of version 4 is still being loaded: version 3 paths are served, not cached
+    monkeypatch.setattr(game_utils.graph_engine, 'graph_version', 3)
+    assert game_utils.get_optimal_path(1, 3) == paths[0]
+    assert game_utils._optimal_paths_cache.get((1, 3)) is None and not stored
+
+    monkeypatch.setattr(game_utils.graph_engine, 'graph_version', 4)
+    assert game_utils.get_optimal_path(3, 1) == game_utils.reverse_path(paths[0])
+    assert game_utils._optimal_paths_cache.get((1, 3)) == paths
+    assert stored == {'optimal-paths:4:1:3': paths}
@@ -0,0 +1,131 @@
+import itertools
+import random
+
+import pytest
+
+from app.utils import graph_engine
+from app.utils.graph_engine import PlayedWithGraph, LAYER_UNREACHABLE
+
+MAX_LEN = 6
+
+
+def random_graph(seed: int, players: int = 30, edges: int = 45):
+    rng = random.Random(seed)
+    ids = rng.sample(range(1, 1000), players)
+    values = {player_id: float(rng.randint(1, 20)) for player_id in ids}
+    edge_list = [(rng.choice(ids), rng.choice(ids), rng.randint(1, 5)) for _ in range(edges)]
+    return values, edge_list
+
+
+def adjacency(values, edges):
+    # player id -> {teammate id: lowest team id}, like the CSR build
+    adj = {player_id: {} for player_id in values}
+    for a, b, team_id in edges:
+        if a == b:
+            continue
+        for u, v in ((a, b), (b, a)):
+            adj.setdefault(u, {})
+            adj[u][v] = min(team_id, adj[u].get(v, team_id))
+    return adj
+
+
+def brute_force_paths(adj, source, target, max_len):
+    # every simple path of up to max_len edges between two players
+    paths = []
+
+    def walk(path):
+        if path[-1] == target:
+            paths.append(list(path))
+            return
+        if len(path) > max_len:
+            return
+        for v in adj[path[-1]]:
+            if v not in path:
+                path.append(v)
+                walk(path)
+                path.pop()
+
+    walk([source])
+    return paths
+
+
+SEEDS = range(8)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_csr_matches_edges(seed):
+    values, edges = random_graph(seed)
+    g = PlayedWithGraph.from_edges(values, edges)
+    adj = adjacency(values, edges)
+
+    assert list(g.node_ids) == sorted(adj)
+    assert g.edge_count == sum(len(n) for n in adj.values()) // 2
+    for i, player_id in enumerate(g.node_ids):
+        row = range(g.offsets[i], g.offsets[i + 1])
+        assert list(g.neighbors[row.start:row.stop]) == sorted(g.neighbors[k] for k in row)
+        assert {g.node_ids[g.neighbors[k]]: g.team_ids[k] for k in row} == adj[player_id]
+        assert g.values[i] == values.get(player_id, 0.0)
+    assert g.index(max(adj) + 1) is None
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_search_matches_brute_force(seed):
+    values, edges = random_graph(seed)
+    g = PlayedWithGraph.from_edges(values, edges)
+    adj = adjacency(values, edges)
+
+    for source, target in itertools.permutations(sorted(adj)[:12], 2):
+        i, j = g.index(source), g.index(target)
+        paths = brute_force_paths(adj, source, target, MAX_LEN)
+        shortest = min((len(p) - 1 for p in paths), default=None)
+
+        assert g.shortest_path_length(i, j, MAX_LEN) == shortest
+        if shortest is None:
+            assert g.max_weight_shortest_paths(i, j, MAX_LEN) == []
+            continue
+
+        candidates = [p for p in paths if len(p) - 1 == shortest]
+        weights = [sum(values[player_id] for player_id in path) for path in candidates]
+        expected = sorted(path for path, weight in zip(candidates, weights) if weight == max(weights))
+        found = sorted([g.node_ids[k] for k in path] for path in g.max_weight_shortest_paths(i, j, MAX_LEN))
+        assert found == expected
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_distance_layer_matches_bfs(seed):
+    values, edges = random_graph(seed)
+    g = PlayedWithGraph.from_edges(values, edges)
+    adj = adjacency(values, edges)
+
+    for max_len in (2, MAX_LEN):
+        for source in sorted(adj)[:10]:
+            dist = {source: 0}
+            frontier = [source]
+            for depth in range(1, max_len + 1):
+                next_frontier = []
+                for u in frontier:
+                    for v in adj[u]:
+                        if v not in dist:
+                            dist[v] = depth
+                            next_frontier.append(v)
+                frontier = next_frontier
+            layer = g.distance_layer(g.index(source), max_len)
+            assert {g.node_ids[k]: d for k, d in enumerate(layer) if d != LAYER_UNREACHABLE} == dist
+
+
+def test_module_functions_on_loaded_graph(monkeypatch):
+    # 1 - 2 - 3 - 4 - 5, and 1 - 6 - 7 - 5 through more valuable players
+    values = {1: 1.0, 2: 1.0, 3: 1.0, 4: 1.0, 5: 1.0, 6: 5.0, 7: 5.0}
+    edges = [(1, 2, 10), (2, 3, 10), (3, 4, 11), (4, 5, 11), (1, 6, 12), (6, 7, 12), (7, 5, 13)]
+    monkeypatch.setattr(graph_engine, 'graph', PlayedWithGraph.from_edges(values, edges))
+
+    assert graph_engine.get_challenge_path_length(1, 5, MAX_LEN) == 3
+    assert graph_engine.get_challenge_path_lengths([(1, 5), (1, 2), (1, 1)], MAX_LEN) == [3, None, None]
+    assert graph_engine.validate_path_for_challenge_creation(1, 5, MAX_LEN)
+    assert not graph_engine.validate_path_for_challenge_creation(1, 2, MAX_LEN)
+    assert graph_engine.get_relationship(3, 4) == {'start': 3, 'team': 11, 'end': 4}
+    assert graph_engine.get_relationship(1, 5) is None
+    assert graph_engine.optimal_paths(1, 5) == [
+        [{'start': 1, 'team': 12, 'end': 6}, {'start': 6, 'team': 12, 'end': 7}, {'start': 7, 'team': 13, 'end': 5}]
+    ]
+    assert graph_engine.next_hop(1, 5) == {'start': 1, 'team': 12, 'end': 6, 'distance': 3}
@@ -0,0 +1,104 @@
+import pytest
+
+from app.utils import graph_engine
+from app.utils.graph_engine import PlayedWithGraph
+
+
+@pytest.fixture
+def graph():
+    values = {1: 3.0, 2: 1.5, 3: 0.0, 5: 7.25, 8: 2.0}
+    edges = [(1, 2, 10), (2, 3, 10), (3, 5, 11), (5, 8, 12), (1, 8, 13), (2, 1, 14)]
+    return PlayedWithGraph.from_edges(values, edges)
+
+
+def assert_same_graph(a, b):
+    for name in ('node_ids', 'values', 'offsets', 'neighbors', 'team_ids'):
+        assert list(getattr(a, name)) == list(getattr(b, name)), name
+
+
+def test_round_trip(tmp_path, graph):
+    path = str(tmp_path / 'graph.bin')
+    graph_engine.save_snapshot(graph, path, 7)
+
+    loaded, version = graph_engine.load_snapshot(path)
+    assert version == 7
+    assert_same_graph(loaded, graph)
+    assert loaded.shortest_path_length(loaded.index(1), loaded.index(5), 6) == 2
+
+
+def test_truncated_snapshot(tmp_path, graph):
+    path = str(tmp_path / 'graph.bin')
+    graph_engine.save_snapshot(graph, path, 7)
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 4)
+
+    with pytest.raises(ValueError, match='truncated'):
+        graph_engine.load_snapshot(path)
+
+
+def test_wrong_magic(tmp_path, graph):
+    path = str(tmp_path / 'graph.bin')
+    graph_engine.save_snapshot(graph, path, 7)
+    with open(path, 'r+b') as f:
+        f.write(b'NOPE')
+
+    with pytest.raises(ValueError, match='not a graph snapshot'):
+        graph_engine.load_snapshot(path)
+
+
+@pytest.fixture
+def from_neo4j(monkeypatch, graph):
+    loads = []
+
+    def load_from_neo4j():
+        loads.append(1)
+        return graph
+
+    monkeypatch.setattr(graph_engine, 'load_from_neo4j', load_from_neo4j)
+    monkeypatch.setattr(graph_engine, 'graph', None)
+    monkeypatch.setattr(graph_engine, 'graph_version', None)
+    return loads
+
+
+def test_load_maps_the_snapshot_of_the_version(tmp_path, monkeypatch, graph, from_neo4j):
+    path = str(tmp_path / 'graph.bin')
+    graph_engine.save_snapshot(graph, path, 7)
+    monkeypatch.setattr(graph_engine, 'SNAPSHOT_PATH', path)
+
+    graph_engine.load(7)
+    assert not from_neo4j
+    assert graph_engine.graph_version == 7
+    assert_same_graph(graph_engine.graph, graph)
+
+
+@pytest.mark.parametrize('damage', ['other version', 'truncated', 'missing'])
+def test_load_falls_back_to_neo4j(tmp_path, monkeypatch, graph, from_neo4j, damage):
+    path = str(tmp_path / 'graph.bin')
+    if damage != 'missing':
+        graph_engine.save_snapshot(graph, path, 6 if damage == 'other version' else 7)
+    if damage == 'truncated':
+        with open(path, 'r+b') as f:
+            f.truncate(100)
+    monkeypatch.setattr(graph_engine, 'SNAPSHOT_PATH', path)
+
+    graph_engine.load(7)
+    assert from_neo4j == [1]
+    assert graph_engine.graph is graph and graph_engine.graph_version == 7
+
+
+def test_queries_stay_on_the_graph_they_started_on(monkeypatch, graph):
+    # a reload replacing the module graph right after the first lookup of a query
+    other = PlayedWithGraph.from_edges({100: 1.0, 101: 1.0}, [(100, 101, 1)])
+    index = graph.index
+
+    def reloaded_meanwhile(player_id):
+        monkeypatch.setattr(graph_engine, 'graph', other)
+        return index(player_id)
+
+    monkeypatch.setattr(graph, 'index', reloaded_meanwhile)
+    monkeypatch.setattr(graph_engine, 'graph', graph)
+    assert graph_engine.validate_path_for_challenge_creation(2, 5, 6, min_len=1)
+    monkeypatch.setattr(graph_engine, 'graph', graph)
+    assert graph_engine.get_relationship(3, 5) == {'start': 3, 'team': 11, 'end': 5}
+    monkeypatch.setattr(graph_engine, 'graph', graph)
+    assert graph_engine.next_hop(1, 5) == {'start': 1, 'team': 13, 'end': 8, 'distance': 2}
@@ -0,0 +1,70 @@
+import datetime
+import itertools
+import random
+
+import pytest
+
+from app.utils import ingestion
+
+DAY = datetime.date(2000, 1, 1)
+
+
+def random_militancies(seed: int, players: int = 40, teams: int = 6, spells: int = 120):
+    rng = random.Random(seed)
+    res = []
+    for _ in range(spells):
+        start = rng.randrange(0, 3000)
+        end = start + rng.randrange(1, 1500)
+        res.append((
+            rng.randrange(1, players + 1), rng.randrange(1, teams + 1),
+            # some open spells, and some ending the day others start
+            None if rng.random() < 0.05 else DAY + datetime.timedelta(days=start // 30 * 30),
+            None if rng.random() < 0.1 else DAY + datetime.timedelta(days=end // 30 * 30 + 30),
+        ))
+    return res
+
+
+def naive_overlaps(militancies):
+    # every pair of spells at the same team, compared directly: pair -> {team: start of its latest overlap}
+    res = {}
+    for (p1, t1, s1, e1), (p2, t2, s2, e2) in itertools.combinations(militancies, 2):
+        if t1 != t2 or p1 == p2:
+            continue
+        s1, s2 = s1 or datetime.date.min, s2 or datetime.date.min
+        e1, e2 = e1 or datetime.date.max, e2 or datetime.date.max
+        start = max(s1, s2)
+        if start < min(e1, e2):
+            overlaps = res.setdefault((min(p1, p2), max(p1, p2)), {})
+            overlaps[t1] = max(start, overlaps.get(t1, start))
+    return res
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_derive_edges_matches_a_pairwise_build(seed):
+    militancies = random_militancies(seed)
+    expected = naive_overlaps(militancies)
+
+    edges = ingestion.derive_edges(militancies)
+    assert len(edges) == len({(p1, p2) for p1, p2, _ in edges})
+    assert {(p1, p2) for p1, p2, _ in edges} == set(expected)
+    for p1, p2, team_id in edges:
+        assert p1 < p2
+        # the team of the latest overlap
+        overlaps = expected[(p1, p2)]
+        assert overlaps[team_id] == max(overlaps.values())
+
+
+def test_transfers_and_repeated_spells():
+    d = DAY.replace
+    militancies = [
+        (1, 10, d(year=2000), d(year=2002)),
+        # starts the day 1 leaves: a transfer, not an overlap
+        (2, 10, d(year=2002), d(year=2004)),
+        # the same player twice at a team doesn't pair with itself
+        (2, 10, d(year=2005), None),
+        (3, 10, None, d(year=2001)),
+        # 1 and 3 also overlapped later at team 20
+        (1, 20, d(year=2003), d(year=2006)),
+        (3, 20, d(year=2004), None),
+    ]
+    assert sorted(ingestion.derive_edges(militancies)) == [(1, 3, 20)]
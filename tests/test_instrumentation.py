@@ -0,0 +1,46 @@
+import flask
+import pytest
+
+from app import model as m
+from app.utils import instrumentation
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'metrics', instrumentation.Metrics())
+    monkeypatch.setattr(instrumentation, '_enabled', False)
+    flask_app = flask.Flask(__name__)
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "test.db"}'
+    m.db.init_app(flask_app)
+    instrumentation.init_app(flask_app)
+
+    @flask_app.route('/plain')
+    def plain():
+        instrumentation.record_query('sql', 'SELECT 1', 0.01, 1)
+        return 'ok'
+
+    @flask_app.route('/streamed')
+    def streamed():
+        def body():
+            # like a paginated query iterated while the response is sent
+            instrumentation.record_query('sql', 'SELECT 2', 0.01, 1)
+            yield '[]'
+        return flask.Response(flask.stream_with_context(body()))
+
+    return flask_app
+
+
+def test_plain_response_queries_are_in_the_server_timing(app):
+    response = app.test_client().get('/plain')
+    assert 'sql;dur=10.0;desc="1 queries, 1 rows"' in response.headers['Server-Timing']
+    assert instrumentation.metrics.queries == {('sql', 'plain'): [1, 0.01, 1]}
+
+
+def test_streamed_response_queries_count_for_the_request(app):
+    response = app.test_client().get('/streamed')
+    assert response.get_data() == b'[]'
+    response.close()
+
+    assert instrumentation.metrics.queries == {('sql', 'streamed'): [1, 0.01, 1]}
+    assert list(instrumentation.metrics.requests) == [('streamed', 'GET', '200')]
+    assert instrumentation._current.get() is None
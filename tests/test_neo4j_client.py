@@ -0,0 +1,91 @@
+import os
+import re
+
+import pytest
+
+from app.utils import neo4j_client
+
+# a neo4j to run the queries on, e.g. bolt://localhost:7687 (with NEO4J_USER and NEO4J_PASSWORD)
+NEO4J_TEST_URI = os.getenv('NEO4J_TEST_URI')
+
+CLAUSES = ('UNWIND', 'WITH', 'MATCH', 'WHERE', 'OPTIONAL MATCH', 'RETURN')
+
+
+class RecordingDriver:
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+
+    def execute_query(self, query, **parameters):
+        self.queries.append(query)
+        return self.records, None, None
+
+
+def assert_clauses_on_their_own_lines(query):
+    # a clause glued to the end of the previous line doesn't parse
+    assert not re.search(r'\S(OPTIONAL MATCH|MATCH|WHERE|RETURN)\b', query)
+    assert '[:PLAYED_WITH*..6]' in query
+
+
+def test_challenge_path_lengths_query_has_one_clause_per_line(monkeypatch):
+    driver = RecordingDriver([])
+    monkeypatch.setattr(neo4j_client, 'get_driver', lambda: driver)
+
+    assert neo4j_client.get_challenge_path_lengths([(1, 2), (3, 4)], max_len=6) == [None, None]
+
+    query, = driver.queries
+    lines = [line.strip() for line in query.splitlines()]
+    for clause in CLAUSES:
+        assert any(line.startswith(clause + ' ') or line == clause for line in lines), clause
+    assert_clauses_on_their_own_lines(query)
+
+
+@pytest.mark.parametrize('call, records, expected', [
+    (lambda: neo4j_client.get_challenge_path_length(1, 2, max_len=6), [[4]], 4),
+    (lambda: neo4j_client.validate_path_for_challenge_creation(1, 2, max_len=6), [[True]], True),
+])
+def test_path_length_queries_have_one_clause_per_line(monkeypatch, call, records, expected):
+    driver = RecordingDriver(records)
+    monkeypatch.setattr(neo4j_client, 'get_driver', lambda: driver)
+    monkeypatch.setattr(neo4j_client, 'have_played_together', lambda *_: False)
+
+    assert call() == expected
+    query, = driver.queries
+    assert re.search(r'\n\s*RETURN ', query)
+    assert_clauses_on_their_own_lines(query)
+
+
+@pytest.fixture
+def neo4j(monkeypatch):
+    if not NEO4J_TEST_URI:
+        pytest.skip('NEO4J_TEST_URI is not set')
+    monkeypatch.setenv('NEO4J_URI', NEO4J_TEST_URI)
+    neo4j_client.close()
+    # a chain of negative ids that can't collide with real players: -1 - -2 - -3 - -4, and -5 on its own
+    neo4j_client.execute_query(
+        """
+        UNWIND range(1, 5) AS i
+        CREATE (:Player {playerId: toString(-i)})
+        """)
+    neo4j_client.execute_query(
+        """
+        UNWIND range(1, 3) AS i
+        MATCH (a:Player {playerId: toString(-i)}), (b:Player {playerId: toString(-i - 1)})
+        CREATE (a)-[:PLAYED_WITH]->(b)
+        """)
+    yield
+    neo4j_client.execute_query(
+        """
+        MATCH (p:Player) WHERE p.playerId IN ['-1', '-2', '-3', '-4', '-5']
+        DETACH DELETE p
+        """)
+    neo4j_client.close()
+
+
+def test_challenge_path_lengths_runs(neo4j):
+    lengths = neo4j_client.get_challenge_path_lengths([(-1, -4), (-1, -2), (-1, -5), (-1, -4)], max_len=6, min_len=2)
+    assert lengths == [3, None, None, 3]
+    assert neo4j_client.get_challenge_path_length(-1, -4, max_len=6) == 3
+    assert neo4j_client.get_challenge_path_length(-1, -5, max_len=6) is None
+    assert neo4j_client.validate_path_for_challenge_creation(-1, -4, max_len=6)
+    assert not neo4j_client.validate_path_for_challenge_creation(-1, -2, max_len=6)
@@ -0,0 +1,42 @@
+import flask
+import pytest
+
+from app.utils import response_cache
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(response_cache, '_enabled', False)
+    monkeypatch.setattr(response_cache.data_version, 'get', lambda: 1)
+    monkeypatch.setattr(response_cache.shared_store, 'get_store', lambda: None)
+    response_cache._responses.clear()
+    flask_app = flask.Flask(__name__)
+    response_cache.init_app(flask_app)
+    flask_app.calls = []
+    flask_app.index_ready = False
+
+    @flask_app.route('/search/<query>')
+    @response_cache.cached
+    def search(query):
+        flask_app.calls.append(query)
+        if not flask_app.index_ready:
+            response_cache.skip()
+        return flask.jsonify([query, flask_app.index_ready])
+
+    return flask_app
+
+
+def test_fallback_responses_are_not_cached(app):
+    client = app.test_client()
+    assert client.get('/search/abc').json == ['abc', False]
+    assert client.get('/search/abc').json == ['abc', False]
+    assert app.calls == ['abc', 'abc']
+
+    app.index_ready = True
+    assert client.get('/search/abc').json == ['abc', True]
+    assert client.get('/search/abc').json == ['abc', True]
+    assert app.calls == ['abc', 'abc', 'abc']
+
+
+def test_local_entries_expire():
+    assert response_cache._responses.ttl == response_cache.SHARED_TTL